@@ -0,0 +1,100 @@
+# ========================================
+# bench_agent_latency.py — LATENCY/THROUGHPUT CỦA invoke_agent, agent_query VÀ REPORT STAGE (OFFLINE)
+# ========================================
+# Dùng FakeBedrockAgentRuntime nên kết quả lặp lại được (seed cố định), không cần mạng.
+# Chạy (cần boto3): python benchmarks/bench_agent_latency.py --ttfc 0.5 --chunk-rate 200 --throttle 0.05
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from local_pipeline.runner import load_lambda  # noqa: E402
+from drift_common.agent_cache import AgentResponseCache  # noqa: E402
+from drift_common.single_flight import SingleFlight  # noqa: E402
+from drift_common.rate_limiter import AdaptiveRateLimiter  # noqa: E402
+from local_pipeline.backends import fake_backend  # noqa: E402
+from local_pipeline.local_aws import LocalLambdaClient, LocalS3, LocalTable  # noqa: E402
+
+
+def detector_completion(items: int):
+    drifts = [{
+        "resource_address": f"aws_instance.web_{i}",
+        "issue": "instance_type mismatch",
+        "risk": "high",
+        "remediation_update_iac": 'Update instance_type = "t3.micro"',
+        "remediation_remove_source": "N/A",
+    } for i in range(items)]
+    return json.dumps({"detection_type": "normal", "drifted_resources": drifts, "summary": f"{items} drifts"})
+
+
+def measure(name, fn, calls, threads):
+    latencies = []
+
+    def one(_):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(one, range(calls)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))]
+    print(f"{name:<14}{calls:>7}{threads:>9}{statistics.median(latencies):>10.3f}{p95:>10.3f}{calls / elapsed:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--items", type=int, default=50, help="Số drift trong completion giả lập")
+    parser.add_argument("--ttfc", type=float, default=0.2)
+    parser.add_argument("--chunk-rate", type=float, default=500.0)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--throttle", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota-rps", type=float, default=None, help="Quota request/s của fake agent")
+    parser.add_argument("--rate", type=float, default=2.0, help="Rate ban đầu của limiter (req/s)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Chỉ retry throttling, không chờ token")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--single-flight", action="store_true", help="Gộp các lời gọi trùng prompt đang chạy")
+    args = parser.parse_args()
+
+    completion = detector_completion(args.items)
+    backend = fake_backend(
+        responder=lambda prompt: completion,
+        time_to_first_chunk=args.ttfc, chunks_per_sec=args.chunk_rate, chunk_size=args.chunk_size,
+        throttle_probability=args.throttle, error_probability=args.error_rate, quota_rps=args.quota_rps,
+        seed=args.seed,
+    )
+    rate_limiter = AdaptiveRateLimiter(rate=args.rate, enabled=not args.no_rate_limit)
+    detector = load_lambda("drift_detection_normal_lambda")
+    input_parser = load_lambda("input_parser_lambda")
+    report = load_lambda("drift-combined-report")
+    for module in (detector, input_parser, report):
+        module.bedrock = backend
+        module.rate_limiter = rate_limiter
+        # Không cache: đo round trip thật tới (fake) agent; --single-flight: các thread cùng prompt dùng chung 1 lời gọi
+        module.agent_cache = AgentResponseCache([], single_flight=SingleFlight() if args.single_flight else None)
+    report.s3, report.table, report.lambda_client = LocalS3(), LocalTable(), LocalLambdaClient()
+
+    print(f"completion: {len(completion)} bytes, ttfc={args.ttfc}s, {args.chunk_rate} chunk/s x {args.chunk_size} B")
+    print(f"{'stage':<14}{'calls':>7}{'threads':>9}{'p50 (s)':>10}{'p95 (s)':>10}{'calls/s':>12}")
+    measure("invoke_agent", lambda: detector.invoke_agent("bench prompt"), args.calls, args.threads)
+    measure("agent_query", lambda: input_parser.agent_query("bench prompt"), args.calls, args.threads)
+    # Report handler dùng biến global → chạy tuần tự
+    report_event = {"query": "cicd", "type": "cicd_log", "update_remediation": {}, "remove_remediation": {}}
+    measure("report", lambda: report.lambda_handler(report_event, None), max(1, args.calls // 10), 1)
+    print(f"fake agent stats: {backend.stats}")
+    print(f"rate limiter stats: {rate_limiter.stats}")
+
+
+if __name__ == "__main__":
+    main()
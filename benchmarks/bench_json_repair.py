@@ -0,0 +1,175 @@
+# ========================================
+# bench_json_repair.py — SO SÁNH extract_json_from_text CŨ vs drift_common.json_repair
+# ========================================
+# Chạy: python benchmarks/bench_json_repair.py [--sizes 10KB,1MB,20MB] [--skip-legacy-above 5MB]
+# Input giả lập output của detector (drifted_resources có "content" HCL), bản đầy đủ và bản bị cắt.
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "drift_common_layer", "python"))
+from drift_common.json_repair import extract_json_from_text  # noqa: E402
+
+SIZE_UNITS = {"KB": 1024, "MB": 1024 * 1024}
+
+
+def parse_size(value: str):
+    m = re.fullmatch(r"(\d+)(KB|MB)", value.strip().upper())
+    if not m:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+    return int(m.group(1)) * SIZE_UNITS[m.group(2)]
+
+
+def make_agent_output(size: int):
+    item = {
+        "resource_address": "module.app.aws_instance.web",
+        "issue": "instance_type mismatch",
+        "risk": "high",
+        "content": 'resource "aws_instance" "web" {\n  instance_type = "t3.micro"\n  tags = { Name = "web" }\n}',
+        "remediation_update_iac": 'Update instance_type = "t3.small"',
+        "remediation_remove_source": "N/A",
+    }
+    item_json = json.dumps(item)
+    count = max(1, size // (len(item_json) + 2))
+    body = ",\n".join([item_json] * count)
+    return f'Here is the report:\n```json\n{{"detection_type": "normal", "drifted_resources": [\n{body}\n], "summary": "{count} drifts"}}\n```'
+
+
+# === extract_json_from_text cũ (copy nguyên bản từ các lambda) ===
+def legacy_extract_json_from_text(text: str):
+    try:
+        print("=== [TRACE] START extract_json_from_text ===")
+        full_text = text.strip()
+        print(f"[TRACE] Raw : {full_text}")
+
+        # === B1: ƯU TIÊN TÌM JSON OBJECT { ... } ===
+        start_obj = full_text.find('{')
+        end_obj = full_text.rfind('}') + 1
+
+        if start_obj != -1 and end_obj > start_obj:
+            json_str = full_text[start_obj:end_obj]
+            is_array = False
+            print(f"[TRACE] Found JSON object: {len(json_str)} chars")
+        else:
+            # Nếu không có object, thử array
+            start_arr = full_text.find('[')
+            end_arr = full_text.rfind(']') + 1
+            if start_arr != -1 and end_arr > start_arr:
+                json_str = full_text[start_arr:end_arr]
+                is_array = True
+                print(f"[TRACE] Found JSON array: {len(json_str)} chars")
+            else:
+                print("[TRACE] No JSON found")
+                return {}
+
+        # === B2: Fix content bị cắt ===
+        fixed = ""
+        i = 0
+        in_content = False
+
+        while i < len(json_str):
+            if not in_content and json_str[i:i+10] == '"content":':
+                in_content = True
+                fixed += json_str[i:i+10]
+                i += 10
+                quote = json_str.find('"', i)
+                if quote == -1:
+                    fixed += ' ""'
+                    break
+                fixed += json_str[i:quote+1]
+                i = quote + 1
+                continue
+
+            if in_content and json_str[i] == '"' and json_str[i-1] != '\\':
+                next_part = json_str[i+1:i+5]
+                if any(x in next_part for x in [',', '}', '\n', '\r']):
+                    in_content = False
+            fixed += json_str[i]
+            i += 1
+
+        if in_content:
+            fixed += '"INCOMPLETE"'
+
+        json_str = fixed
+
+        # === B3: Dọn phẩy thừa + đóng ngoặc ===
+        json_str = re.sub(r',\s*([\]}])', r'\1', json_str)
+        json_str = re.sub(r',\s*$', '', json_str)
+
+        open_b = json_str.count('{')
+        close_b = json_str.count('}')
+        open_br = json_str.count('[')
+        close_br = json_str.count(']')
+
+        while open_b > close_b:
+            json_str += '}'
+            close_b += 1
+        while open_br > close_br:
+            json_str += ']'
+            close_br += 1
+
+        print(f"[TRACE] Final JSON: {json_str}")
+
+        # === B4: Parse ===
+        try:
+            data = json.loads(json_str)
+            if is_array:
+                print(f"[TRACE] Parsed array: {len(data)} items")
+                return data
+            else:
+                print(f"[TRACE] Parsed object: {list(data.keys())}")
+                return data
+        except json.JSONDecodeError as e:
+            print(f"[TRACE] JSON Error: {e}")
+            print(f"[TRACE] JSON string:\n{json_str[:600]}")
+            return {}  # Luôn trả object nếu là object
+
+    except Exception as e:
+        print(f"[TRACE] Exception: {e}")
+        return {}
+    finally:
+        print("=== [TRACE] END extract_json_from_text ===")
+
+
+def run_once(fn, text):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = fn(text)
+    return time.perf_counter() - start, data
+
+
+def item_count(data):
+    return len(data.get("drifted_resources", [])) if isinstance(data, dict) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10KB,1MB,20MB")
+    parser.add_argument("--skip-legacy-above", type=parse_size, default=parse_size("20MB"))
+    args = parser.parse_args()
+
+    print(f"{'input':<16}{'size':>10}{'legacy (s)':>14}{'items':>8}{'new (s)':>12}{'items':>8}{'speedup':>10}")
+    for label in args.sizes.split(","):
+        size = parse_size(label)
+        full = make_agent_output(size)
+        # Cắt giữa item cuối cùng giống khi agent bị dừng vì giới hạn token
+        truncated = full[: int(len(full) * 0.9)]
+        for name, text in (("full", full), ("truncated", truncated)):
+            new_time, new_data = run_once(extract_json_from_text, text)
+            if len(text) <= args.skip_legacy_above:
+                legacy_time, legacy_data = run_once(legacy_extract_json_from_text, text)
+                legacy_col = f"{legacy_time:>14.3f}{item_count(legacy_data):>8}"
+                speedup = f"{legacy_time / new_time:>9.1f}x"
+            else:
+                legacy_col = f"{'skipped':>14}{'-':>8}"
+                speedup = f"{'-':>10}"
+            print(f"{label + ' ' + name:<16}{len(text):>10}{legacy_col}{new_time:>12.3f}{item_count(new_data):>8}{speedup}")
+
+
+if __name__ == "__main__":
+    main()
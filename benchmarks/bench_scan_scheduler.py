@@ -0,0 +1,118 @@
+# ========================================
+# bench_scan_scheduler.py — THỜI GIAN 1 CYCLE SCAN N REPO: CHUỖI ScanNextRepo vs SCAN SCHEDULER
+# ========================================
+# Mô phỏng sự kiện rời rạc với đồng hồ giả (không sleep): mỗi scan kéo dài ~ lognormal quanh --scan-min phút
+# (--spread lớn → vài monorepo rất lâu), một tỉ lệ scan bị treo (không bao giờ báo xong) → chỉ được lấy lại khi
+# lease hết hạn. Chạy 2 cycle: cycle 1 ghi lịch sử chi phí, số đo lấy ở cycle 2 (SEJF đã có lịch sử).
+# "mean done" = thời gian trung bình từ đầu cycle tới khi report của 1 repo xong (repo không đổi được dedup = 0).
+# --change-rate: tỉ lệ repo có IaC/AWS State đổi giữa 2 cycle (phần còn lại dùng lại report cũ, không scan).
+# Chạy: python benchmarks/bench_scan_scheduler.py --repos 400 --concurrency 1 4 8 16 --order oldest sejf
+import argparse
+import heapq
+import itertools
+import logging
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "drift_common_layer", "python"))
+from drift_common.scan_scheduler import DONE, FAILED, InMemoryRepoStore, ScanScheduler, is_active  # noqa: E402
+
+
+class SimClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate(repos: int, concurrency: int, order_by: str, scan_min: float, spread: float, stuck_rate: float,
+             lease_min: float, tick_min: float, aging: float, change_rate: float, seed: int):
+    rng = random.Random(seed)
+    sizes = {f"https://github.com/org/repo-{i}": scan_min * 60 * rng.lognormvariate(0, spread) for i in range(repos)}
+    clock = SimClock()
+    store = InMemoryRepoStore(sizes)
+    events, sequence = [], itertools.count()
+    stats = {}
+    # Phiên bản đầu vào của mỗi repo; fingerprint đổi khi repo/AWS State đổi
+    versions = dict.fromkeys(sizes, 0)
+
+    def start_scan(repo_url, lease_id):
+        stats["starts"] += 1
+        # Scan treo mà lease đã hết hạn không còn tính vào concurrency
+        stats["peak"] = max(stats["peak"], sum(1 for item in store.scan_repos() if is_active(item, clock.now)))
+        if rng.random() >= stuck_rate:
+            # Thời gian thật dao động quanh kích thước repo giữa các cycle
+            duration = sizes[repo_url] * rng.lognormvariate(0, 0.2)
+            heapq.heappush(events, (clock.now + duration, next(sequence), repo_url, lease_id))
+
+    # 1 scheduler → đếm lease là đủ, không cần slot store
+    scheduler = ScanScheduler(store, start_scan, concurrency, lease_sec=int(lease_min * 60), max_attempts=3,
+                              clock=clock, order_by=order_by, aging=aging,
+                              fingerprint=lambda repo_url: f"{repo_url}@{versions[repo_url]}")
+
+    def run_cycle():
+        stats.update(starts=0, peak=0, done=[])
+        start = clock.now
+        stats["skipped"] = len(scheduler.start_cycle()["skipped"])
+        stats["done"].extend([0.0] * stats["skipped"])
+        next_tick = start + tick_min * 60
+        while True:
+            if all(item["scanStatus"] in (DONE, FAILED) for item in store.scan_repos()):
+                break
+            if events and events[0][0] <= next_tick:
+                clock.now, _, repo_url, lease_id = heapq.heappop(events)
+                if scheduler.finish(repo_url, lease_id, report_url=f"{repo_url}/report"):
+                    stats["done"].append(clock.now - start)
+            else:
+                # EventBridge định kỳ: lấy lại lease hết hạn của scan bị treo
+                clock.now = next_tick
+                next_tick += tick_min * 60
+            scheduler.fill()
+        events.clear()
+        return clock.now - start
+
+    run_cycle()  # cycle 1: ghi lịch sử chi phí
+    clock.now += 3600
+    for repo_url in versions:
+        if rng.random() < change_rate:
+            versions[repo_url] += 1
+    elapsed = run_cycle()
+    failed = sum(1 for item in store.scan_repos() if item["scanStatus"] == FAILED)
+    mean_done = sum(stats["done"]) / max(1, len(stats["done"]))
+    return elapsed, mean_done, stats["starts"], stats["skipped"], stats["peak"], failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repos", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--order", nargs="+", default=["oldest", "sejf"], help="SCAN_ORDER cần so sánh")
+    parser.add_argument("--scan-min", type=float, default=3.0, help="Thời gian scan trung vị (phút)")
+    parser.add_argument("--spread", type=float, default=1.0, help="Độ lệch lognormal của kích thước repo")
+    parser.add_argument("--stuck-rate", type=float, default=0.01, help="Tỉ lệ scan bị treo")
+    parser.add_argument("--lease-min", type=float, default=60.0, help="SCAN_LEASE_SEC (phút)")
+    parser.add_argument("--tick-min", type=float, default=15.0, help="Chu kỳ EventBridge FillScanSlots (phút)")
+    parser.add_argument("--aging", type=float, default=1.0, help="SCAN_AGING_FACTOR")
+    parser.add_argument("--change-rate", type=float, default=1.0, help="Tỉ lệ repo đổi giữa 2 cycle")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    # Scan dài hơn lease ở cycle 1 → finish muộn bị từ chối (đúng thiết kế), không in cảnh báo
+    logging.getLogger("drift_common.scan_scheduler").setLevel(logging.ERROR)
+
+    print(f"{'concurrency':>12}{'order':>8}{'cycle (h)':>12}{'mean done (h)':>15}{'starts':>9}{'skipped':>9}"
+          f"{'peak':>7}{'failed':>8}")
+    for concurrency in args.concurrency:
+        for order_by in args.order:
+            elapsed, mean_done, starts, skipped, peak, failed = simulate(
+                args.repos, concurrency, order_by, args.scan_min, args.spread, args.stuck_rate, args.lease_min,
+                args.tick_min, args.aging, args.change_rate, args.seed)
+            print(f"{concurrency:>12}{order_by:>8}{elapsed / 3600:>12.2f}{mean_done / 3600:>15.2f}"
+                  f"{starts:>9}{skipped:>9}{peak:>7}{failed:>8}")
+    print(f"(lease={args.lease_min:.0f}m, stuck={args.stuck_rate:.0%}; concurrency 1 ~ chuỗi ScanNextRepo, "
+          f"trừ việc chuỗi cũ dừng hẳn khi 1 scan bị treo)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 # lambda_function.py
 import os
 import json
-import random
 import boto3
 import logging
 import time
 import re
+from functools import partial
 from boto3.dynamodb.conditions import Attr
 from datetime import datetime, timezone
-from botocore.exceptions import ClientError
+from drift_common.agent_cache import build_agent_cache, find_kb_fingerprint
+from drift_common.html_report import iter_report_pages, render_report_pages
+from drift_common.incremental import build_scan_cache
+from drift_common.json_repair import extract_json_from_text
+from drift_common.rate_limiter import build_rate_limiter, is_throttling
+from drift_common.report_builder import build_combined_report, normalize_agent_report
+from drift_common.s3_stream import GzipMultipartWriter
+from drift_common.scan_metrics import StageMeter, collect_scan_metrics, summarize_scan_metrics
+from drift_common.scan_scheduler import DynamoDBRepoStore, build_slot_store, release_scan
+from drift_common.short_circuit import load_short_circuit_policy, remediation_is_clean
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -25,8 +34,33 @@ sf = boto3.client("stepfunctions")
 STEP_FUNCTION_ARN = os.environ.get("STEP_FUNCTION_ARN", "arn:aws:states:us-east-1:933000400558:stateMachine:DriftReportAgentASL")
 lambda_client = boto3.client("lambda")
 LAMBDA_NAME = os.environ.get("LAMBDA_NAME", "iacScanOrchestrator")
+# "lease": trả lease trong repoSubscriptions rồi gọi scan scheduler fill slot; "chain": DONE + ScanNextRepo như cũ
+SCAN_SCHEDULER = os.environ.get("SCAN_SCHEDULER", "lease")
+SCHEDULER_LAMBDA_NAME = os.environ.get("SCHEDULER_LAMBDA_NAME", "iacScanScheduler")
+repo_store = DynamoDBRepoStore(table)
+scan_slots = build_slot_store()
+# Ghép 2 report remediation tại chỗ; "false" → agent ghép như cũ
+LOCAL_COMBINED_REPORT = os.environ.get("LOCAL_COMBINED_REPORT", "true").lower() == "true"
+# Agent chỉ viết đoạn narrative khi được yêu cầu (env hoặc event {"narrative": true})
+REPORT_NARRATIVE = os.environ.get("REPORT_NARRATIVE", "false").lower() == "true"
+# "template": HTML render tại chỗ (email-safe, không JS); "agent": agent viết HTML như cũ
+HTML_RENDERER = os.environ.get("HTML_RENDERER", "template")
+REPORT_PAGE_SIZE = int(os.environ.get("REPORT_PAGE_SIZE", "200"))
+# HTML được nén gzip trong lúc render và upload multipart từng part (Content-Encoding: gzip)
+REPORT_GZIP = os.environ.get("REPORT_GZIP", "true").lower() == "true"
+REPORT_PART_SIZE_MB = int(os.environ.get("REPORT_PART_SIZE_MB", "8"))
+# Không có suggestion nào → report "clean" dựng sẵn, không gọi agent (env SHORT_CIRCUIT)
+SHORT_CIRCUIT = load_short_circuit_policy()
+# HTML report clean đã render, theo (repo_prefix, ngày), sống qua các lần invoke warm
+CLEAN_PAGES = {}
 
 bedrock = boto3.client("bedrock-agent-runtime", region_name=REGION)
+# Cache theo prompt hash, sống qua các lần invoke warm (cấu hình qua env AGENT_CACHE_*)
+agent_cache = build_agent_cache()
+# Token bucket + AIMD dùng chung mọi stage (cấu hình qua env RATE_LIMIT_*)
+rate_limiter = build_rate_limiter()
+# Thời gian / token của stage; cùng số đo các stage trước được ghi vào lịch sử chi phí của repo
+meter = StageMeter()
 
 # PROMPT – ĐÃ LOẠI BỎ CÁC PLACEHOLDER KHÔNG CẦN
 PROMPT = """
@@ -90,6 +124,19 @@ STRICT INSTRUCTION:
 - The output must always be valid JSON following the specified schema.
 """
 
+# Narrative cho người đọc, dựa trên combined report đã ghép sẵn
+NARRATIVE_PROMPT = """
+You are an expert in Infrastructure as Code (IaC) drift analysis and remediation.
+Write a short human-readable narrative (at most 2 paragraphs) for the drift report below: what drifted, which
+resources are most at risk, and which remediation option (update IaC or remove source) fits each group best.
+Do not search the Knowledge Base and do not invent resources that are not in the report.
+
+Drift report:
+{report}
+
+Return plain text only.
+"""
+
 PROMPTT_GENERATE_HTML = """
 You are an AI Web Developer. Your task is to generate a single, self-contained HTML document for rendering in an landing page, based on user instructions and Data Drift Analysis Report.
 
@@ -132,7 +179,9 @@ results = {
     "update_remediation": None,
     "remove_remediation": None,
     "query": None,
-    "type": None
+    "type": None,
+    "narrative": None,
+    "lease_id": None
 }
 
 def now_utc():
@@ -153,13 +202,30 @@ def extract_detection(obj):
                 results["query"] = v
             elif k == "type":
                 results["type"] = v
+            elif k == "narrative":
+                results["narrative"] = v
+            elif k == "lease_id":
+                results["lease_id"] = v
             else:
                 extract_detection(v)
     elif isinstance(obj, list):
         for item in obj:
             extract_detection(item)
 
-def finish_one_repo(repo_url):
+def finish_one_repo(repo_url, scan_metrics=None, report_url=None, failed_detections=None):
+    if SCAN_SCHEDULER == "lease":
+        # Không có lease_id (execution cũ / chạy tay) → trả lease hiện tại của repo
+        summary = summarize_scan_metrics(scan_metrics or {})
+        logger.info(f"Scan metrics {repo_url}: {summary}")
+        # Detection lỗi → report thiếu, không để scheduler dùng lại cho lần scan sau
+        released = release_scan(repo_store, scan_slots, repo_url, results["lease_id"], summary=summary,
+                                report_url=report_url, failed_detections=failed_detections)
+        lambda_client.invoke(
+            FunctionName=SCHEDULER_LAMBDA_NAME,
+            InvocationType="Event",
+            Payload=json.dumps({"eventName": "FillScanSlots"})
+        )
+        return {"status": "completed" if released else "lease_lost", "repo": repo_url}
     table.update_item(
         Key={"repoUrl": repo_url},
         UpdateExpression="SET scanStatus = :done, lastScanAt = :t, updatedAt = :t",
@@ -173,7 +239,10 @@ def finish_one_repo(repo_url):
     return {"status": "completed", "repo": repo_url}
 
 def lambda_handler(event, context):
+    reset_results()
+    meter.reset()
     extract_detection(event)
+    agent_cache.set_kb_fingerprint(find_kb_fingerprint(event))
     print("print event", event)
     
     update_remediation = results["update_remediation"]
@@ -183,184 +252,166 @@ def lambda_handler(event, context):
     logger.info(f"remove_remediation: {remove_remediation}")
     # Tạo date
     current_date = now_utc()#time.strftime('%Y%m%d')
-    # Format prompt – chỉ dùng các key đã định nghĩa
-    prompt_formatted = PROMPT.format(
-        update_remediation=update_remediation,
-        remove_remediation=remove_remediation,
-        date=current_date
-    )
-    
-    logger.info(f"Prompt for combined report: {prompt_formatted}...")
-    
-    agent_output = invoke_agent(prompt_formatted)
-    logger.info(f"Agent raw output: {agent_output}...")
-    
-    parsed = extract_json_from_text(agent_output)
+    clean = "report" in SHORT_CIRCUIT and remediation_is_clean(update_remediation) and \
+        remediation_is_clean(remove_remediation)
+    if clean:
+        parsed = build_combined_report(None, None, current_date)
+        parsed["summary"] = "No drift detected"
+        logger.info("Short-circuit report: no remediation suggestions, using clean report")
+    elif LOCAL_COMBINED_REPORT:
+        parsed = build_combined_report(update_remediation, remove_remediation, current_date)
+        logger.info(f"Combined report built locally: {parsed['summary']}")
+        if REPORT_NARRATIVE or results["narrative"] is True:
+            add_narrative(parsed)
+    else:
+        parsed = combine_with_agent(update_remediation, remove_remediation, current_date)
+
+    failed = failed_detection_types(update_remediation, remove_remediation)
+    if failed and isinstance(parsed, dict):
+        # Detector lỗi → kết quả thiếu, không được báo "No drift detected"
+        parsed["failed_detections"] = failed
+        parsed["summary"] = f"{parsed.get('summary', '')} (incomplete: detection failed for {', '.join(failed)})"
+
     repo_prefix = "cicd_log"
+    repo_url = None
     query_type = results["type"]
     if query_type == "full_scan":
         query = results["query"].strip()
         repo_url = extract_repo_url(query)
         repo_prefix = repo_url.split("/")[-1]
         print(f"🔍 Query: {query}, Repo: {repo_url}")
-        finish_one_repo(repo_url)
     
     if not parsed:
         parsed = "Agent invoke error: An error occurred (throttlingException) when calling the InvokeAgent operation: Your request rate is too high. Reduce the frequency of requests. Check your Bedrock model invocation quotas to find the acceptable frequency." 
-    prompt_formatted = PROMPTT_GENERATE_HTML.format(
-        data=parsed
-    )
-    repo_prefix = "cicd_log"
-    logger.info(f"Gen HTML File: {prompt_formatted}...")
-    html_content = invoke_agent(prompt_formatted)
-    logger.info(f"Agent gen html_content raw output: {html_content}...")
-    # === Save HTML to S3 ===
     bucket_name = "html-ai-gen"
     now_time = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
     file_name = f"drift-{repo_prefix}-{now_time}.html"
-    s3.put_object(
-        Bucket=bucket_name,
-        Key=file_name,
-        Body=html_content.encode("utf-8"),
-        ContentType="text/html",
-        )
+    if clean:
+        html_pages = [[page] for page in clean_report_pages(parsed, repo_prefix, current_date)]
+    elif HTML_RENDERER == "agent":
+        html_pages = [[generate_html_with_agent(parsed)]]
+    else:
+        html_pages = iter_report_pages(
+            parsed, partial(page_file_names, file_name), title=f"IaC Drift Report - {repo_prefix}",
+            generated_at=current_date, page_size=REPORT_PAGE_SIZE)
+        logger.info(f"Rendering {len(html_pages)} HTML page(s) from template")
+    # === Save HTML to S3 ===
+    for page_name, chunks in zip(page_file_names(file_name, len(html_pages)), html_pages):
+        # Render → gzip → multipart upload theo từng đoạn, không giữ cả trang trong bộ nhớ
+        with GzipMultipartWriter(s3, bucket_name, page_name, content_type="text/html",
+                                 part_size=REPORT_PART_SIZE_MB * 1024 * 1024, compress=REPORT_GZIP) as writer:
+            writer.writelines(chunks)
     # URL public (S3 static website endpoint)
     website_url = f"http://{bucket_name}.s3-website-us-east-1.amazonaws.com/{file_name}"
     logger.info(f"✅ Uploaded to S3: {website_url}")
+    if repo_url:
+        promote_scan_cache(repo_prefix)
+        # Trả lease sau khi report đã lên S3: upload lỗi → lease hết hạn, scheduler scan lại
+        scan_metrics = collect_scan_metrics(event)
+        scan_metrics["report"] = meter.snapshot()
+        finish_one_repo(repo_url, scan_metrics, website_url, failed)
     return website_url
 
-# === INVOKE AGENT ===
-def invoke_agent(question: str, max_retries: int = 5):
-    full_output = ""
-    attempt = 0
-
-    while attempt < max_retries:
-        try:
-            response = bedrock.invoke_agent(
-                agentId=AGENT_ID,
-                agentAliasId=AGENT_ALIAS_ID,
-                sessionId=f"report-{int(time.time())}",
-                inputText=question
-            )
-
-            for event in response.get("completion", []):
-                chunk = event.get("chunk", {})
-                bytes_data = chunk.get("bytes")
-                if bytes_data:
-                    full_output += bytes_data.decode("utf-8")
-
-            # Nếu thành công, thoát khỏi vòng lặp retry
-            return full_output
-
-        except ClientError as e:
-            error_code = e.response["Error"]["Code"]
-
-            # Nếu là lỗi throttling thì backoff retry
-            if error_code in ["ThrottlingException", "throttlingException"]:
-                wait_time = (2 ** attempt) + random.uniform(0, 0.5)
-                logger.warning(
-                    f"Rate limit hit. Retry {attempt + 1}/{max_retries} after {wait_time:.1f}s..."
-                )
-                time.sleep(wait_time)
-                attempt += 1
-                continue
-            else:
-                logger.error(f"Agent invoke error: {str(e)}")
-                return f"Agent invoke error: {str(e)}"
-        except Exception as e:
-            logger.error(f"Agent invoke error: {str(e)}")
-            return f"Agent invoke error: {str(e)}"
-
-    # Nếu retry hết số lần mà vẫn lỗi throttling
-    logger.error("Max retries reached due to throttling.")
-    return "Agent invoke error: Max retries reached due to throttling."
-
-# === EXTRACT JSON ===
-def extract_json_from_text(text: str):
+def promote_scan_cache(repo_prefix):
+    # Report đã lên S3 → fingerprint resource của scan này thành baseline cho detection tăng dần lần sau
+    cache = build_scan_cache(s3, repo_prefix)
+    if cache is None:
+        return
     try:
-        print("=== [TRACE] START extract_json_from_text ===")
-        full_text = text.strip()
-        logger.info(f"[TRACE] Raw : {full_text}")
-
-        # === B1: ƯU TIÊN TÌM JSON OBJECT { ... } ===
-        start_obj = full_text.find('{')
-        end_obj = full_text.rfind('}') + 1
-
-        if start_obj != -1 and end_obj > start_obj:
-            json_str = full_text[start_obj:end_obj]
-            is_array = False
-            print(f"[TRACE] Found JSON object: {len(json_str)} chars")
-        else:
-            # Nếu không có object, thử array
-            start_arr = full_text.find('[')
-            end_arr = full_text.rfind(']') + 1
-            if start_arr != -1 and end_arr > start_arr:
-                json_str = full_text[start_arr:end_arr]
-                is_array = True
-                print(f"[TRACE] Found JSON array: {len(json_str)} chars")
-            else:
-                print("[TRACE] No JSON found")
-                return {}
-
-        # === B2: Fix content bị cắt ===
-        fixed = ""
-        i = 0
-        in_content = False
-
-        while i < len(json_str):
-            if not in_content and json_str[i:i+10] == '"content":':
-                in_content = True
-                fixed += json_str[i:i+10]
-                i += 10
-                quote = json_str.find('"', i)
-                if quote == -1:
-                    fixed += ' ""'
-                    break
-                fixed += json_str[i:quote+1]
-                i = quote + 1
-                continue
-
-            if in_content and json_str[i] == '"' and json_str[i-1] != '\\':
-                next_part = json_str[i+1:i+5]
-                if any(x in next_part for x in [',', '}', '\n', '\r']):
-                    in_content = False
-            fixed += json_str[i]
-            i += 1
-
-        if in_content:
-            fixed += '"INCOMPLETE"'
-
-        json_str = fixed
-
-        # === B3: Dọn phẩy thừa + đóng ngoặc ===
-        json_str = re.sub(r',\s*([\]}])', r'\1', json_str)
-        json_str = re.sub(r',\s*$', '', json_str)
-
-        open_b = json_str.count('{')
-        close_b = json_str.count('}')
-        open_br = json_str.count('[')
-        close_br = json_str.count(']')
-
-        while open_b > close_b:
-            json_str += '}'
-            close_b += 1
-        while open_br > close_br:
-            json_str += ']'
-            close_br += 1
-
-        print(f"[TRACE] Final JSON: {json_str}")
-
-        # === B4: Parse ===
-        try:
-            data = json.loads(json_str)
-            return data
-        except json.JSONDecodeError as e:
-            print(f"[TRACE] JSON Error: {e}")
-            print(f"[TRACE] JSON string:\n{json_str[:600]}")
-            return {}  # Luôn trả object nếu là object
+        cache.promote()
+    except Exception as e:
+        logger.warning(f"Could not promote scan cache for {repo_prefix}: {str(e)}")
+
+def failed_detection_types(*remediation_reports):
+    return sorted({t for report in remediation_reports if isinstance(report, dict)
+                   for t in report.get("failed_detections") or []})
+
+def page_file_names(file_name, pages):
+    # Trang 1 giữ tên cũ (URL trả về không đổi), trang sau: drift-...-p2.html
+    stem = file_name[:-len(".html")]
+    return [file_name] + [f"{stem}-p{i}.html" for i in range(2, pages + 1)]
+
+def clean_report_pages(parsed, repo_prefix, current_date):
+    key = (repo_prefix, current_date[:10])
+    if key not in CLEAN_PAGES:
+        if len(CLEAN_PAGES) >= 256:
+            CLEAN_PAGES.clear()
+        CLEAN_PAGES[key] = render_report_pages(parsed, lambda n: [], title=f"IaC Drift Report - {repo_prefix}",
+                                               generated_at=current_date[:10])
+    return CLEAN_PAGES[key]
+
+def generate_html_with_agent(parsed):
+    prompt_formatted = PROMPTT_GENERATE_HTML.format(
+        data=parsed
+    )
+    logger.info(f"Gen HTML File: {prompt_formatted}...")
+    html_content = invoke_agent(prompt_formatted, uses_kb=False)
+    logger.info(f"Agent gen html_content raw output: {html_content}...")
+    return html_content
+
+def reset_results():
+    # Lambda warm start giữ lại biến global → xóa kết quả của lần invoke trước
+    for key in results:
+        results[key] = None
+
+def combine_with_agent(update_remediation, remove_remediation, current_date):
+    # Format prompt – chỉ dùng các key đã định nghĩa
+    prompt_formatted = PROMPT.format(
+        update_remediation=update_remediation,
+        remove_remediation=remove_remediation,
+        date=current_date
+    )
+    
+    logger.info(f"Prompt for combined report: {prompt_formatted}...")
+    
+    agent_output = invoke_agent(prompt_formatted)
+    logger.info(f"Agent raw output: {agent_output}...")
+    # Agent theo schema PROMPT cũ (drifted_resources dạng list) → chuẩn hóa về dạng combined report để render
+    return normalize_agent_report(extract_json_from_text(agent_output), current_date)
+
+def add_narrative(report):
+    narrative = invoke_agent(NARRATIVE_PROMPT.format(report=json.dumps(report, ensure_ascii=False)), uses_kb=False)
+    if narrative and not narrative.startswith("Agent invoke error"):
+        report["narrative"] = narrative.strip()
+    else:
+        logger.warning(f"Narrative skipped: {narrative}")
 
+# === INVOKE AGENT ===
+def invoke_agent(question: str, max_retries: int = 5, uses_kb: bool = True):
+    # Lỗi được trả về dạng text "Agent invoke error: ..." → không cache
+    return agent_cache.get_or_call(
+        question, AGENT_ID, AGENT_ALIAS_ID,
+        lambda: invoke_agent_uncached(question, max_retries),
+        cacheable=lambda output: bool(output) and not output.startswith("Agent invoke error"),
+        uses_kb=uses_kb
+    )
+
+def invoke_agent_uncached(question: str, max_retries: int = 5):
+    def read_stream():
+        full_output = ""
+        response = bedrock.invoke_agent(
+            agentId=AGENT_ID,
+            agentAliasId=AGENT_ALIAS_ID,
+            sessionId=f"report-{int(time.time())}",
+            inputText=question
+        )
+
+        for event in response.get("completion", []):
+            chunk = event.get("chunk", {})
+            bytes_data = chunk.get("bytes")
+            if bytes_data:
+                full_output += bytes_data.decode("utf-8")
+        return full_output
+
+    try:
+        # Chờ token trước khi gửi prompt; throttling → giảm rate chung + backoff retry
+        full_output = rate_limiter.call(read_stream, max_retries=max_retries)
+        meter.add_call(question, full_output)
+        return full_output
     except Exception as e:
-        print(f"[TRACE] Exception: {e}")
-        return {}
-    finally:
-        print("=== [TRACE] END extract_json_from_text ===")
\ No newline at end of file
+        if is_throttling(e):
+            # Nếu retry hết số lần mà vẫn lỗi throttling
+            logger.error("Max retries reached due to throttling.")
+            return "Agent invoke error: Max retries reached due to throttling."
+        logger.error(f"Agent invoke error: {str(e)}")
+        return f"Agent invoke error: {str(e)}"
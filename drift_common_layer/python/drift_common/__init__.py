@@ -0,0 +1 @@
+# drift_common — code dùng chung cho các lambda (deploy dưới dạng Lambda layer, path /opt/python)
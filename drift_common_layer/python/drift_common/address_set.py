@@ -0,0 +1,87 @@
+# ========================================
+# address_set.py — TẬP ĐỊA CHỈ IaC CHO UNMANAGED DETECTOR (set chính xác, quá ngưỡng → Bloom filter)
+# ========================================
+# ≤ exact_limit địa chỉ: set chính xác. Vượt ngưỡng: chuyển hẳn sang Bloom filter (bộ nhớ cố định ~1.8 byte/địa chỉ
+# với error_rate 0.001), bỏ set. Bloom không có false negative; false positive (~error_rate) = resource unmanaged
+# bị coi là có trong IaC → bị bỏ sót, không bao giờ báo nhầm. Tỷ lệ ước lượng: estimated_error_rate (parser log lại).
+# Key = đường dẫn đầy đủ kể cả module (bỏ index, bỏ tiền tố "resource."): module.a.x.web ≠ module.b.x.web.
+import hashlib
+import math
+import re
+
+
+def address_key(address: str):
+    """`resource.aws_instance.web` → "aws_instance.web"; `module.x.aws_instance.web[0]` → "module.x.aws_instance.web"."""
+    normalized = re.sub(r"\[[^\]]*\]", "", address or "").strip()
+    if normalized.startswith("resource."):
+        normalized = normalized[len("resource."):]
+    return normalized
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: h1 + i*h2
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def estimated_error_rate(self, items: int):
+        return (1 - math.exp(-self.hashes * items / self.size)) ** self.hashes
+
+
+class AddressSet:
+    def __init__(self, exact_limit: int = 1_000_000, bloom_capacity: int = 10_000_000, error_rate: float = 0.001):
+        self.exact_limit = exact_limit
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        self.exact = set()
+        self.bloom = None
+        self.count = 0
+
+    @property
+    def bloom_enabled(self):
+        return self.bloom is not None
+
+    @property
+    def estimated_error_rate(self):
+        """Xác suất false positive hiện tại (0 khi còn dùng set chính xác)."""
+        return self.bloom.estimated_error_rate(self.count) if self.bloom is not None else 0.0
+
+    def add(self, address: str):
+        self.count += 1
+        key = address_key(address)
+        if self.bloom is not None:
+            self.bloom.add(key)
+            return
+        self.exact.add(key)
+        if len(self.exact) > self.exact_limit:
+            self._switch_to_bloom()
+
+    def _switch_to_bloom(self):
+        self.bloom = BloomFilter(max(self.bloom_capacity, 2 * len(self.exact)), self.error_rate)
+        for key in self.exact:
+            self.bloom.add(key)
+        # Chỉ giữ Bloom filter: bộ nhớ không tăng theo số địa chỉ nữa
+        self.exact = set()
+
+    def __contains__(self, address: str):
+        key = address_key(address)
+        if self.bloom is not None:
+            return key in self.bloom
+        return key in self.exact
+
+    def __len__(self):
+        return self.count
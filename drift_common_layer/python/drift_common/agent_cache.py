@@ -0,0 +1,272 @@
+# ========================================
+# agent_cache.py — CACHE OUTPUT CỦA BEDROCK AGENT THEO PROMPT HASH
+# ========================================
+# Key = prompt_hash(prompt, agent_id, alias_id, kb_fingerprint). 3 tầng, đọc lần lượt, hit ở tầng dưới được ghi ngược lên:
+#   1. memory : LRU trong process → sống qua các lần invoke warm của Lambda
+#   2. disk   : /tmp, LRU giới hạn theo dung lượng (giữ được tới khi execution environment bị thu hồi)
+#   3. shared : DynamoDB (dùng chung giữa các lambda / lần chạy), stand-in InMemoryStore khi local
+# Miss → gọi agent qua SingleFlight: các lời gọi cùng key đang chạy dùng chung 1 lần gọi (lease giữa các worker).
+# Prompt tham chiếu tới KB (vd. chỉ có repo URL) → câu trả lời phụ thuộc nội dung KB không nằm trong prompt:
+# key kèm kb_fingerprint (scan_fingerprint của KB, input parser tính và chuyển theo event "kb_fingerprint");
+# không có fingerprint → không đọc/ghi cache cho prompt đó (AGENT_CACHE_UNSCOPED_KB=true → hành vi cũ, chỉ TTL).
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from drift_common.kv_store import EXPIRES_AT, DynamoDBStore
+from drift_common.prompt_hash import prompt_hash
+from drift_common.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# DynamoDB item tối đa 400 KB
+MAX_SHARED_VALUE_BYTES = 350 * 1024
+KB_FINGERPRINT_KEY = "kb_fingerprint"
+
+
+def find_kb_fingerprint(obj):
+    """kb_fingerprint đầu tiên trong event (output của stage trước, kể cả nhánh Parallel)."""
+    if isinstance(obj, dict):
+        if isinstance(obj.get(KB_FINGERPRINT_KEY), str) and obj[KB_FINGERPRINT_KEY]:
+            return obj[KB_FINGERPRINT_KEY]
+        obj = list(obj.values())
+    if isinstance(obj, list):
+        for item in obj:
+            found = find_kb_fingerprint(item)
+            if found:
+                return found
+    return None
+
+
+class MemoryTier:
+    name = "memory"
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()     # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskTier:
+    name = "disk"
+
+    def __init__(self, directory: str = "/tmp/agent-cache", max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._sizes = None                # path -> bytes, thứ tự LRU (đọc từ thư mục lần đầu, theo mtime)
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _index(self):
+        if self._sizes is None:
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(".json"):
+                        stat = os.stat(os.path.join(root, name))
+                        files.append((stat.st_mtime, os.path.join(root, name), stat.st_size))
+            self._sizes = OrderedDict((path, size) for _, path, size in sorted(files))
+        return self._sizes
+
+    def _remove(self, path):
+        self._index().pop(path, None)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            if entry["expires_at"] <= time.time():
+                self._remove(path)
+                return None
+            if path in self._index():
+                self._sizes.move_to_end(path)
+        return entry["value"]
+
+    def put(self, key, value, expires_at):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        with self._lock:
+            sizes = self._index()
+            sizes[path] = size
+            sizes.move_to_end(path)
+            # /tmp của Lambda có giới hạn → bỏ entry ít dùng nhất tới khi dưới max_bytes
+            total = sum(sizes.values())
+            while total > self.max_bytes and len(sizes) > 1:
+                oldest = next(iter(sizes))
+                total -= sizes[oldest]
+                self._remove(oldest)
+
+
+class SharedTier:
+    name = "shared"
+
+    def __init__(self, store, key_prefix: str = "agent-cache#"):
+        self.store = store
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        item = self.store.get(self.key_prefix + key)
+        return item.get("value") if item else None
+
+    def put(self, key, value, expires_at):
+        if len(value.encode("utf-8")) > MAX_SHARED_VALUE_BYTES:
+            logger.info(f"[agent_cache] value too large for shared tier ({len(value)} chars), skip")
+            return
+        self.store.put(self.key_prefix + key, {
+            "value": value,
+            EXPIRES_AT: int(expires_at),
+            "sha256": hashlib.sha256(value.encode("utf-8")).hexdigest(),
+        })
+
+
+class AgentResponseCache:
+    def __init__(self, tiers, ttl_sec: int = 3600, single_flight=None, unscoped_kb: bool = False):
+        self.tiers = list(tiers)
+        self.ttl_sec = ttl_sec
+        self.single_flight = single_flight
+        self.unscoped_kb = unscoped_kb
+        self.kb_fingerprint = None
+        self._lock = threading.Lock()
+        self.metrics = {"hits": {t.name: 0 for t in self.tiers}, "misses": 0, "puts": 0, "errors": 0,
+                        "bypassed": 0}
+
+    def set_kb_fingerprint(self, kb_fingerprint):
+        # Gọi đầu mỗi lần invoke (warm start giữ fingerprint của lần trước)
+        self.kb_fingerprint = kb_fingerprint or None
+
+    def key(self, prompt: str, agent_id: str, agent_alias_id: str, kb_fingerprint: str = None):
+        return prompt_hash(prompt, agent_id, agent_alias_id, kb_fingerprint or "")
+
+    def get(self, key, count_miss: bool = True):
+        for index, tier in enumerate(self.tiers):
+            try:
+                value = tier.get(key)
+            except Exception as e:
+                self._count_error(tier, e)
+                continue
+            if value is not None:
+                self._count("hits", tier.name)
+                # Ghi ngược lên các tầng nhanh hơn
+                self._put_tiers(self.tiers[:index], key, value, time.time() + self.ttl_sec)
+                return value
+        if count_miss:
+            self._count("misses")
+        return None
+
+    def put(self, key, value):
+        self._count("puts")
+        self._put_tiers(self.tiers, key, value, time.time() + self.ttl_sec)
+
+    def get_or_call(self, prompt: str, agent_id: str, agent_alias_id: str, call, cacheable=bool, uses_kb: bool = True):
+        """Hit → trả về output đã cache (bỏ qua round trip tới agent); miss → call() rồi cache nếu cacheable(output).
+        uses_kb=False: prompt tự chứa đủ dữ liệu (không tra KB) → cache không cần kb_fingerprint."""
+        if not self.tiers and self.single_flight is None:
+            return call()
+        kb_fingerprint = self.kb_fingerprint if uses_kb else None
+        use_tiers = bool(self.tiers) and (not uses_kb or kb_fingerprint is not None or self.unscoped_kb)
+        if self.tiers and not use_tiers:
+            self._count("bypassed")
+        key = self.key(prompt, agent_id, agent_alias_id, kb_fingerprint)
+        cached = self.get(key) if use_tiers else None
+        if cached is not None:
+            logger.info(f"[agent_cache] hit {key[:12]} {self.metrics}")
+            return cached
+
+        def load():
+            output = call()
+            # Ghi cache trước khi trả lease để worker đang chờ đọc được
+            if use_tiers and cacheable(output):
+                self.put(key, output)
+            return output
+
+        if self.single_flight is None:
+            output = load()
+        else:
+            lookup = (lambda: self.get(key, count_miss=False)) if use_tiers else None
+            output = self.single_flight.do(key, load, lookup=lookup)
+        logger.info(f"[agent_cache] miss {key[:12]} {self.metrics}")
+        return output
+
+    def _put_tiers(self, tiers, key, value, expires_at):
+        for tier in tiers:
+            try:
+                tier.put(key, value, expires_at)
+            except Exception as e:
+                self._count_error(tier, e)
+
+    def _count(self, metric, tier_name=None):
+        with self._lock:
+            if tier_name:
+                self.metrics[metric][tier_name] += 1
+            else:
+                self.metrics[metric] += 1
+
+    def _count_error(self, tier, error):
+        logger.warning(f"[agent_cache] {tier.name} tier error: {error}")
+        self._count("errors")
+
+
+def build_agent_cache(shared_store=None):
+    """Cấu hình từ env:
+    AGENT_CACHE_ENABLED (true), AGENT_CACHE_TTL_SEC (3600), AGENT_CACHE_MAX_ENTRIES (256),
+    AGENT_CACHE_DIR (/tmp/agent-cache, rỗng = tắt), AGENT_CACHE_DIR_MAX_MB (256),
+    AGENT_CACHE_TABLE (bảng DynamoDB, rỗng = tắt), AGENT_CACHE_UNSCOPED_KB (false: prompt tra KB mà không có
+    kb_fingerprint thì không cache), AGENT_SINGLE_FLIGHT (true), AGENT_LEASE_TTL_SEC (300, 0 = không dùng lease).
+    """
+    single_flight = None
+    if os.environ.get("AGENT_SINGLE_FLIGHT", "true").lower() == "true":
+        single_flight = SingleFlight()
+    if os.environ.get("AGENT_CACHE_ENABLED", "true").lower() != "true":
+        return AgentResponseCache([], single_flight=single_flight)
+    tiers = [MemoryTier(int(os.environ.get("AGENT_CACHE_MAX_ENTRIES", "256")))]
+    cache_dir = os.environ.get("AGENT_CACHE_DIR", "/tmp/agent-cache")
+    if cache_dir:
+        tiers.append(DiskTier(cache_dir, int(float(os.environ.get("AGENT_CACHE_DIR_MAX_MB", "256")) * 1024 * 1024)))
+    table_name = os.environ.get("AGENT_CACHE_TABLE", "")
+    if shared_store is None and table_name:
+        shared_store = DynamoDBStore.from_table_name(table_name)
+    if shared_store is not None:
+        tiers.append(SharedTier(shared_store))
+        lease_ttl_sec = int(os.environ.get("AGENT_LEASE_TTL_SEC", "300"))
+        if single_flight is not None and lease_ttl_sec > 0:
+            # Lease nằm cùng bảng với tầng shared → worker chờ đọc kết quả từ đó
+            single_flight = SingleFlight(shared_store, lease_ttl_sec)
+    return AgentResponseCache(tiers, int(os.environ.get("AGENT_CACHE_TTL_SEC", "3600")), single_flight,
+                              os.environ.get("AGENT_CACHE_UNSCOPED_KB", "false").lower() == "true")
@@ -0,0 +1,166 @@
+# ========================================
+# attribute_diff.py — PHÁT HIỆN NORMAL DRIFT (KHÁC ATTRIBUTE) KHÔNG CẦN LLM
+# ========================================
+# iac_config doc: {"resource_address": "resource.aws_instance.web", "content": "<HCL>", ...}
+# aws_state doc : {"id": "AWS__EC2__Instance_i-123", "metadata": {"resourceType", "resourceId", "resourceName",
+#                  "status"}, "configuration": {"InstanceType": "t3.small", ...}}
+# 1. Ghép IaC ↔ AWS bằng resource_matcher (hash join theo type + ARN / tên / tag Name)
+# 2. So sánh các attribute có trong ATTRIBUTE_MAP, sau khi chuẩn hóa giá trị (VALUE_NORMALIZERS theo attribute:
+#    enum hoa/thường, canned ACL, bool/số dạng chuỗi; rồi kiểu, thứ tự list, tags, rule SG)
+# 3. Output theo schema drifted_resources của detector, remediation viết bằng template
+import json
+import re
+
+from drift_common.hcl_parser import Unresolved
+from drift_common.resource_matcher import match_resources, normalize_tags, split_address, state_configuration
+from drift_common.resource_types import ATTRIBUTE_MAP, ATTRIBUTE_RISK, RISK_RANK, VALUE_NORMALIZERS
+
+NUMBER_RE = re.compile(r"^-?\d+(?:\.\d+)?$")
+PROTOCOL_NAMES = {"-1": "all", "all": "all", "6": "tcp", "17": "udp", "1": "icmp"}
+
+
+# === CHUẨN HÓA GIÁ TRỊ ===
+def normalize_value(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = value.strip()
+        if text.lower() in ("true", "false"):
+            return text.lower() == "true"
+        if NUMBER_RE.match(text):
+            return float(text)
+        return text
+    if isinstance(value, list):
+        items = [normalize_value(v) for v in value]
+        # Thứ tự list (vd. security group ids) không có ý nghĩa
+        return sorted(items, key=lambda v: json.dumps(v, sort_keys=True, default=str))
+    if isinstance(value, dict):
+        return {k: normalize_value(v) for k, v in value.items()}
+    return value
+
+
+def normalize_sg_rules(rules):
+    """ingress/egress Terraform (cidr_blocks list) và AWS (CidrIp từng rule) → set (protocol, from, to, cidr)."""
+    normalized = set()
+    for rule in rules or []:
+        if not isinstance(rule, dict):
+            continue
+        rule = {k.lower(): v for k, v in rule.items()}
+        protocol = str(rule.get("protocol", rule.get("ipprotocol", ""))).lower()
+        protocol = PROTOCOL_NAMES.get(protocol, protocol)
+        from_port = rule.get("from_port", rule.get("fromport"))
+        to_port = rule.get("to_port", rule.get("toport"))
+        cidrs = rule.get("cidr_blocks") or []
+        if rule.get("cidrip"):
+            cidrs = [rule["cidrip"]]
+        for cidr in cidrs or [None]:
+            normalized.add((protocol, normalize_value(from_port), normalize_value(to_port), cidr))
+    return normalized
+
+
+def has_unresolved(value):
+    if isinstance(value, Unresolved):
+        return True
+    if isinstance(value, list):
+        return any(has_unresolved(v) for v in value)
+    if isinstance(value, dict):
+        return any(has_unresolved(v) for v in value.values())
+    return False
+
+
+def normalize_attribute(tf_type: str, attribute: str, value):
+    normalizer = VALUE_NORMALIZERS.get(tf_type, {}).get(attribute)
+    return normalizer(value) if normalizer else value
+
+
+def values_differ(attribute: str, iac_value, aws_value, tf_type: str = None):
+    iac_value = normalize_attribute(tf_type, attribute, iac_value)
+    aws_value = normalize_attribute(tf_type, attribute, aws_value)
+    if attribute in ("ingress", "egress"):
+        return normalize_sg_rules(iac_value) != normalize_sg_rules(aws_value)
+    if attribute == "tags":
+        aws_tags = normalize_tags(aws_value) or {}
+        # Tag do AWS tự gắn (aws:cloudformation:...) không phải drift
+        aws_tags = {k: v for k, v in aws_tags.items() if not str(k).startswith("aws:")}
+        return normalize_value(iac_value or {}) != normalize_value(aws_tags)
+    return normalize_value(iac_value) != normalize_value(aws_value)
+
+
+# === SO SÁNH ===
+def compare_attributes(tf_type: str, attributes: dict, configuration: dict):
+    lowered = {k.lower(): v for k, v in configuration.items()}
+    diffs = []
+    for attribute, aws_key in ATTRIBUTE_MAP.get(tf_type, {}).items():
+        # Attribute không khai báo trong IaC = giá trị mặc định/computed → không phải drift
+        if attribute not in attributes or aws_key.lower() not in lowered:
+            continue
+        iac_value = attributes[attribute]
+        if has_unresolved(iac_value):
+            continue
+        aws_value = lowered[aws_key.lower()]
+        if values_differ(attribute, iac_value, aws_value, tf_type):
+            diffs.append({"attribute": attribute, "aws_attribute": aws_key, "iac_value": iac_value,
+                          "aws_value": to_iac_value(attribute, normalize_attribute(tf_type, attribute, aws_value))})
+    return diffs
+
+
+def to_iac_value(attribute: str, aws_value):
+    """Giá trị AWS viết theo dạng attribute Terraform (cho issue / remediation update_iac)."""
+    if attribute in ("ingress", "egress"):
+        return [{"protocol": protocol, "from_port": as_int(from_port), "to_port": as_int(to_port),
+                 "cidr_blocks": [cidr] if cidr else []}
+                for protocol, from_port, to_port, cidr in sorted(normalize_sg_rules(aws_value), key=str)]
+    if attribute == "tags":
+        tags = normalize_tags(aws_value) or {}
+        return {k: v for k, v in tags.items() if not str(k).startswith("aws:")}
+    return aws_value
+
+
+def as_int(value):
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def format_value(value):
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def build_drift(resource_address: str, aws_identifier: str, diffs: list):
+    risk = min((ATTRIBUTE_RISK.get(d["attribute"], "medium") for d in diffs), key=RISK_RANK.get)
+    issue = "; ".join(
+        f"{d['attribute']}: IaC {format_value(d['iac_value'])} vs AWS {format_value(d['aws_value'])}" for d in diffs)
+    update_iac = "; ".join(f"{d['attribute']} = {format_value(d['aws_value'])}" for d in diffs)
+    remove_source = "; ".join(f"{d['aws_attribute']} = {format_value(d['iac_value'])}" for d in diffs)
+    return {
+        "resource_address": resource_address,
+        "aws_identifier": aws_identifier,
+        "issue": issue,
+        "risk": risk,
+        "attributes": diffs,
+        "remediation_update_iac": f"Update {resource_address} in IaC to match AWS: {update_iac}",
+        "remediation_remove_source": (f"Revert {aws_identifier} to the IaC definition ({remove_source}) "
+                                      f"by running terraform apply for {resource_address}"),
+    }
+
+
+def diff_iac_and_state(iac_docs, state_docs, max_drifts: int = 50, match=None):
+    """Trả về report cùng schema với output của agent normal drift; match = kết quả match_resources nếu đã có."""
+    if match is None:
+        match = match_resources(iac_docs, state_docs)
+    drifts = []
+    for iac, state, attributes in match.pairs:
+        tf_type, _ = split_address(iac["resource_address"])
+        diffs = compare_attributes(tf_type, attributes, state_configuration(state))
+        if diffs:
+            drifts.append(build_drift(iac["resource_address"], state.get("id", ""), diffs))
+
+    drifts.sort(key=lambda d: (RISK_RANK[d["risk"]], d["resource_address"]))
+    return {
+        "detection_type": "normal",
+        "drifted_resources": drifts[:max_drifts],
+        "summary": (f"{len(drifts)} drifted of {len(match.pairs)} matched resources "
+                    f"({len(iac_docs)} IaC, {match.active_state} AWS, "
+                    f"{len(match.unsupported_iac)} unsupported types)"),
+        "source": "local_attribute_diff",
+    }
@@ -0,0 +1,228 @@
+# ========================================
+# hcl_parser.py — ĐỌC ATTRIBUTE TỪ "content" CỦA 1 RESOURCE TERRAFORM (HCL)
+# ========================================
+# Chỉ đủ cho so sánh attribute: literal (string, số, bool, list, map) và block lồng nhau (ingress { ... }).
+# Biểu thức không tính được tại chỗ (var.x, aws_vpc.main.id, "${...}", hàm) → Unresolved, bỏ qua khi so sánh.
+import json
+import re
+
+TOKEN_RE = re.compile(r"""
+    (?P<ws>[ \t\r]+)
+  | (?P<comment>\#[^\n]*|//[^\n]*|/\*.*?\*/)
+  | (?P<newline>\n)
+  | (?P<heredoc><<-?(?P<tag>\w+)\n(?P<body>.*?)\n\s*(?P=tag)(?=\s|$))
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?![\w.]))
+  | (?P<ident>[A-Za-z_][\w\-]*)
+  | (?P<punct>[{}\[\]()=,:.?*<>!&|+/%-])
+""", re.VERBOSE | re.DOTALL)
+
+CLOSERS = {"{": "}", "[": "]", "(": ")"}
+# Escape của string HCL: \n \r \t \" \\ \uNNNN \UNNNNNNNN; escape khác (vd. "a\d") giữ nguyên văn
+ESCAPE_RE = re.compile(r"\\(?:u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)", re.DOTALL)
+SIMPLE_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", '"': '"', "\\": "\\"}
+
+
+class Unresolved:
+    """Biểu thức Terraform không phải literal."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self):
+        return f"Unresolved({self.text!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, Unresolved) and other.text == self.text
+
+    def __hash__(self):
+        return hash(self.text)
+
+
+def decode_escape(match):
+    escape = match.group(0)[1:]
+    if escape[0] in "uU" and len(escape) > 1:
+        code = int(escape[1:], 16)
+        return chr(code) if code <= 0x10FFFF else match.group(0)
+    return SIMPLE_ESCAPES.get(escape, match.group(0))
+
+
+def decode_string(token: str):
+    """Token string HCL (kèm dấu nháy) → giá trị; không bao giờ raise như json.loads."""
+    return ESCAPE_RE.sub(decode_escape, token[1:-1])
+
+
+def tokenize(text: str):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        m = TOKEN_RE.match(text, pos)
+        if not m:
+            # Ký tự lạ → coi như punct để parser bỏ qua
+            tokens.append(("punct", text[pos]))
+            pos += 1
+            continue
+        kind = m.lastgroup if m.lastgroup not in ("tag", "body") else "heredoc"
+        if m.group("heredoc"):
+            tokens.append(("heredoc", m.group("body")))
+        elif kind not in ("ws", "comment"):
+            tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    return tokens
+
+
+class HclParser:
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self, offset: int = 0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def skip_newlines(self):
+        while self.peek()[0] == "newline":
+            self.pos += 1
+
+    def parse_body(self, closer: str = None):
+        attributes = {}
+        while True:
+            self.skip_newlines()
+            kind, value = self.peek()
+            if kind is None or (kind == "punct" and value == closer):
+                self.pos += 1
+                return attributes
+            if kind not in ("ident", "string"):
+                self.pos += 1
+                continue
+            name = value if kind == "ident" else decode_string(value)
+            self.pos += 1
+            if self.peek() == ("punct", "="):
+                self.pos += 1
+                attributes[name] = self.parse_expression()
+                continue
+            # Block: name ["label" ...] { ... }
+            while self.peek()[0] in ("string", "ident"):
+                self.pos += 1
+            if self.peek() == ("punct", "{"):
+                self.pos += 1
+                block = self.parse_body("}")
+                if not isinstance(attributes.get(name), list):
+                    attributes[name] = []
+                attributes[name].append(block)
+
+    def parse_expression(self):
+        start = self.pos
+        kind, value = self.peek()
+        if kind == "string" and self.is_end(1):
+            self.pos += 1
+            text = decode_string(value)
+            return Unresolved(text) if "${" in text else text
+        if kind == "heredoc":
+            self.pos += 1
+            return value
+        if kind == "number" and self.is_end(1):
+            self.pos += 1
+            number = float(value)
+            return int(number) if number.is_integer() and "." not in value else number
+        if kind == "ident" and value in ("true", "false", "null") and self.is_end(1):
+            self.pos += 1
+            return {"true": True, "false": False, "null": None}[value]
+        if kind == "punct" and value == "[":
+            self.pos += 1
+            items = self.parse_list()
+            if self.is_end(0):
+                return items
+        elif kind == "punct" and value == "{":
+            self.pos += 1
+            mapping = self.parse_map()
+            if self.is_end(0):
+                return mapping
+        # Còn lại: reference / hàm / toán tử → lấy nguyên văn tới hết biểu thức
+        self.pos = start
+        return Unresolved(self.skip_expression())
+
+    def is_end(self, offset: int):
+        kind, value = self.peek(offset)
+        return kind in (None, "newline") or (kind == "punct" and value in (",", "}", "]"))
+
+    def is_foreign_closer(self, closer: str):
+        # Document bị cắt / sai cú pháp (vd. `[ "a" }`): gặp closer của cấp ngoài → trả về, để cấp ngoài xử lý
+        kind, value = self.peek()
+        return kind == "punct" and value in CLOSERS.values() and value != closer
+
+    def parse_list(self):
+        items = []
+        while True:
+            self.skip_newlines()
+            if self.peek() == ("punct", "]"):
+                self.pos += 1
+                return items
+            if self.peek()[0] is None or self.is_foreign_closer("]"):
+                return items
+            start = self.pos
+            items.append(self.parse_expression())
+            self.skip_newlines()
+            if self.peek() == ("punct", ","):
+                self.pos += 1
+            if self.pos == start:
+                # Không tiến được → dừng thay vì lặp mãi
+                return items
+
+    def parse_map(self):
+        mapping = {}
+        while True:
+            self.skip_newlines()
+            kind, value = self.peek()
+            if kind is None or (kind == "punct" and value == "}"):
+                self.pos += 1
+                return mapping
+            if self.is_foreign_closer("}"):
+                return mapping
+            self.pos += 1
+            key = decode_string(value) if kind == "string" else value
+            if self.peek()[1] in ("=", ":"):
+                self.pos += 1
+                mapping[key] = self.parse_expression()
+            if self.peek() == ("punct", ","):
+                self.pos += 1
+
+    def skip_expression(self):
+        parts = []
+        depth = []
+        while True:
+            kind, value = self.peek()
+            if kind is None:
+                break
+            if not depth and self.is_end(0):
+                break
+            if kind == "punct" and value in CLOSERS:
+                depth.append(CLOSERS[value])
+            elif kind == "punct" and depth and value == depth[-1]:
+                depth.pop()
+            if kind != "newline":
+                parts.append(value)
+            self.pos += 1
+        return " ".join(parts)
+
+
+def parse_hcl_attributes(content: str):
+    """Attribute của 1 resource. content có thể là cả block `resource "t" "n" { ... }`, chỉ phần body, hoặc JSON."""
+    text = (content or "").strip()
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+            if isinstance(data, dict):
+                return data
+        except ValueError:
+            pass
+    parsed = HclParser(text).parse_body()
+    # Cả block resource → lấy body bên trong
+    if list(parsed) == ["resource"] and len(parsed["resource"]) == 1:
+        return parsed["resource"][0]
+    return parsed
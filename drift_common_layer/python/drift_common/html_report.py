@@ -0,0 +1,227 @@
+# ========================================
+# html_report.py — RENDER COMBINED REPORT THÀNH HTML (THAY CHO AGENT VIẾT HTML)
+# ========================================
+# Email-safe: không JavaScript, layout bằng <table>, CSS inline (mail client bỏ <style>/<script>).
+# Template biên dịch 1 lần lúc import (string.Template); mọi giá trị từ report đều được html.escape.
+# Report lớn: drift trải phẳng theo thứ tự detection type → chia trang page_size drift/trang,
+#             mỗi trang có section theo type và link điều hướng giữa các trang.
+# iter_report_pages trả về mỗi trang dạng generator các đoạn HTML (từng row) → ghi stream, không cần giữ cả trang.
+import html
+from string import Template
+
+THEME = {
+    "primary": "#246db5",
+    "secondary": "#5cadff",
+    "background": "#ffffff",
+    "text": "#1a1a1a",
+    "primary_text": "#ffffff",
+}
+RISK_COLORS = {"high": "#c62828", "medium": "#ef6c00", "low": "#2e7d32"}
+TYPE_TITLES = {
+    "normal": "Normal Drift",
+    "policy": "Policy / Compliance Drift",
+    "semantic": "Semantic Drift",
+    "hidden": "Hidden / Implicit Configuration Drift",
+    "cross": "Cross-Resource Dependency Drift",
+    "behavioral": "Behavioral Drift",
+    "version": "Version / API-Level Drift",
+}
+
+PAGE = Template("""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>$title</title>
+</head>
+<body style="margin:0;padding:0;background:${background};color:${text};font-family:Arial,Helvetica,sans-serif;">
+<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="background:${background};">
+<tr><td align="center" style="padding:16px 8px;">
+<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="max-width:960px;">
+<tr><td style="background:${primary};color:${primary_text};padding:20px 24px;">
+<div style="font-size:22px;font-weight:bold;">$title</div>
+<div style="font-size:13px;margin-top:4px;">$subtitle</div>
+</td></tr>
+$body
+<tr><td style="padding:12px 24px;font-size:12px;color:#666666;border-top:1px solid #e0e0e0;">$footer</td></tr>
+</table>
+</td></tr>
+</table>
+</body>
+</html>
+""")
+
+SUMMARY = Template("""<tr><td style="padding:16px 24px;">
+<table role="presentation" width="100%" cellpadding="0" cellspacing="0"><tr>
+<td width="33%" style="padding:8px;"><div style="border:1px solid ${secondary};padding:12px;">
+<div style="font-size:12px;color:#666666;">Total drift</div><div style="font-size:26px;font-weight:bold;color:${primary};">$total</div></div></td>
+<td width="33%" style="padding:8px;"><div style="border:1px solid ${secondary};padding:12px;">
+<div style="font-size:12px;color:#666666;">High risk</div><div style="font-size:26px;font-weight:bold;color:${high_color};">$high_risk</div></div></td>
+<td width="34%" style="padding:8px;"><div style="border:1px solid ${secondary};padding:12px;">
+<div style="font-size:12px;color:#666666;">Detection types</div><div style="font-size:26px;font-weight:bold;color:${primary};">$types</div></div></td>
+</tr></table>
+<p style="font-size:14px;margin:12px 8px 0;">$summary</p>
+$narrative
+$by_type
+</td></tr>
+""")
+
+BY_TYPE_ROW = Template("""<tr><td style="padding:6px 8px;border-bottom:1px solid #e0e0e0;">$title</td>
+<td align="right" style="padding:6px 8px;border-bottom:1px solid #e0e0e0;">$count</td></tr>""")
+
+SECTION = Template("""<tr><td style="padding:8px 24px 16px;">
+<div style="background:${secondary};color:${primary_text};padding:8px 12px;font-weight:bold;">$title$continued</div>
+<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="border-collapse:collapse;font-size:13px;">
+<tr style="background:#f2f7fc;">
+<th align="left" style="padding:8px;border:1px solid #e0e0e0;">Resource</th>
+<th align="left" style="padding:8px;border:1px solid #e0e0e0;">Risk</th>
+<th align="left" style="padding:8px;border:1px solid #e0e0e0;">Issue</th>
+<th align="left" style="padding:8px;border:1px solid #e0e0e0;">Update IaC</th>
+<th align="left" style="padding:8px;border:1px solid #e0e0e0;">Remove source</th>
+</tr>
+$rows
+</table>
+</td></tr>
+""")
+
+ROW = Template("""<tr>
+<td style="padding:8px;border:1px solid #e0e0e0;font-family:Consolas,monospace;word-break:break-all;">$resource</td>
+<td style="padding:8px;border:1px solid #e0e0e0;"><span style="background:${risk_color};color:#ffffff;padding:2px 6px;font-size:11px;">$risk</span></td>
+<td style="padding:8px;border:1px solid #e0e0e0;">$issue</td>
+<td style="padding:8px;border:1px solid #e0e0e0;">$update_iac</td>
+<td style="padding:8px;border:1px solid #e0e0e0;">$remove_source</td>
+</tr>""")
+
+MESSAGE = Template("""<tr><td style="padding:24px;">
+<div style="border-left:4px solid ${color};padding:12px 16px;background:#fafafa;font-size:14px;">$message</div>
+</td></tr>
+""")
+
+NAV = Template("""<tr><td align="center" style="padding:8px 24px;font-size:13px;">$links</td></tr>
+""")
+
+
+# Điểm cắt template thành phần đầu/phần cuối khi render dạng stream
+SPLIT_MARK = "\x00split\x00"
+
+
+def esc(value):
+    # Giữ xuống dòng của remediation nhiều dòng
+    return html.escape("" if value is None else str(value)).replace("\n", "<br>")
+
+
+def render_page(title: str, subtitle: str, body: str, footer: str):
+    return PAGE.substitute(THEME, title=esc(title), subtitle=esc(subtitle), body=body, footer=esc(footer))
+
+
+def page_chunks(title: str, subtitle: str, body_chunks, footer: str):
+    head, tail = render_page(title, subtitle, SPLIT_MARK, footer).split(SPLIT_MARK)
+    yield head
+    yield from body_chunks
+    yield tail
+
+
+def render_summary(report: dict):
+    counts = report.get("drifts_by_type") or {}
+    by_type = ""
+    if counts:
+        rows = "".join(BY_TYPE_ROW.substitute(title=esc(TYPE_TITLES.get(t, t)), count=n) for t, n in counts.items())
+        by_type = f'<table role="presentation" width="100%" cellpadding="0" cellspacing="0" ' \
+                  f'style="margin-top:12px;font-size:13px;">{rows}</table>'
+    narrative = ""
+    if report.get("narrative"):
+        narrative = f'<p style="font-size:14px;margin:12px 8px 0;line-height:1.5;">{esc(report["narrative"])}</p>'
+    return SUMMARY.substitute(
+        THEME, total=esc(report.get("total_drift", 0)), high_risk=esc(report.get("high_risk", 0)),
+        high_color=RISK_COLORS["high"], types=len(counts), summary=esc(report.get("summary", "")),
+        narrative=narrative, by_type=by_type)
+
+
+def render_row(item: dict):
+    risk = str(item.get("risk", "medium")).lower()
+    return ROW.substitute(
+        resource=esc(item.get("resource_address")), risk=esc(risk), risk_color=RISK_COLORS.get(risk, "#757575"),
+        issue=esc(item.get("issue")), update_iac=esc(item.get("remediation_update_iac")),
+        remove_source=esc(item.get("remediation_remove_source")))
+
+
+def section_chunks(detection_type: str, items: list, continued: bool):
+    head, tail = SECTION.substitute(
+        THEME, title=esc(TYPE_TITLES.get(detection_type, detection_type)),
+        continued=" (continued)" if continued else "", rows=SPLIT_MARK).split(SPLIT_MARK)
+    yield head
+    for item in items:
+        yield render_row(item)
+    yield tail
+
+
+def render_nav(page: int, pages: int, page_names: list):
+    if pages <= 1:
+        return ""
+    links = []
+    for index in range(pages):
+        if index == page:
+            links.append(f'<b style="color:{THEME["primary"]};padding:0 6px;">{index + 1}</b>')
+        else:
+            links.append(f'<a href="{esc(page_names[index])}" style="color:{THEME["primary"]};'
+                         f'padding:0 6px;">{index + 1}</a>')
+    return NAV.substitute(links=f"Page {page + 1} of {pages}: " + "".join(links))
+
+
+def paginate(drifted_resources: dict, page_size: int):
+    """→ list trang, mỗi trang là list (detection_type, items, continued)."""
+    pages, current, used = [], [], 0
+    for detection_type, items in drifted_resources.items():
+        start = 0
+        while start < len(items):
+            take = min(page_size - used, len(items) - start)
+            current.append((detection_type, items[start:start + take], start > 0))
+            start += take
+            used += take
+            if used == page_size:
+                pages.append(current)
+                current, used = [], 0
+    if current or not pages:
+        pages.append(current)
+    return pages
+
+
+def body_chunks(report: dict, sections, nav: str, first_page: bool):
+    if first_page:
+        yield render_summary(report)
+    yield nav
+    failed = report.get("failed_detections") or []
+    if first_page and failed:
+        message = f"Detection failed for: {', '.join(failed)}. Results are incomplete; re-run the scan."
+        yield MESSAGE.substitute(color=RISK_COLORS["high"], message=esc(message))
+    if not sections and not failed:
+        yield MESSAGE.substitute(color=RISK_COLORS["low"], message="No drift detected.")
+    for detection_type, items, continued in sections:
+        yield from section_chunks(detection_type, items, continued)
+    yield nav
+
+
+def iter_report_pages(report, page_names, title: str = "IaC Drift Report", generated_at: str = "",
+                      page_size: int = 200):
+    """report: combined report (dict) hoặc chuỗi lỗi. page_names(n) → tên file/URL tương đối của n trang.
+    Trả về list trang, mỗi trang là generator các đoạn HTML."""
+    footer = f"Generated {generated_at}".strip()
+    if not isinstance(report, dict) or not isinstance(report.get("drifted_resources") or {}, dict):
+        # drifted_resources phải là {detection_type: [resource]} (build_combined_report); dạng khác → trang lỗi
+        message = report if not isinstance(report, dict) else "Report has an unexpected format"
+        body = MESSAGE.substitute(color=RISK_COLORS["high"], message=esc(message or "Report is empty"))
+        return [page_chunks(title, "Report unavailable", [body], footer)]
+
+    drifted = {t: items for t, items in (report.get("drifted_resources") or {}).items()
+               if isinstance(items, list) and items}
+    pages = paginate(drifted, max(1, page_size))
+    names = page_names(len(pages))
+    subtitle = f"{report.get('report_id', '')} · {report.get('summary', '')}"
+    return [page_chunks(title, subtitle, body_chunks(report, sections, render_nav(index, len(pages), names),
+                                                     index == 0), footer)
+            for index, sections in enumerate(pages)]
+
+
+def render_report_pages(report, page_names, title: str = "IaC Drift Report", generated_at: str = "",
+                        page_size: int = 200):
+    return ["".join(chunks) for chunks in iter_report_pages(report, page_names, title, generated_at, page_size)]
@@ -0,0 +1,172 @@
+# ========================================
+# incremental.py — DETECTION TĂNG DẦN: CHỈ PHÂN TÍCH RESOURCE ĐỔI TỪ LẦN SCAN TRƯỚC, GHÉP VỚI FINDING ĐÃ CACHE
+# ========================================
+# Cache trên S3 (env SCAN_CACHE_BUCKET), theo repo: scan-cache/{repo_prefix}/
+#   resources.json       : baseline = fingerprint từng resource của lần scan xong gần nhất {scan_id, version, fingerprints}
+#   resources-next.json  : fingerprint của scan đang chạy (parser ghi), report lambda promote thành baseline khi xong
+#   findings-{type}.json : finding của 1 detection type theo resource {scan_id, findings: {key: [drift, ...]}}
+# Parser tính delta (added / changed / removed) so với baseline. Detector chỉ dùng cache khi findings-{type}.json
+# cùng scan_id với baseline (mọi lần scan lỗi / detection parse lỗi → lần sau tự chạy full cho type đó).
+# Key resource: địa chỉ IaC (bỏ tiền tố "resource.") hoặc identifier AWS State; resource ghép cặp đổi → cả 2 key.
+import copy
+import hashlib
+import json
+import logging
+import os
+
+from botocore.exceptions import ClientError
+
+from drift_common.prompt_composer import PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "scan-cache"
+# Trường đổi mỗi lần snapshot dù cấu hình không đổi (AWS Config) → không tính vào fingerprint
+VOLATILE_KEYS = frozenset({"configurationItemCaptureTime", "configurationStateId", "configurationItemVersion",
+                           "captureTime", "resourceCreationTime"})
+
+
+def resource_key(value):
+    return value[len("resource."):] if isinstance(value, str) and value.startswith("resource.") else value
+
+
+def stable(value):
+    if isinstance(value, dict):
+        return {k: stable(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [stable(v) for v in value]
+    return value
+
+
+def resource_fingerprint(*docs):
+    text = "\n".join(json.dumps(stable(doc), sort_keys=True, ensure_ascii=False, default=str) for doc in docs)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def resource_fingerprints(match):
+    """ResourceMatch → {key: fingerprint}; cặp IaC ↔ State dùng key IaC, kèm "=" + id State để biết cặp đổi."""
+    fingerprints = {}
+    for iac, state, _ in match.pairs:
+        fingerprints[resource_key(iac.get("resource_address", ""))] = \
+            f"{resource_fingerprint(iac, state)}={state.get('id', '')}"
+    for doc in match.unmatched_iac:
+        fingerprints[resource_key(doc.get("resource_address", ""))] = resource_fingerprint(doc)
+    for doc in match.unmatched_state:
+        fingerprints[doc.get("id", "")] = resource_fingerprint(doc)
+    return fingerprints
+
+
+def paired_state_id(fingerprint: str):
+    return fingerprint.partition("=")[2] or None
+
+
+def compute_delta(previous: dict, current: dict):
+    added = sorted(set(current) - set(previous))
+    removed = sorted(set(previous) - set(current))
+    changed = sorted(k for k in set(current) & set(previous) if current[k] != previous[k])
+    # Cặp đổi/xóa → identifier State của cả bản cũ lẫn bản mới đều phải phân tích lại
+    for key in changed + removed:
+        for fingerprint in (previous.get(key), current.get(key)):
+            state_id = paired_state_id(fingerprint or "")
+            if state_id and state_id not in changed:
+                changed.append(state_id)
+    return {"added": added, "changed": changed, "removed": removed}
+
+
+class ScanCache:
+    def __init__(self, s3, bucket: str, repo_prefix: str):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = f"{CACHE_PREFIX}/{repo_prefix}/"
+
+    def load(self, name: str):
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + name)["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            return None
+        return json.loads(body)
+
+    def save(self, name: str, value):
+        self.s3.put_object(Bucket=self.bucket, Key=self.prefix + name, ContentType="application/json",
+                           Body=json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+
+    def promote(self):
+        """Scan xong → fingerprint của scan này thành baseline cho lần sau."""
+        pending = self.load("resources-next.json")
+        if pending is not None:
+            self.save("resources.json", pending)
+        return pending
+
+
+def plan_scan_cache(cache: ScanCache, match, scan_id: str, full_every: int = 7, max_changed_ratio: float = 0.5):
+    """Parser: ghi fingerprint của scan này, trả thông tin delta cho detector (delta None → detector chạy full)."""
+    fingerprints = resource_fingerprints(match)
+    baseline = cache.load("resources.json")
+    runs = 0
+    delta = None
+    if baseline and baseline.get("version") == PROMPT_VERSION:
+        runs = baseline.get("incremental_runs", 0) + 1
+        delta = compute_delta(baseline.get("fingerprints", {}), fingerprints)
+        touched = len(delta["added"]) + len(delta["changed"]) + len(delta["removed"])
+        if runs > full_every or touched > max_changed_ratio * max(1, len(fingerprints)):
+            # Định kỳ chạy full (finding cache không trôi mãi) / đổi quá nhiều thì full rẻ hơn
+            delta, runs = None, 0
+    cache.save("resources-next.json", {"scan_id": scan_id, "version": PROMPT_VERSION, "incremental_runs": runs,
+                                       "fingerprints": fingerprints})
+    info = {"scan_id": scan_id, "base_scan_id": baseline.get("scan_id") if delta is not None else None}
+    if delta is not None:
+        info.update(delta)
+    logger.info(f"[incremental] {len(fingerprints)} resources, base={info['base_scan_id']}, "
+                f"delta={None if delta is None else {k: len(v) for k, v in delta.items()}}")
+    return info
+
+
+def changed_keys(scan_cache: dict):
+    return {resource_key(k) for k in (scan_cache.get("added") or []) + (scan_cache.get("changed") or [])}
+
+
+def filter_to_keys(prompt_args: dict, keys: set):
+    """Chỉ giữ resource trong keys (cùng dạng input với relevance.filter_inputs)."""
+    filtered = dict(prompt_args)
+    filtered["iac_data"] = [r for r in prompt_args.get("iac_data") or [] if resource_key(r) in keys]
+    filtered["state_data"] = [r for r in prompt_args.get("state_data") or [] if r in keys]
+    filtered["resource_pairs"] = [p for p in prompt_args.get("resource_pairs") or []
+                                  if resource_key(p[0]) in keys or p[1] in keys]
+    filtered["unmatched_iac"] = [r for r in prompt_args.get("unmatched_iac") or [] if resource_key(r) in keys]
+    return filtered
+
+
+def group_findings(drifts):
+    grouped = {}
+    for drift in drifts or []:
+        if isinstance(drift, dict):
+            grouped.setdefault(resource_key(drift.get("resource_address", "")), []).append(drift)
+    return grouped
+
+
+def merge_findings(cached: dict, new_drifts, scan_cache: dict):
+    """Finding cũ của resource không đổi + finding mới của resource đã phân tích lại. → (merged, reused)."""
+    stale = changed_keys(scan_cache) | {resource_key(k) for k in scan_cache.get("removed") or []}
+    kept = {key: copy.deepcopy(items) for key, items in cached.items() if key not in stale}
+    reused = sum(len(items) for items in kept.values())
+    for key, items in group_findings(new_drifts).items():
+        kept[key] = items
+    return [drift for items in kept.values() for drift in items], reused
+
+
+def merged_summary(drifts, reported: int, analysed: int, reused: int, base_scan_id: str):
+    """Summary của report đã ghép (cache + delta), không phải của riêng lần chạy delta."""
+    risks = {}
+    for drift in drifts:
+        risk = str(drift.get("risk", "medium")).lower()
+        risks[risk] = risks.get(risk, 0) + 1
+    by_risk = ", ".join(f"{count} {risk}" for risk, count in sorted(risks.items()))
+    return (f"{reported} drifts reported of {len(drifts)} found{f' ({by_risk})' if by_risk else ''}; "
+            f"{analysed} changed resources analysed, {reused} findings reused from scan {base_scan_id}")
+
+
+def build_scan_cache(s3, repo_prefix: str):
+    bucket = os.environ.get("SCAN_CACHE_BUCKET", "")
+    return ScanCache(s3, bucket, repo_prefix) if bucket and repo_prefix else None
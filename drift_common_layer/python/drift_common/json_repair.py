@@ -0,0 +1,194 @@
+# ========================================
+# json_repair.py — SỬA + PARSE JSON TỪ OUTPUT CỦA AGENT (1 LẦN QUÉT, O(n))
+# ========================================
+# Thay cho extract_json_from_text cũ (copy trong từng lambda). Một lần quét:
+#   - theo dõi string/escape, bỏ qua text trước/sau JSON (markdown, lời dẫn)
+#   - bỏ dấu phẩy thừa trước } / ], thêm } / ] bị thiếu theo đúng thứ tự
+#   - escape dấu " không được escape bên trong string (vd. HCL trong "content")
+#   - output bị cắt: giữ các phần tử đã hoàn chỉnh, string value dở dang được đóng lại
+# Chỉ dùng regex để nhảy tới ký tự cấu trúc kế tiếp nên không có vòng lặp từng ký tự.
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+STRUCT_RE = re.compile(r'[{}\[\]",:]')
+STRING_SPECIAL_RE = re.compile(r'["\\]')
+WHITESPACE_RE = re.compile(r"\s*")
+PRIMITIVE_RE = re.compile(r"\s*(?:true|false|null|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*\Z")
+PARTIAL_UNICODE_RE = re.compile(r"\\u[0-9a-fA-F]{0,3}\Z")
+
+CLOSER = {"{": "}", "[": "]"}
+VALUE_START = frozenset('"{[-0123456789tfn')
+MAX_START_ATTEMPTS = 3
+DECODER = json.JSONDecoder(strict=False)
+
+
+def _closes_string(text, pos, is_value, stack, last_close):
+    """Dấu " tại pos-1 có thật sự đóng string không (nhìn 1-2 token phía sau)."""
+    n = len(text)
+    after = WHITESPACE_RE.match(text, pos).end()
+    if after == n:
+        return True
+    ch = text[after]
+    if ch == ":":
+        return not is_value
+    if ch == ",":
+        nxt = WHITESPACE_RE.match(text, after + 1).end()
+        return nxt == n or text[nxt] in VALUE_START or text[nxt] in "}]"
+    if ch in "}]":
+        # `"x"\n}` trong HCL: sau } vẫn là nội dung string
+        nxt = WHITESPACE_RE.match(text, after + 1).end()
+        if nxt == n or text[nxt] in ",}]":
+            return True
+        if len(stack) == 1 and stack[0] == ch:
+            # Đóng JSON ngoài cùng, phía sau là text tự do (trừ khi string còn tiếp tục)
+            return after == last_close[ch] or text[nxt] != '"'
+        return False
+    return False
+
+
+def repair_json(text: str, start: int = 0):
+    """Trả về JSON đã sửa (str) của container đầu tiên bắt đầu tại `start`, hoặc None."""
+    n = len(text)
+    stack = []              # ký tự đóng còn thiếu: "}" / "]"
+    edits = []              # (pos, số ký tự xóa, text chèn), theo thứ tự tăng dần
+    cut = start             # vị trí kết thúc an toàn gần nhất (mọi phần tử trước đó đã đủ)
+    prev_char = ""
+    prev_pos = -1
+    last_close = {"}": text.rfind("}"), "]": text.rfind("]")}
+    i = start
+
+    while True:
+        m = STRUCT_RE.search(text, i)
+        if m is None:
+            break
+        j = m.start()
+        c = text[j]
+
+        if c == '"':
+            is_value = bool(stack) and (stack[-1] == "]" or prev_char == ":")
+            k = j + 1
+            while True:
+                m2 = STRING_SPECIAL_RE.search(text, k)
+                if m2 is None:
+                    # === Bị cắt giữa string ===
+                    if is_value:
+                        tail_end = n - 1 if k > n else n      # bỏ "\" treo cuối text
+                        partial = PARTIAL_UNICODE_RE.search(text, j + 1, tail_end)
+                        if partial:
+                            tail_end = partial.start()
+                        return _assemble(text, start, tail_end, edits, '"' + "".join(reversed(stack)))
+                    return _assemble(text, start, cut, edits, "".join(reversed(stack)))
+                p = m2.start()
+                if text[p] == "\\":
+                    k = p + 2
+                    continue
+                if not _closes_string(text, p + 1, is_value, stack, last_close):
+                    # Dấu " nằm trong nội dung string → escape lại
+                    edits.append((p, 0, "\\"))
+                    k = p + 1
+                    continue
+                break
+            i = p + 1
+            if is_value:
+                cut = i
+            prev_char, prev_pos = '"', p
+            continue
+
+        if c in "{[":
+            stack.append(CLOSER[c])
+            cut = j + 1
+        elif c in "}]":
+            if prev_char == "," and not text[prev_pos + 1:j].strip():
+                edits.append((prev_pos, 1, ""))
+            if not stack:
+                break
+            if stack[-1] != c:
+                if c in stack:
+                    # Thiếu ký tự đóng của container bên trong: chèn vào trước c
+                    missing = []
+                    while stack[-1] != c:
+                        missing.append(stack.pop())
+                    edits.append((j, 0, "".join(missing)))
+                else:
+                    # Ký tự đóng thừa → xóa
+                    edits.append((j, 1, ""))
+                    i = j + 1
+                    continue
+            stack.pop()
+            cut = j + 1
+            if not stack:
+                return _assemble(text, start, cut, edits, "")
+        elif c == ",":
+            cut = j
+        prev_char, prev_pos = c, j
+        i = j + 1
+
+    if not stack:
+        return None
+    # === Bị cắt ngoài string: giữ primitive cuối nếu đã hoàn chỉnh (vd. `"count": 3`) ===
+    if prev_char in ":,[" and PRIMITIVE_RE.match(text, prev_pos + 1):
+        cut = n
+    return _assemble(text, start, cut, edits, "".join(reversed(stack)))
+
+
+def _assemble(text, start, end, edits, suffix):
+    parts = []
+    pos = start
+    for at, delete, insert in edits:
+        if at >= end:
+            break
+        parts.append(text[pos:at])
+        parts.append(insert)
+        pos = at + delete
+    parts.append(text[pos:end])
+    parts.append(suffix)
+    return "".join(parts)
+
+
+def parse_json(text: str):
+    """Parse JSON object (ưu tiên) hoặc array trong text. Trả về None nếu không parse được."""
+    if not text:
+        return None
+    start = text.find("{")
+    if start == -1:
+        start = text.find("[")
+    attempts = 0
+    while start != -1 and attempts < MAX_START_ATTEMPTS:
+        attempts += 1
+        # Fast path: JSON hợp lệ (trường hợp phổ biến) được parse hoàn toàn bằng C
+        try:
+            return DECODER.raw_decode(text, start)[0]
+        except json.JSONDecodeError:
+            pass
+        repaired = repair_json(text, start)
+        if repaired is not None:
+            try:
+                return json.loads(repaired, strict=False)
+            except json.JSONDecodeError as e:
+                logger.info(f"[json_repair] parse failed at offset {start}: {e}")
+        start = text.find(text[start], start + 1)
+    return None
+
+
+def is_complete_json(text: str):
+    """True nếu text chứa JSON hợp lệ, không cần sửa (vd. stream không bị cắt giữa chừng)."""
+    start = text.find("{") if text else -1
+    if start == -1:
+        return False
+    try:
+        DECODER.raw_decode(text, start)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+def extract_json_from_text(text: str):
+    """Drop-in cho extract_json_from_text cũ: trả về dict/list, {} nếu không có JSON hợp lệ."""
+    data = parse_json(text.strip() if text else "")
+    if data is None:
+        logger.info(f"[json_repair] No JSON found ({len(text or '')} chars)")
+        return {}
+    return data
@@ -0,0 +1,158 @@
+# ========================================
+# json_stream.py — PARSE JSON TĂNG DẦN TỪ CÁC CHUNK CỦA BEDROCK AGENT
+# ========================================
+# Nhận từng chunk khi stream tới:
+#   - phát ra (on_item) mỗi phần tử của "drifted_resources" ngay khi object của nó đóng
+#   - done = True khi object JSON ngoài cùng đã đóng → caller dừng đọc stream
+# Kết quả cuối cùng vẫn parse bằng json_repair (chịu được output bị cắt/lỗi).
+import codecs
+import json
+import logging
+import re
+
+from drift_common.json_repair import parse_json
+
+logger = logging.getLogger(__name__)
+
+STRUCT_RE = re.compile(r'[{}\[\]",:]')
+STRING_SPECIAL_RE = re.compile(r'["\\]')
+
+
+class JsonStreamParser:
+    def __init__(self, items_key: str = "drifted_resources", on_item=None):
+        self.items_key = items_key
+        self.on_item = on_item
+        self.items = []
+        self.done = False
+        self._chunks = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        # Trạng thái quét (giữ qua các chunk)
+        self._window = ""        # phần text còn cần (từ đầu item/string đang dở)
+        self._pos = 0
+        self._started = False
+        self._stack = []         # frame: [ký tự đóng, key hiện tại, đang chờ key]
+        self._in_string = False
+        self._string_start = -1
+        self._item_start = -1
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    def feed_bytes(self, data: bytes):
+        # Decoder tăng dần: ký tự UTF-8 nhiều byte có thể bị chia giữa 2 chunk
+        return self.feed(self._decoder.decode(data))
+
+    def feed(self, chunk: str):
+        """Nạp thêm text, trả về list item mới hoàn chỉnh trong chunk này."""
+        if self.done or not chunk:
+            return []
+        self._chunks.append(chunk)
+        self._window += chunk
+        new_items = []
+        self._scan(new_items)
+        self._trim()
+        return new_items
+
+    def result(self):
+        """JSON cuối cùng (đã sửa nếu cần), {} nếu không parse được."""
+        data = parse_json(self.text)
+        return data if data is not None else {}
+
+    # === QUÉT ===
+    def _scan(self, new_items):
+        w = self._window
+        n = len(w)
+        pos = self._pos
+        while pos < n and not self.done:
+            if not self._started:
+                start = w.find("{", pos)
+                if start == -1:
+                    pos = n
+                    break
+                self._started = True
+                self._stack.append(["}", None, True])
+                pos = start + 1
+                continue
+
+            if self._in_string:
+                m = STRING_SPECIAL_RE.search(w, pos)
+                if m is None:
+                    pos = n
+                    break
+                p = m.start()
+                if w[p] == "\\":
+                    if p + 1 >= n:
+                        pos = p          # escape bị chia giữa 2 chunk
+                        break
+                    pos = p + 2
+                    continue
+                self._in_string = False
+                frame = self._stack[-1]
+                if frame[0] == "}" and frame[2]:
+                    frame[1] = json.loads(w[self._string_start:p + 1], strict=False)
+                self._string_start = -1
+                pos = p + 1
+                continue
+
+            m = STRUCT_RE.search(w, pos)
+            if m is None:
+                pos = n
+                break
+            j = m.start()
+            c = w[j]
+            pos = j + 1
+            frame = self._stack[-1]
+            if c == '"':
+                self._in_string = True
+                self._string_start = j
+            elif c == "{" or c == "[":
+                if c == "{" and self._is_item_position():
+                    self._item_start = j
+                self._stack.append(["}" if c == "{" else "]", None, c == "{"])
+            elif c == "}" or c == "]":
+                self._stack.pop()
+                if self._item_start != -1 and self._is_item_position():
+                    self._emit(w[self._item_start:j + 1], new_items)
+                    self._item_start = -1
+                if not self._stack:
+                    self.done = True
+            elif c == ":":
+                frame[2] = False
+            elif c == "," and frame[0] == "}":
+                frame[2] = True
+        self._pos = pos
+
+    def _is_item_position(self):
+        # Đang ở ngay trong array `items_key` của object ngoài cùng
+        s = self._stack
+        return len(s) == 2 and s[1][0] == "]" and s[0][1] == self.items_key
+
+    def _emit(self, item_text, new_items):
+        try:
+            item = json.loads(item_text, strict=False)
+        except json.JSONDecodeError:
+            item = parse_json(item_text)
+            if item is None:
+                logger.info(f"[json_stream] skip malformed item ({len(item_text)} chars)")
+                return
+        self.items.append(item)
+        new_items.append(item)
+        if self.on_item:
+            self.on_item(item)
+
+    def _trim(self):
+        # Bỏ phần text đã quét xong, chỉ giữ từ đầu item/string đang dở
+        keep = self._pos
+        if self._item_start != -1:
+            keep = min(keep, self._item_start)
+        if self._in_string:
+            keep = min(keep, self._string_start)
+        if keep <= 0:
+            return
+        self._window = self._window[keep:]
+        self._pos -= keep
+        if self._item_start != -1:
+            self._item_start -= keep
+        if self._string_start != -1:
+            self._string_start -= keep
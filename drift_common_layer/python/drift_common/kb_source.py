@@ -0,0 +1,58 @@
+# ========================================
+# kb_source.py — ĐỌC TRỰC TIẾP DOCUMENT NGUỒN CỦA KNOWLEDGE BASE TRÊN S3
+# ========================================
+# KB sync từ S3: iac_config/{repo_prefix}/ và aws_state/{region}/. Mỗi object là 1 document JSON,
+# 1 mảng JSON hoặc JSON Lines; file sidecar "*.metadata.json" của Bedrock KB bị bỏ qua.
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def list_keys(s3, bucket: str, prefix: str):
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        page = s3.list_objects_v2(**kwargs)
+        keys.extend(obj["Key"] for obj in page.get("Contents", []) if not obj["Key"].endswith(".metadata.json"))
+        if not page.get("IsTruncated"):
+            return keys
+        kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+
+def parse_documents(body: bytes):
+    text = body.decode("utf-8", errors="replace").strip()
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+        return [d for d in data if isinstance(d, dict)] if isinstance(data, list) else [data]
+    except ValueError:
+        documents = []
+        for line in text.splitlines():
+            try:
+                documents.append(json.loads(line))
+            except ValueError:
+                continue
+        return [d for d in documents if isinstance(d, dict)]
+
+
+def iter_kb_documents(s3, bucket: str, prefix: str, max_workers: int = 16):
+    """Document theo từng object, tải song song nhưng chỉ giữ 1 lô object trong bộ nhớ."""
+    keys = list_keys(s3, bucket, prefix)
+
+    def load(key):
+        return parse_documents(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+
+    workers = max(1, min(max_workers, len(keys)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(keys), workers * 4):
+            for docs in pool.map(load, keys[start:start + workers * 4]):
+                yield from docs
+
+
+def load_kb_documents(s3, bucket: str, prefix: str, max_workers: int = 16):
+    documents = list(iter_kb_documents(s3, bucket, prefix, max_workers))
+    logger.info(f"[kb_source] s3://{bucket}/{prefix}: {len(documents)} documents")
+    return documents
@@ -0,0 +1,160 @@
+# ========================================
+# kv_store.py — KEY/VALUE STORE DÙNG CHUNG GIỮA CÁC LAMBDA (DynamoDB + stand-in local)
+# ========================================
+# Item là dict; "expiresAt" (epoch giây) là thuộc tính TTL của bảng DynamoDB.
+# DynamoDB xóa item hết hạn không ngay lập tức → get() tự bỏ qua item đã hết hạn.
+# put_if_absent / delete_if dùng cho lease (item hết hạn coi như không tồn tại), put_if_match cho compare-and-set.
+import copy
+import threading
+import time
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+EXPIRES_AT = "expiresAt"
+
+
+def _expired(item, now):
+    expires_at = item.get(EXPIRES_AT)
+    return expires_at is not None and float(expires_at) <= now
+
+
+class InMemoryStore:
+    """Stand-in local cho DynamoDBStore (test, local pipeline, 1 process)."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or _expired(item, time.time()):
+                return None
+            return copy.deepcopy(item)
+
+    def put(self, key: str, item: dict):
+        with self._lock:
+            self._items[key] = copy.deepcopy(item)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def put_if_absent(self, key: str, item: dict):
+        with self._lock:
+            current = self._items.get(key)
+            if current is not None and not _expired(current, time.time()):
+                return False
+            self._items[key] = copy.deepcopy(item)
+            return True
+
+    def put_if_match(self, key: str, item: dict, field: str, expected):
+        """Ghi nếu item hiện tại có field == expected (expected None → item chưa tồn tại)."""
+        with self._lock:
+            current = self._items.get(key)
+            actual = None if current is None else current.get(field)
+            if actual != expected:
+                return False
+            self._items[key] = copy.deepcopy(item)
+            return True
+
+    def delete_if(self, key: str, field: str, value):
+        with self._lock:
+            current = self._items.get(key)
+            if current is None or current.get(field) != value:
+                return False
+            del self._items[key]
+            return True
+
+
+def to_dynamodb(value):
+    # boto3 resource không nhận float → Decimal
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: to_dynamodb(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_dynamodb(v) for v in value]
+    return value
+
+
+def from_dynamodb(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: from_dynamodb(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [from_dynamodb(v) for v in value]
+    return value
+
+
+class DynamoDBStore:
+    """Bảng DynamoDB với partition key dạng string (mặc định "pk")."""
+
+    def __init__(self, table, key_name: str = "pk"):
+        self.table = table
+        self.key_name = key_name
+
+    @classmethod
+    def from_table_name(cls, table_name: str, key_name: str = "pk"):
+        import boto3
+        return cls(boto3.resource("dynamodb").Table(table_name), key_name)
+
+    def get(self, key: str):
+        item = self.table.get_item(Key={self.key_name: key}, ConsistentRead=True).get("Item")
+        if item is None or _expired(item, time.time()):
+            return None
+        item.pop(self.key_name, None)
+        return from_dynamodb(item)
+
+    def put(self, key: str, item: dict):
+        self.table.put_item(Item={**to_dynamodb(item), self.key_name: key})
+
+    def delete(self, key: str):
+        self.table.delete_item(Key={self.key_name: key})
+
+    def put_if_absent(self, key: str, item: dict):
+        try:
+            self.table.put_item(
+                Item={**to_dynamodb(item), self.key_name: key},
+                ConditionExpression="attribute_not_exists(#pk) OR #exp <= :now",
+                ExpressionAttributeNames={"#pk": self.key_name, "#exp": EXPIRES_AT},
+                ExpressionAttributeValues={":now": int(time.time())},
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    def put_if_match(self, key: str, item: dict, field: str, expected):
+        # DynamoDB từ chối ExpressionAttributeNames/Values không dùng tới → dựng theo từng trường hợp
+        if expected is None:
+            condition = {"ConditionExpression": "attribute_not_exists(#pk)",
+                         "ExpressionAttributeNames": {"#pk": self.key_name}}
+        else:
+            condition = {"ConditionExpression": "#f = :v",
+                         "ExpressionAttributeNames": {"#f": field},
+                         "ExpressionAttributeValues": {":v": to_dynamodb(expected)}}
+        try:
+            self.table.put_item(Item={**to_dynamodb(item), self.key_name: key}, **condition)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    def delete_if(self, key: str, field: str, value):
+        try:
+            self.table.delete_item(
+                Key={self.key_name: key},
+                ConditionExpression="#f = :v",
+                ExpressionAttributeNames={"#f": field},
+                ExpressionAttributeValues={":v": value},
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
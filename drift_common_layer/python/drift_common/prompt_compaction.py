@@ -0,0 +1,103 @@
+# ========================================
+# prompt_compaction.py — THU GỌN DỮ LIỆU TRƯỚC KHI ĐƯA VÀO PROMPT
+# ========================================
+# Trước đây prompt nhận repr Python của list/dict ({'a': None, 'b': []}) → thừa quote, khoảng trắng, giá trị rỗng.
+# Compaction: JSON minify (key sắp xếp, không khoảng trắng) + bỏ giá trị rỗng / document lặp ở mức field/document
+#             + (tùy chọn) rút gọn key quen thuộc, kèm legend để agent đọc lại.
+# Không đụng vào bên trong document: iac_value [] vs aws_value [...] ("rỗng trong IaC, có trên AWS") và list lặp
+# phần tử (multiset) là thông tin drift.
+import json
+
+# Giá trị không mang thông tin cho agent
+EMPTY_VALUES = (None, "", [], {})
+# Giá trị attribute: rỗng vẫn là thông tin (vd. ingress [] trong IaC) → không bao giờ bỏ
+VALUE_KEYS = frozenset({"iac_value", "aws_value"})
+
+# Key xuất hiện lặp lại nhiều trong cicd_drift / drift report
+KEY_LEGEND = {
+    "resource_address": "ra",
+    "aws_identifier": "id",
+    "drift_details": "dd",
+    "change_type": "ct",
+    "attributes": "at",
+    "attribute": "a",
+    "iac_value": "iv",
+    "aws_value": "av",
+    "reason": "r",
+    "total_refreshed": "tr",
+    "managed_count": "mc",
+    "drifted": "d",
+    "unmanaged": "u",
+}
+
+
+def estimate_tokens(text: str):
+    # ~4 ký tự / token cho văn bản lẫn JSON tiếng Anh (đủ để so sánh trước/sau)
+    return (len(text or "") + 3) // 4
+
+
+def strip_empty(value):
+    """Bỏ key rỗng của dict chứa và document rỗng/trùng trong list; document (phần tử list) chỉ bỏ key rỗng của chính nó,
+    giá trị bên trong (iac_value, aws_value, list con) giữ nguyên."""
+    if isinstance(value, dict):
+        stripped = {k: v if k in VALUE_KEYS else strip_empty(v) for k, v in value.items()}
+        return {k: v for k, v in stripped.items() if k in VALUE_KEYS or v not in EMPTY_VALUES}
+    if isinstance(value, (list, tuple)):
+        items, seen = [], set()
+        for item in value:
+            if isinstance(item, dict):
+                item = {k: v for k, v in item.items() if k in VALUE_KEYS or v not in EMPTY_VALUES}
+            key = json.dumps(item, sort_keys=True, default=str)
+            if item in EMPTY_VALUES or key in seen:
+                continue
+            seen.add(key)
+            items.append(item)
+        return items
+    return value
+
+
+def shorten_keys(value, legend: dict, used: dict):
+    if isinstance(value, dict):
+        shortened = {}
+        for k, v in value.items():
+            short = legend.get(k, k)
+            if short != k:
+                used[short] = k
+            shortened[short] = shorten_keys(v, legend, used)
+        return shortened
+    if isinstance(value, list):
+        return [shorten_keys(v, legend, used) for v in value]
+    return value
+
+
+def compact_json(value, legend: dict = None):
+    """→ (JSON minify, {key ngắn: key gốc} đã dùng). Chuỗi giữ nguyên (vd. "[]" hay text log)."""
+    if isinstance(value, str):
+        return value, {}
+    used = {}
+    value = strip_empty(value)
+    if legend:
+        value = shorten_keys(value, legend, used)
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str), used
+
+
+def render_legend(used: dict):
+    if not used:
+        return ""
+    return "Compact JSON keys: " + ", ".join(f"{short}={key}" for short, key in sorted(used.items()))
+
+
+def compact_prompt_args(prompt_args: dict, fields, legend: dict = None):
+    """Thu gọn các field của prompt_args → (args mới, legend text, {field: (token trước, token sau)})."""
+    compacted = dict(prompt_args)
+    used, stats = {}, {}
+    for field in fields:
+        if field not in prompt_args:
+            continue
+        original = prompt_args[field]
+        # "Trước" = đúng chuỗi mà str.format chèn vào prompt cũ
+        before = estimate_tokens(str(original))
+        compacted[field], field_used = compact_json(original, legend)
+        used.update(field_used)
+        stats[field] = (before, estimate_tokens(compacted[field]))
+    return compacted, render_legend(used), stats
@@ -0,0 +1,137 @@
+# ========================================
+# prompt_composer.py — GHÉP PROMPT DETECTOR TỪ CÁC FRAGMENT CÓ VERSION
+# ========================================
+# Thứ tự: [PREFIX tĩnh — giống hệt nhau ở cả 7 detector] → cache point → [TASK của detection type] → [CONTEXT của lần gọi]
+#   - PREFIX: vai trò, KNOWLEDGE BASE RULES, quy trình chung, schema output, STRICT INSTRUCTION (không chứa biến)
+#   - TASK  : vài dòng riêng của từng detection type
+#   - CONTEXT: repo, region, bảng ghép và dữ liệu đầu vào (đã compact)
+# Prefix đứng đầu và không đổi byte nào giữa các detector/lần gọi → provider có prompt caching tái sử dụng được.
+# Đổi nội dung fragment → tăng PROMPT_VERSION (version nằm trong prompt nên cache theo prompt hash tự tách).
+import hashlib
+
+PROMPT_VERSION = "2"
+
+ROLE = """You are an expert in detecting Infrastructure as Code (IaC) drift. The TASK and its CONTEXT come after the rules below."""
+
+KB_RULES = """KNOWLEDGE BASE RULES (<repo_url>, <repo_prefix>, <region> are given in CONTEXT):
+1. IaC Configs (iac_config/<repo_prefix>/)
+   Structure: {"resource_address": "resource.aws_instance.web", "type": "iac_configuration", "content": "...", "metadata": {"repo": "<repo_url>"}}
+   Search: "iac_configuration <repo_url> resource_address"
+   Extract: resource_address, content (for attributes)
+2. AWS State (aws_state/<region>/)
+   Structure: {"id": "AWS__EC2__Instance_i-123", "metadata": {"resourceType": "AWS::EC2::Instance", "resourceId": "i-123", "resourceName": "web", "status": "ResourceDiscovered"}, "configuration": {"InstanceType": "t3.small", "ImageId": "ami-xyz"}}
+   Search: "metadata.resourceType AWS configuration"
+   Extract: metadata (type, id, name, status), configuration (attributes)
+   Filter: Exclude status = "ResourceDeleted"
+3. The KB is already synchronized. Prefer AWS Desired State (`aws_state/`) when conflict or uncertainty occurs.
+4. Matching IaC ↔ AWS: CONTEXT "Pre-paired" resources are already matched (do not re-match); "no AWS match" resources have no counterpart; match any other resource by type, name, or ARN, and skip it if nothing matches.
+5. Never invent AWS resources or rely on data not found in the KB or the provided inputs.
+6. Only include up to 50 high-risk drifts in the output (risk="high")."""
+
+WORKFLOW = """Step by Step:
+1. Start from the CONTEXT input data and get details from the KB; if an input is empty, scan the KB.
+2. Perform the TASK and document every drift.
+3. Suggest remediation: update_iac (change IaC in `iac_config/`) and remove_source (rebuild or reset the AWS resource).
+4. Review all findings and compile the JSON report (top 50 high-risk drifts only)."""
+
+OUTPUT_FORMAT = """IMPORTANT: Start with JSON output only. Output JSON ("detection_type" = the TASK detection_type):
+{"detection_type": "...", "drifted_resources": [{"resource_address": "...", "issue": "...", "risk": "high", "remediation_update_iac": "...", "remediation_remove_source": "..."}], "summary": "..."}"""
+
+STRICT_INSTRUCTION = """STRICT INSTRUCTION:
+- Never ask clarification questions; proceed even if iac_data, state_data or cicd_drift is missing or empty.
+- Never output explanations, reasoning, or commentary outside the JSON.
+- The output must always be valid JSON following the schema."""
+
+PREFIX_FRAGMENTS = (ROLE, KB_RULES, WORKFLOW, OUTPUT_FORMAT, STRICT_INSTRUCTION)
+
+# Phần riêng của từng detection type
+TASKS = {
+    "normal": {
+        "title": "Normal Drift (attribute differences)",
+        "steps": [
+            "Compare IaC vs AWS attributes (e.g., instance_type, AMI, subnet, etc.).",
+            "If attribute differences exist, log them under `drifted_resources`.",
+            "update_iac: modify IaC to resolve the drift; remove_source: rebuild or reset the source if needed.",
+        ],
+    },
+    "policy": {
+        "title": "Policy / Compliance Drift (valid but violating internal or AWS compliance rules)",
+        "steps": [
+            "Identify any policy or compliance violations (e.g., open security group, missing tags, public access).",
+            "Document all drift with compliance context.",
+            "update_iac: fix IaC configurations to comply; remove_source: rebuild to remove non-compliant resources.",
+        ],
+    },
+    "semantic": {
+        "title": "Semantic Drift (logical difference despite similar structure)",
+        "steps": [
+            "Analyze semantic drift (same logic but different implementation, or vice versa).",
+            "update_iac: modify IaC to match intended logic; remove_source: rebuild or refactor inconsistent semantics.",
+        ],
+    },
+    "hidden": {
+        "title": "Hidden / Implicit Configuration Drift",
+        "steps": ["Identify hidden configurations (e.g., default SGs, auto-generated tags)."],
+    },
+    "cross": {
+        "title": "Cross-Resource Dependency Drift",
+        "steps": ["Identify cross-resource impacts.", "Document dependencies and affected resources."],
+    },
+    "behavioral": {
+        "title": "Behavioral Drift",
+        "steps": [
+            "Detect runtime behavior differences (e.g., performance, downtime, cost).",
+            "If the CICD log or data is incomplete, consult the KB to fill missing context; "
+            "if results are still missing, return empty lists.",
+        ],
+    },
+    "version": {
+        "title": "Version / API-Level Drift",
+        "steps": ["Identify version mismatches or deprecated configs."],
+    },
+}
+
+CONTEXT_TEMPLATE = """CONTEXT:
+Repo: {repo_url} (repo_prefix = {repo_prefix}, region = {region})
+Pre-paired resources ([IaC resource_address, AWS id]): {resource_pairs}
+IaC resources with no AWS match: {unmatched_iac}
+IaC Data: {iac_data}
+Desired State Data: {state_data}
+CICD Drift Log: {cicd_drift}"""
+
+
+class ComposedPrompt:
+    def __init__(self, prefix: str, suffix: str):
+        self.prefix = prefix
+        self.suffix = suffix
+
+    @property
+    def text(self):
+        # InvokeAgent chỉ nhận 1 chuỗi → prefix vẫn đứng đầu nguyên vẹn
+        return f"{self.prefix}\n\n{self.suffix}"
+
+    def converse_content(self):
+        """Content blocks kiểu Bedrock Converse, có cachePoint ngay sau prefix tĩnh."""
+        return [{"text": self.prefix}, {"cachePoint": {"type": "default"}}, {"text": self.suffix}]
+
+
+def render_prefix():
+    return f"[drift-detection prompt v{PROMPT_VERSION}]\n" + "\n\n".join(PREFIX_FRAGMENTS)
+
+
+STATIC_PREFIX = render_prefix()
+PREFIX_HASH = hashlib.sha256(STATIC_PREFIX.encode("utf-8")).hexdigest()[:12]
+
+
+def render_task(detection_type: str):
+    task = TASKS[detection_type]
+    steps = "\n".join(f"- {step}" for step in task["steps"])
+    return f"TASK: detect {task['title']}. detection_type = \"{detection_type}\".\n{steps}"
+
+
+def compose_prompt(detection_type: str, context: dict, extra: str = ""):
+    """context: các giá trị đã là chuỗi (repo_url, repo_prefix, region, resource_pairs, ..., cicd_drift)."""
+    suffix = render_task(detection_type) + "\n\n" + CONTEXT_TEMPLATE.format(**context)
+    if extra:
+        suffix += f"\n{extra}"
+    return ComposedPrompt(STATIC_PREFIX, suffix)
@@ -0,0 +1,33 @@
+# ========================================
+# prompt_hash.py — KEY ỔN ĐỊNH CHO 1 PROMPT (cache / coalescing: prompt nguyên văn; replay: prompt đã chuẩn hóa)
+# ========================================
+import hashlib
+import re
+
+# Replay local: các phần thay đổi theo từng lần chạy nhưng không đổi ý nghĩa prompt (vd. report_id = drift-{date})
+# Không dùng cho agent cache: prompt chỉ khác timestamp (log CI, report_id) phải là 2 key khác nhau
+VOLATILE_RE = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?Z?")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str):
+    return WHITESPACE_RE.sub(" ", VOLATILE_RE.sub("<ts>", prompt or "")).strip()
+
+
+def hash_parts(text: str, scope):
+    h = hashlib.sha256()
+    for part in scope:
+        h.update((part or "").encode("utf-8"))
+        h.update(b"\x00")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+def prompt_hash(prompt: str, *scope: str):
+    """sha256 của prompt nguyên văn; scope (vd. agent id, alias id) được đưa vào key."""
+    return hash_parts(prompt or "", scope)
+
+
+def replay_hash(prompt: str, *scope: str):
+    """sha256 của prompt đã chuẩn hóa (che timestamp, gộp khoảng trắng) — chỉ cho fixture replay của fake backend."""
+    return hash_parts(normalize_prompt(prompt), scope)
@@ -0,0 +1,166 @@
+# ========================================
+# rate_limiter.py — GIỚI HẠN TỐC ĐỘ GỌI BEDROCK AGENT DÙNG CHUNG MỌI STAGE (token bucket + AIMD)
+# ========================================
+# - Token bucket: mỗi lời gọi lấy 1 token; hết token → chờ TRƯỚC khi gửi prompt (không phát hiện throttling sau khi upload)
+# - AIMD: thành công → rate += increase_step; throttlingException → rate *= decrease_factor và xả bucket
+# - State {tokens, rate, updated_at, version} nằm trong kv_store (DynamoDB dùng chung giữa các lambda,
+#   InMemoryStore khi local / không cấu hình bảng), cập nhật bằng compare-and-set theo version
+# - call(fn): acquire → fn() → retry khi throttling (fn nên đọc hết stream, vì throttling có thể xảy ra giữa stream)
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from drift_common.kv_store import DynamoDBStore, InMemoryStore
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_CODES = {"ThrottlingException", "throttlingException", "TooManyRequestsException"}
+
+
+def is_throttling(error):
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in THROTTLING_CODES
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, store=None, name: str = "bedrock-agent", rate: float = 2.0, burst: float = 4.0,
+                 min_rate: float = 0.2, max_rate: float = 10.0, increase_step: float = 0.1,
+                 decrease_factor: float = 0.5, max_wait_sec: float = 120.0, max_retries: int = 6,
+                 backoff_base_sec: float = 1.0, backoff_cap_sec: float = 20.0, enabled: bool = True,
+                 sleep=time.sleep):
+        self.store = store if store is not None else InMemoryStore()
+        self.key = f"rate-limit#{name}"
+        self.initial_rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.max_wait_sec = max_wait_sec
+        self.max_retries = max_retries
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_cap_sec = backoff_cap_sec
+        self.enabled = enabled
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.stats = {"acquired": 0, "waited_sec": 0.0, "throttled": 0, "conflicts": 0, "store_errors": 0}
+
+    # === BUCKET STATE ===
+    def _update(self, mutate, attempts: int = 10):
+        """mutate(tokens, rate) → (tokens, rate, result); tokens None = không ghi state. Trả result (None nếu CAS thất bại)."""
+        for _ in range(attempts):
+            now = time.time()
+            state = self.store.get(self.key)
+            version = None if state is None else state["version"]
+            if state is None:
+                tokens, rate = self.burst, self.initial_rate
+            else:
+                rate = state["rate"]
+                tokens = min(self.burst, state["tokens"] + max(0.0, now - state["updated_at"]) * rate)
+            new_tokens, new_rate, result = mutate(tokens, rate)
+            if new_tokens is None:
+                return result
+            item = {"tokens": new_tokens, "rate": new_rate, "updated_at": now, "version": (version or 0) + 1}
+            if self.store.put_if_match(self.key, item, "version", version):
+                return result
+            self._count("conflicts")
+        return None
+
+    def _safe_update(self, mutate):
+        try:
+            return self._update(mutate)
+        except Exception as e:
+            # Store lỗi → không chặn lời gọi agent (retry throttling vẫn còn)
+            self._count("store_errors")
+            logger.warning(f"[rate_limiter] store error: {e}")
+            return 0.0
+
+    def acquire(self):
+        """Chờ tới khi có token; trả về số giây đã chờ."""
+        if not self.enabled:
+            return 0.0
+
+        def take(tokens, rate):
+            if tokens >= 1:
+                return tokens - 1, rate, 0.0
+            return None, None, (1 - tokens) / rate
+
+        start = time.time()
+        while True:
+            wait = self._safe_update(take)
+            if wait is None:
+                wait = 0.05    # tranh chấp CAS → thử lại ngay sau đó
+            elif wait == 0.0:
+                waited = time.time() - start
+                self._count("acquired")
+                self._count("waited_sec", waited)
+                return waited
+            if time.time() - start + wait > self.max_wait_sec:
+                logger.warning(f"[rate_limiter] waited {time.time() - start:.1f}s for a token, proceed anyway")
+                return time.time() - start
+            # Jitter để các worker cùng chờ không đồng loạt lấy token
+            self.sleep(wait * random.uniform(1.0, 1.2))
+
+    def on_success(self):
+        if self.enabled:
+            self._safe_update(lambda tokens, rate: (tokens, min(self.max_rate, rate + self.increase_step), rate))
+
+    def on_throttle(self):
+        self._count("throttled")
+        if not self.enabled:
+            return
+
+        def decrease(tokens, rate):
+            # Xả bucket → mọi worker chờ theo rate mới
+            new_rate = max(self.min_rate, rate * self.decrease_factor)
+            return min(tokens, 0.0), new_rate, new_rate
+
+        logger.warning(f"[rate_limiter] throttled, rate → {self._safe_update(decrease)} req/s")
+
+    def _count(self, metric, value=1):
+        with self._lock:
+            self.stats[metric] += value
+
+    # === GỌI CÓ GIỚI HẠN + RETRY THROTTLING ===
+    def call(self, fn, max_retries: int = None):
+        retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_throttling(e) or attempt >= retries:
+                    raise
+                self.on_throttle()
+                backoff = min(self.backoff_cap_sec, self.backoff_base_sec * 2 ** attempt) * random.uniform(0.5, 1.0)
+                attempt += 1
+                logger.warning(f"[rate_limiter] retry {attempt}/{retries} after {backoff:.1f}s")
+                self.sleep(backoff)
+                continue
+            self.on_success()
+            return result
+
+
+def build_rate_limiter(shared_store=None):
+    """Cấu hình từ env:
+    RATE_LIMIT_ENABLED (true), RATE_LIMIT_TABLE (bảng DynamoDB dùng chung, rỗng = state trong process),
+    RATE_LIMIT_RPS (2), RATE_LIMIT_BURST (4), RATE_LIMIT_MIN_RPS (0.2), RATE_LIMIT_MAX_RPS (10),
+    RATE_LIMIT_MAX_RETRIES (6), RATE_LIMIT_MAX_WAIT_SEC (120).
+    """
+    table_name = os.environ.get("RATE_LIMIT_TABLE", "")
+    if shared_store is None and table_name:
+        shared_store = DynamoDBStore.from_table_name(table_name)
+    return AdaptiveRateLimiter(
+        store=shared_store,
+        rate=float(os.environ.get("RATE_LIMIT_RPS", "2")),
+        burst=float(os.environ.get("RATE_LIMIT_BURST", "4")),
+        min_rate=float(os.environ.get("RATE_LIMIT_MIN_RPS", "0.2")),
+        max_rate=float(os.environ.get("RATE_LIMIT_MAX_RPS", "10")),
+        max_retries=int(os.environ.get("RATE_LIMIT_MAX_RETRIES", "6")),
+        max_wait_sec=float(os.environ.get("RATE_LIMIT_MAX_WAIT_SEC", "120")),
+        enabled=os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true",
+    )
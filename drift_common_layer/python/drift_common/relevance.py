@@ -0,0 +1,145 @@
+# ========================================
+# relevance.py — LỌC RESOURCE THEO TỪNG DETECTION TYPE TRƯỚC KHI ĐƯA VÀO PROMPT
+# ========================================
+# Filter của 1 detection type: {"types": [glob Terraform / AWS type], "include": regex trên địa chỉ/identifier}
+#   - resource liên quan nếu type khớp 1 glob HOẶC địa chỉ khớp include
+#   - filter rỗng / không có → giữ mọi resource
+#   - không suy ra được type → giữ (thà gửi thừa còn hơn bỏ sót drift)
+# Ghi đè bằng env RELEVANCE_FILTERS_JSON, vd. {"policy": {"types": ["aws_iam_*"]}, "cross": {}}
+import fnmatch
+import json
+import os
+import re
+
+from drift_common.resource_types import AWS_TO_TF_TYPE
+
+RELEVANCE_FILTERS = {
+    "normal": {},
+    "semantic": {},
+    "cross": {},
+    # Mỗi filter liệt kê cả glob Terraform lẫn AWS: identifier State có type chưa map sang Terraform
+    # (vd. AWS::Lambda::Function) chỉ khớp được glob AWS
+    "policy": {
+        "types": ["aws_security_group*", "aws_vpc_security_group_*", "aws_s3_bucket*", "aws_iam_*",
+                  "aws_kms_*", "aws_db_instance", "aws_rds_*", "aws_instance", "aws_network_acl*",
+                  "aws_lb*", "aws_cloudtrail*", "aws_ebs_*", "AWS::IAM::*", "AWS::KMS::*", "AWS::S3::*",
+                  "AWS::EC2::SecurityGroup*", "AWS::RDS::*", "AWS::EC2::Instance", "AWS::EC2::NetworkAcl*",
+                  "AWS::ElasticLoadBalancing*", "AWS::CloudTrail::*", "AWS::EC2::Volume"],
+    },
+    "hidden": {
+        "types": ["aws_security_group*", "aws_default_*", "aws_vpc*", "aws_subnet", "aws_route_table*",
+                  "aws_network_acl*", "aws_instance", "aws_s3_bucket*", "aws_iam_*", "AWS::EC2::*",
+                  "AWS::S3::*", "AWS::IAM::*"],
+        "include": r"default",
+    },
+    "behavioral": {
+        "types": ["aws_instance", "aws_autoscaling_*", "aws_launch_template", "aws_lambda_*", "aws_ecs_*",
+                  "aws_db_instance", "aws_rds_*", "aws_cloudwatch_*", "aws_appautoscaling_*", "aws_sqs_*",
+                  "aws_sns_*", "aws_lb*", "AWS::EC2::Instance", "AWS::AutoScaling::*", "AWS::EC2::LaunchTemplate",
+                  "AWS::Lambda::*", "AWS::ECS::*", "AWS::RDS::*", "AWS::CloudWatch::*",
+                  "AWS::ApplicationAutoScaling::*", "AWS::SQS::*", "AWS::SNS::*", "AWS::ElasticLoadBalancing*"],
+    },
+    "version": {
+        "types": ["aws_db_instance", "aws_rds_*", "aws_lambda_function", "aws_lambda_layer_version",
+                  "aws_eks_*", "aws_elasticache_*", "aws_mq_*", "aws_msk_*", "aws_opensearch_*",
+                  "aws_elasticsearch_*", "aws_instance", "aws_launch_template", "aws_ecs_task_definition",
+                  "AWS::RDS::*", "AWS::Lambda::Function", "AWS::Lambda::LayerVersion", "AWS::EKS::*",
+                  "AWS::ElastiCache::*", "AWS::AmazonMQ::*", "AWS::MSK::*", "AWS::OpenSearchService::*",
+                  "AWS::Elasticsearch::*", "AWS::EC2::Instance", "AWS::EC2::LaunchTemplate",
+                  "AWS::ECS::TaskDefinition"],
+        "include": r"(^|[._-])(version|engine|runtime|ami)",
+    },
+}
+
+# "EC2Instance_web" (dạng identifier của prompt retrieve_iac_and_state) → AWS type
+COMPACT_AWS_TYPES = {aws.replace("AWS::", "").replace("::", ""): aws for aws in AWS_TO_TF_TYPE}
+
+
+def load_relevance_filters():
+    filters = dict(RELEVANCE_FILTERS)
+    override = os.environ.get("RELEVANCE_FILTERS_JSON", "")
+    if override:
+        filters.update(json.loads(override))
+    return filters
+
+
+def terraform_type(address: str):
+    """`module.a.module.b.aws_iam_role.r[0]` → `aws_iam_role` (cả data source)."""
+    parts = re.sub(r"\[[^\]]*\]", "", address).split(".")
+    if parts and parts[0] == "resource":
+        parts = parts[1:]
+    while len(parts) > 2 and parts[0] == "module":
+        parts = parts[2:]
+    if parts and parts[0] == "data":
+        parts = parts[1:]
+    return parts[0] if len(parts) >= 2 else None
+
+
+def resource_types_of(value: str):
+    """Các type (Terraform và/hoặc AWS) của 1 địa chỉ IaC hoặc identifier AWS."""
+    if value.startswith("AWS__"):
+        parts = value.split("__")
+        aws_type = "::".join(parts[:-1] + [parts[-1].split("_", 1)[0]])
+        return [t for t in (aws_type, AWS_TO_TF_TYPE.get(aws_type)) if t]
+    compact = value.split("_", 1)[0]
+    if compact in COMPACT_AWS_TYPES:
+        aws_type = COMPACT_AWS_TYPES[compact]
+        return [aws_type, AWS_TO_TF_TYPE[aws_type]]
+    tf_type = terraform_type(value)
+    return [tf_type] if tf_type else []
+
+
+def is_relevant(spec: dict, value):
+    if not spec or not isinstance(value, str):
+        return True
+    types = resource_types_of(value)
+    if not types:
+        return True
+    if any(fnmatch.fnmatchcase(t, pattern) for t in types for pattern in spec.get("types", [])):
+        return True
+    return bool(spec.get("include")) and re.search(spec["include"], value, re.IGNORECASE) is not None
+
+
+def filter_resources(spec: dict, items, key=None):
+    """Giữ phần tử liên quan; key(item) lấy địa chỉ/identifier (mặc định chính item)."""
+    if not spec or not isinstance(items, list):
+        return items
+    return [item for item in items if is_relevant(spec, key(item) if key else item)]
+
+
+def filter_inputs(detection_type: str, inputs: dict, filters: dict):
+    """inputs: {iac_data, state_data, resource_pairs, unmatched_iac, cicd_drift} → bản đã lọc + số lượng trước/sau."""
+    spec = filters.get(detection_type) or {}
+    if not spec:
+        return inputs, None
+    filtered = dict(inputs)
+    filtered["iac_data"] = filter_resources(spec, inputs.get("iac_data"))
+    filtered["state_data"] = filter_resources(spec, inputs.get("state_data"))
+    filtered["resource_pairs"] = filter_resources(spec, inputs.get("resource_pairs"), key=lambda p: p[0])
+    filtered["unmatched_iac"] = filter_resources(spec, inputs.get("unmatched_iac"))
+    cicd_drift = inputs.get("cicd_drift")
+    if isinstance(cicd_drift, dict) and cicd_drift:
+        filtered["cicd_drift"] = {
+            **cicd_drift,
+            "drifted": filter_resources(spec, cicd_drift.get("drifted"), key=lambda d: d.get("resource_address")),
+            "unmanaged": filter_resources(spec, cicd_drift.get("unmanaged"),
+                                          key=lambda d: d.get("resource_address") or d.get("aws_identifier")),
+        }
+    stats = {name: (count(inputs, name), count(filtered, name))
+             for name in ("iac_data", "state_data", "resource_pairs", "unmatched_iac", "drifted", "unmanaged")}
+    return filtered, stats
+
+
+def count(inputs: dict, name: str):
+    if name in ("drifted", "unmanaged"):
+        cicd_drift = inputs.get("cicd_drift")
+        value = cicd_drift.get(name) if isinstance(cicd_drift, dict) else None
+    else:
+        value = inputs.get(name)
+    return len(value) if isinstance(value, list) else 0
+
+
+def nothing_relevant(stats):
+    """Có resource đầu vào nhưng không resource nào liên quan tới detection type này."""
+    return bool(stats) and sum(before for before, _ in stats.values()) > 0 and \
+        sum(after for _, after in stats.values()) == 0
@@ -0,0 +1,93 @@
+# ========================================
+# remediation.py — GOM REMEDIATION TỪ OUTPUT CỦA DETECTOR (KHÔNG CẦN LLM)
+# ========================================
+# Mỗi drift của detector đã có remediation_update_iac / remediation_remove_source → chỉ cần nhóm theo detection type:
+# {"remediation_type": "update_iac", "<type>": {"remediation_suggestions": [{"resource_address", "suggestion", ...}]},
+#  "summary": "..."}
+from drift_common.resource_types import RISK_RANK
+
+REMEDIATION_FIELDS = {
+    "update_iac": "remediation_update_iac",
+    "remove_source": "remediation_remove_source",
+}
+DETECTION_TYPES = ("normal", "policy", "semantic", "hidden", "cross", "behavioral", "version")
+# Suggestion không mang nội dung
+EMPTY_SUGGESTIONS = {"", "n/a", "na", "none", "-", "..."}
+
+
+def collect_detection_reports(obj, key=None, reports=None):
+    """Tìm mọi report có drifted_resources trong event (Parallel output dạng list, dict theo type, hoặc multi-type)."""
+    if reports is None:
+        reports = {}
+    if isinstance(obj, dict):
+        if isinstance(obj.get("drifted_resources"), list):
+            detection_type = obj.get("detection_type") or key
+            if detection_type:
+                reports.setdefault(detection_type, obj)
+            return reports
+        for k, v in obj.items():
+            collect_detection_reports(v, k, reports)
+    elif isinstance(obj, list):
+        for item in obj:
+            collect_detection_reports(item, key, reports)
+    return reports
+
+
+def is_empty_suggestion(value):
+    return not isinstance(value, str) or value.strip().lower() in EMPTY_SUGGESTIONS
+
+
+def consolidate_remediations(remediation_type: str, reports: dict):
+    field = REMEDIATION_FIELDS[remediation_type]
+    consolidated = {"remediation_type": remediation_type}
+    total, resources = 0, set()
+    ordered = [t for t in DETECTION_TYPES if t in reports] + sorted(t for t in reports if t not in DETECTION_TYPES)
+    for detection_type in ordered:
+        suggestions, seen = [], set()
+        for drift in reports[detection_type].get("drifted_resources") or []:
+            if not isinstance(drift, dict) or is_empty_suggestion(drift.get(field)):
+                continue
+            key = (drift.get("resource_address"), drift[field].strip())
+            if key in seen:
+                continue
+            seen.add(key)
+            suggestions.append({
+                "resource_address": drift.get("resource_address", ""),
+                "suggestion": drift[field].strip(),
+                "issue": drift.get("issue", ""),
+                "risk": drift.get("risk", "medium"),
+            })
+        if not suggestions:
+            continue
+        suggestions.sort(key=lambda s: (RISK_RANK.get(s["risk"], len(RISK_RANK)), s["resource_address"]))
+        consolidated[detection_type] = {"remediation_suggestions": suggestions}
+        total += len(suggestions)
+        resources.update(s["resource_address"] for s in suggestions)
+
+    types = len(consolidated) - 1
+    consolidated["summary"] = (f"{total} {remediation_type} suggestions for {len(resources)} resources "
+                               f"across {types} detection types") if total else "No remediation needed"
+    consolidated["source"] = "local_consolidation"
+    return consolidated
+
+
+def apply_polished(consolidated: dict, polished: dict):
+    """Ghi đè text suggestion bằng bản agent viết lại; cấu trúc, resource và thứ tự giữ nguyên."""
+    if not isinstance(polished, dict):
+        return 0
+    updated = 0
+    for detection_type, section in consolidated.items():
+        if not isinstance(section, dict) or not isinstance(polished.get(detection_type), dict):
+            continue
+        # 1 resource có thể có nhiều suggestion → ghép theo thứ tự xuất hiện
+        rewritten = {}
+        for item in polished[detection_type].get("remediation_suggestions") or []:
+            if isinstance(item, dict) and not is_empty_suggestion(item.get("suggestion")):
+                rewritten.setdefault(item.get("resource_address"), []).append(item["suggestion"])
+        for suggestion in section["remediation_suggestions"]:
+            if rewritten.get(suggestion["resource_address"]):
+                suggestion["suggestion"] = rewritten[suggestion["resource_address"]].pop(0)
+                updated += 1
+    if isinstance(polished.get("summary"), str) and polished["summary"].strip():
+        consolidated["summary"] = polished["summary"]
+    return updated
@@ -0,0 +1,119 @@
+# ========================================
+# report_builder.py — GHÉP REPORT update_iac + remove_source THÀNH COMBINED REPORT (KHÔNG CẦN LLM)
+# ========================================
+# Input : 2 report remediation {"remediation_type", "<type>": {"remediation_suggestions": [...]}, "summary"}
+# Output: {"report_id", "total_drift", "high_risk", "drifted_resources": {<type>: [resource]}, "summary", ...}
+#   resource = {"resource_address", "issue", "risk", "remediation_update_iac", "remediation_remove_source"}
+# Join theo (detection type, resource_address); nhiều suggestion cùng loại được nối bằng xuống dòng.
+from drift_common.remediation import DETECTION_TYPES, REMEDIATION_FIELDS
+from drift_common.resource_types import RISK_RANK
+
+NOT_APPLICABLE = "N/A"
+
+
+def iter_suggestions(remediation_report):
+    """(detection_type, suggestion) của 1 report remediation; report lỗi/không phải dict → không có gì."""
+    if not isinstance(remediation_report, dict):
+        return
+    for detection_type, section in remediation_report.items():
+        if not isinstance(section, dict):
+            continue
+        for suggestion in section.get("remediation_suggestions") or []:
+            if isinstance(suggestion, dict) and suggestion.get("resource_address"):
+                yield detection_type, suggestion
+
+
+def higher_risk(a: str, b: str):
+    return min(a, b, key=lambda r: RISK_RANK.get(r, len(RISK_RANK)))
+
+
+def join_remediations(remediation_reports: dict):
+    """{remediation_type: report} → {detection_type: {resource_address: entry}}."""
+    grouped = {}
+    for remediation_type, report in remediation_reports.items():
+        for detection_type, suggestion in iter_suggestions(report):
+            entry = grouped.setdefault(detection_type, {}).setdefault(suggestion["resource_address"], {
+                "resource_address": suggestion["resource_address"],
+                "issue": suggestion.get("issue", ""),
+                "risk": suggestion.get("risk", "medium"),
+                "suggestions": {t: [] for t in REMEDIATION_FIELDS},
+            })
+            entry["risk"] = higher_risk(entry["risk"], suggestion.get("risk", "medium"))
+            if not entry["issue"]:
+                entry["issue"] = suggestion.get("issue", "")
+            if suggestion.get("suggestion") not in entry["suggestions"][remediation_type]:
+                entry["suggestions"][remediation_type].append(suggestion.get("suggestion"))
+    return grouped
+
+
+def build_combined_report(update_remediation, remove_remediation, report_date: str):
+    grouped = join_remediations({"update_iac": update_remediation, "remove_source": remove_remediation})
+    ordered = [t for t in DETECTION_TYPES if t in grouped] + sorted(t for t in grouped if t not in DETECTION_TYPES)
+
+    drifted_resources, counts, risks = {}, {}, {}
+    for detection_type in ordered:
+        entries = sorted(grouped[detection_type].values(),
+                         key=lambda e: (RISK_RANK.get(e["risk"], len(RISK_RANK)), e["resource_address"]))
+        drifted_resources[detection_type] = [{
+            "resource_address": e["resource_address"],
+            "issue": e["issue"],
+            "risk": e["risk"],
+            **{field: "\n".join(filter(None, e["suggestions"][t])) or NOT_APPLICABLE
+               for t, field in REMEDIATION_FIELDS.items()},
+        } for e in entries]
+        counts[detection_type] = len(entries)
+        for e in entries:
+            risks[e["risk"]] = risks.get(e["risk"], 0) + 1
+
+    total = sum(counts.values())
+    high_risk = risks.get("high", 0)
+    return {
+        "report_id": f"drift-{report_date}",
+        "total_drift": total,
+        "high_risk": high_risk,
+        "drifts_by_type": counts,
+        "drifts_by_risk": risks,
+        "drifted_resources": drifted_resources,
+        "summary": f"{total} drifts found, {high_risk} high-risk" + (
+            " (" + ", ".join(f"{t}: {n}" for t, n in counts.items()) + ")" if counts else ""),
+    }
+
+
+def iter_agent_resources(value, detection_type=None, remediation_type=None):
+    """(detection_type, remediation_type, resource) trong drifted_resources do agent ghép (list phẳng, dict theo
+    detection type, lồng theo remediation type / remediation_suggestions)."""
+    if isinstance(value, list):
+        for item in value:
+            yield from iter_agent_resources(item, detection_type, remediation_type)
+    elif isinstance(value, dict):
+        if value.get("resource_address"):
+            yield detection_type or value.get("detection_type") or "other", remediation_type, value
+            return
+        for key, item in value.items():
+            if key in REMEDIATION_FIELDS:
+                yield from iter_agent_resources(item, detection_type, key)
+            elif key == "remediation_suggestions":
+                yield from iter_agent_resources(item, detection_type, remediation_type)
+            else:
+                yield from iter_agent_resources(item, detection_type or key, remediation_type)
+
+
+def normalize_agent_report(report, report_date: str):
+    """Output của agent ghép report (schema PROMPT cũ, drifted_resources thường là list) → cùng dạng
+    build_combined_report; không phải dict / thiếu drifted_resources → None (report lỗi)."""
+    if not isinstance(report, dict) or "drifted_resources" not in report:
+        return None
+    remediation_reports = {t: {} for t in REMEDIATION_FIELDS}
+    for detection_type, remediation_type, resource in iter_agent_resources(report["drifted_resources"]):
+        added = False
+        for t, field in REMEDIATION_FIELDS.items():
+            suggestion = resource.get(field) or (resource.get("suggestion") if remediation_type == t else None)
+            if suggestion and suggestion != NOT_APPLICABLE:
+                remediation_reports[t].setdefault(detection_type, {"remediation_suggestions": []})[
+                    "remediation_suggestions"].append({**resource, "suggestion": suggestion})
+                added = True
+        if not added:
+            # Không có remediation nào → vẫn liệt kê drift (remediation N/A)
+            remediation_reports["update_iac"].setdefault(detection_type, {"remediation_suggestions": []})[
+                "remediation_suggestions"].append({**resource, "suggestion": None})
+    return build_combined_report(remediation_reports["update_iac"], remediation_reports["remove_source"], report_date)
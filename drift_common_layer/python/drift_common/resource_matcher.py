@@ -0,0 +1,145 @@
+# ========================================
+# resource_matcher.py — GHÉP IaC RESOURCE ↔ AWS STATE RECORD (HASH JOIN, 1 LẦN MỖI SCAN)
+# ========================================
+# Thay cho rule "Match by resource type, name, or ARN" mà cả 7 detector prompt bắt agent tự làm.
+# Build: index AWS State theo (resourceType, resourceName / resourceId / tag Name) và ARN — 1 lượt
+# Probe: mỗi IaC resource tra theo ARN → tên vật lý → tag Name → tên Terraform — O(1) mỗi lần tra
+# Mỗi AWS record chỉ ghép với 1 IaC resource; còn lại → unmatched_iac / unmatched_state.
+import json
+import logging
+import re
+
+from drift_common.hcl_parser import parse_hcl_attributes
+from drift_common.resource_types import NAME_ATTRIBUTES, TF_TO_AWS_TYPE
+
+logger = logging.getLogger(__name__)
+
+
+def split_address(resource_address: str):
+    """`resource.aws_instance.web` / `module.x.aws_instance.web[0]` → ("aws_instance", "web")."""
+    parts = re.sub(r"\[[^\]]*\]", "", resource_address or "").split(".")
+    for index, part in enumerate(parts[:-1]):
+        if part in TF_TO_AWS_TYPE:
+            return part, parts[index + 1]
+    return None, None
+
+
+def normalize_tags(tags):
+    # AWS: [{"Key": "Name", "Value": "web"}] ; Terraform: {"Name": "web"}
+    if isinstance(tags, list) and all(isinstance(t, dict) and "Key" in t for t in tags):
+        return {t["Key"]: t.get("Value") for t in tags}
+    return tags
+
+
+def tag_name(tags):
+    tags = normalize_tags(tags)
+    return tags.get("Name") if isinstance(tags, dict) else None
+
+
+def state_configuration(doc: dict):
+    configuration = doc.get("configuration") or {}
+    if isinstance(configuration, str):
+        try:
+            configuration = json.loads(configuration)
+        except ValueError:
+            return {}
+    return configuration if isinstance(configuration, dict) else {}
+
+
+def state_type(doc: dict):
+    # metadata.resourceType, hoặc suy ra từ id "AWS__EC2__Instance_i-123"
+    resource_type = (doc.get("metadata") or {}).get("resourceType")
+    if resource_type:
+        return resource_type
+    parts = str(doc.get("id", "")).split("__")
+    if len(parts) < 3 or parts[0] != "AWS":
+        return None
+    return "::".join(parts[:-1] + [parts[-1].split("_", 1)[0]])
+
+
+def state_arn(doc: dict):
+    metadata = doc.get("metadata") or {}
+    return metadata.get("arn") or metadata.get("ARN") or state_configuration(doc).get("Arn")
+
+
+def state_keys(doc: dict):
+    metadata = doc.get("metadata") or {}
+    resource_type = state_type(doc)
+    names = [metadata.get("resourceName"), metadata.get("resourceId"),
+             tag_name(state_configuration(doc).get("Tags"))]
+    keys = [("arn", state_arn(doc))] + [(resource_type, str(n).lower()) for n in names if n]
+    return [k for k in keys if k[1]]
+
+
+def iac_keys(tf_type: str, tf_name: str, attributes: dict):
+    aws_type = TF_TO_AWS_TYPE[tf_type]
+    keys = [("arn", attributes.get("arn"))]
+    for name in (attributes.get(NAME_ATTRIBUTES.get(tf_type, "")), tag_name(attributes.get("tags")), tf_name):
+        if isinstance(name, str) and name:
+            keys.append((aws_type, name.lower()))
+    return [k for k in keys if isinstance(k[1], str) and k[1]]
+
+
+def is_active(doc: dict):
+    return (doc.get("metadata") or {}).get("status") != "ResourceDeleted"
+
+
+class ResourceMatch:
+    """Kết quả ghép: pairs = [(iac_doc, state_doc, attributes)]; iac/state không ghép được."""
+
+    def __init__(self):
+        self.pairs = []
+        self.unmatched_iac = []
+        self.unmatched_state = []
+        self.unsupported_iac = []
+        self.active_state = 0
+
+    def pairing_table(self):
+        """Dạng gọn để truyền qua event Step Functions / đưa vào prompt."""
+        return {
+            "resource_pairs": [[iac["resource_address"], state.get("id", "")] for iac, state, _ in self.pairs],
+            "unmatched_iac": [doc.get("resource_address", "") for doc in self.unmatched_iac],
+            "unmatched_state": [doc.get("id", "") for doc in self.unmatched_state],
+        }
+
+
+def parse_document(doc):
+    try:
+        return parse_hcl_attributes(doc.get("content", ""))
+    except Exception as e:
+        # 1 document hỏng không được làm hỏng cả scan: không có attribute nào → không so sánh, chỉ ghép theo tên
+        logger.warning(f"Cannot parse {doc.get('resource_address')}, treated as unresolved: {str(e)}")
+        return {}
+
+
+def match_resources(iac_docs, state_docs):
+    match = ResourceMatch()
+    # Build side
+    index = {}
+    active = []
+    for doc in state_docs:
+        if not is_active(doc):
+            continue
+        active.append(doc)
+        for key in state_keys(doc):
+            index.setdefault(key, doc)
+    match.active_state = len(active)
+
+    # Probe side
+    paired_ids = set()
+    for doc in iac_docs:
+        tf_type, tf_name = split_address(doc.get("resource_address", ""))
+        if tf_type is None:
+            match.unsupported_iac.append(doc)
+            continue
+        attributes = parse_document(doc)
+        state = next((index[k] for k in iac_keys(tf_type, tf_name, attributes)
+                      if k in index and id(index[k]) not in paired_ids), None)
+        if state is None:
+            match.unmatched_iac.append(doc)
+            continue
+        paired_ids.add(id(state))
+        match.pairs.append((doc, state, attributes))
+
+    match.unmatched_state = [doc for doc in active if id(doc) not in paired_ids]
+    return match
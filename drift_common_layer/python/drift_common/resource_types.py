@@ -0,0 +1,189 @@
+# ========================================
+# resource_types.py — MAPPING TERRAFORM ↔ AWS (type, tên attribute, mức rủi ro)
+# ========================================
+# Nguồn duy nhất cho RESOURCE TYPE MAPPING (prompt retrieve_iac_and_state, plan_log_parser, attribute_diff)
+
+# Terraform type ↔ AWS Config resourceType
+TF_TO_AWS_TYPE = {
+    "aws_instance": "AWS::EC2::Instance",
+    "aws_s3_bucket": "AWS::S3::Bucket",
+    "aws_security_group": "AWS::EC2::SecurityGroup",
+    "aws_db_instance": "AWS::RDS::DBInstance",
+    "aws_vpc": "AWS::EC2::VPC",
+}
+AWS_TO_TF_TYPE = {v: k for k, v in TF_TO_AWS_TYPE.items()}
+
+# Attribute Terraform → key trong aws_state configuration (so khớp không phân biệt hoa thường)
+ATTRIBUTE_MAP = {
+    "aws_instance": {
+        "instance_type": "InstanceType",
+        "ami": "ImageId",
+        "subnet_id": "SubnetId",
+        "key_name": "KeyName",
+        "availability_zone": "AvailabilityZone",
+        "private_ip": "PrivateIpAddress",
+        "vpc_security_group_ids": "SecurityGroupIds",
+        "iam_instance_profile": "IamInstanceProfile",
+        "monitoring": "Monitoring",
+        "ebs_optimized": "EbsOptimized",
+        "tags": "Tags",
+    },
+    "aws_s3_bucket": {
+        "bucket": "BucketName",
+        "acl": "AccessControl",
+        "tags": "Tags",
+    },
+    "aws_security_group": {
+        "name": "GroupName",
+        "description": "GroupDescription",
+        "vpc_id": "VpcId",
+        "ingress": "SecurityGroupIngress",
+        "egress": "SecurityGroupEgress",
+        "tags": "Tags",
+    },
+    "aws_db_instance": {
+        "identifier": "DBInstanceIdentifier",
+        "instance_class": "DBInstanceClass",
+        "engine": "Engine",
+        "engine_version": "EngineVersion",
+        "allocated_storage": "AllocatedStorage",
+        "storage_type": "StorageType",
+        "multi_az": "MultiAZ",
+        "publicly_accessible": "PubliclyAccessible",
+        "storage_encrypted": "StorageEncrypted",
+        "backup_retention_period": "BackupRetentionPeriod",
+        "deletion_protection": "DeletionProtection",
+        "tags": "Tags",
+    },
+    "aws_vpc": {
+        "cidr_block": "CidrBlock",
+        "instance_tenancy": "InstanceTenancy",
+        "enable_dns_support": "EnableDnsSupport",
+        "enable_dns_hostnames": "EnableDnsHostnames",
+        "tags": "Tags",
+    },
+}
+
+# Attribute cho biết tên vật lý của resource trên AWS (dùng để match IaC ↔ AWS State)
+NAME_ATTRIBUTES = {
+    "aws_s3_bucket": "bucket",
+    "aws_security_group": "name",
+    "aws_db_instance": "identifier",
+}
+
+# Attribute không có ở đây → "medium"
+ATTRIBUTE_RISK = {
+    "ingress": "high",
+    "egress": "high",
+    "acl": "high",
+    "publicly_accessible": "high",
+    "storage_encrypted": "high",
+    "deletion_protection": "high",
+    "vpc_security_group_ids": "high",
+    "iam_instance_profile": "high",
+    "tags": "low",
+    "description": "low",
+    "monitoring": "low",
+}
+RISK_RANK = {"high": 0, "medium": 1, "low": 2}
+
+
+# === CHUẨN HÓA GIÁ TRỊ THEO ATTRIBUTE (Terraform vs CFN / AWS Config viết khác nhau cùng 1 giá trị) ===
+# Canned ACL: Terraform "public-read" ↔ AccessControl "PublicRead" (key đã bỏ ký tự không phải chữ, viết thường)
+CANNED_ACLS = {
+    "private": "private",
+    "publicread": "public-read",
+    "publicreadwrite": "public-read-write",
+    "awsexecread": "aws-exec-read",
+    "authenticatedread": "authenticated-read",
+    "bucketownerread": "bucket-owner-read",
+    "bucketownerfullcontrol": "bucket-owner-full-control",
+    "logdeliverywrite": "log-delivery-write",
+}
+TRUE_STRINGS = {"true", "yes", "1", "enabled", "on"}
+FALSE_STRINGS = {"false", "no", "0", "disabled", "off"}
+
+
+def fold_enum(value):
+    """Enum không phân biệt hoa thường: "Default" = "default", "MySQL" = "mysql"."""
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+def canned_acl(value):
+    if not isinstance(value, str):
+        return value
+    key = "".join(c for c in value.lower() if c.isalpha())
+    return CANNED_ACLS.get(key, value.strip().lower())
+
+
+def coerce_bool(value):
+    """"True" / "enabled" / 1 → True; {"State": "disabled"} (Monitoring của EC2) → False; còn lại giữ nguyên."""
+    if isinstance(value, dict) and len(value) == 1:
+        value = next(iter(value.values()))
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in TRUE_STRINGS:
+            return True
+        if text in FALSE_STRINGS:
+            return False
+    return value
+
+
+def coerce_number(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            return value
+    return float(value) if isinstance(value, int) else value
+
+
+def arn_name(value):
+    """IamInstanceProfile {"Arn": "arn:...:instance-profile/web"} / ARN → "web" (Terraform dùng tên)."""
+    if isinstance(value, dict):
+        value = value.get("Name") or value.get("Arn") or value.get("arn") or value
+    if isinstance(value, str) and value.startswith("arn:"):
+        return value.rsplit("/", 1)[-1]
+    return value
+
+
+# Terraform type → {attribute: normalizer}, áp dụng cho cả 2 phía trước khi so sánh
+VALUE_NORMALIZERS = {
+    "aws_instance": {
+        "instance_type": fold_enum,
+        "availability_zone": fold_enum,
+        "monitoring": coerce_bool,
+        "ebs_optimized": coerce_bool,
+        "iam_instance_profile": arn_name,
+    },
+    "aws_s3_bucket": {
+        "acl": canned_acl,
+    },
+    "aws_db_instance": {
+        "instance_class": fold_enum,
+        "engine": fold_enum,
+        "storage_type": fold_enum,
+        "allocated_storage": coerce_number,
+        "backup_retention_period": coerce_number,
+        "multi_az": coerce_bool,
+        "publicly_accessible": coerce_bool,
+        "storage_encrypted": coerce_bool,
+        "deletion_protection": coerce_bool,
+    },
+    "aws_vpc": {
+        "instance_tenancy": fold_enum,
+        "enable_dns_support": coerce_bool,
+        "enable_dns_hostnames": coerce_bool,
+    },
+}
+
+
+def render_type_mapping():
+    """Dòng "- aws_instance ↔ AWS::EC2::Instance" cho prompt."""
+    return "\n".join(f"- {tf} ↔ {aws}" for tf, aws in TF_TO_AWS_TYPE.items())
@@ -0,0 +1,99 @@
+# ========================================
+# s3_stream.py — GHI OBJECT S3 DẠNG STREAM: GZIP → MULTIPART UPLOAD
+# ========================================
+# Nội dung được nén ngay khi write(); mỗi khi buffer nén đủ part_size thì upload 1 part rồi bỏ khỏi bộ nhớ
+# → bộ nhớ ~ part_size bất kể report lớn cỡ nào. Object nhỏ hơn 1 part → put_object 1 lần (không multipart).
+# Object có Content-Encoding: gzip nên trình duyệt / S3 website tự giải nén khi hiển thị.
+import gzip
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # giới hạn của S3 cho mọi part trừ part cuối
+
+
+class GzipMultipartWriter:
+    def __init__(self, s3, bucket: str, key: str, content_type: str = "text/html; charset=utf-8",
+                 part_size: int = 8 * 1024 * 1024, compress: bool = True, compresslevel: int = 6):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = max(MIN_PART_SIZE, part_size)
+        self.compress = compress
+        self.buffer = io.BytesIO()
+        self.gzip = gzip.GzipFile(fileobj=self.buffer, mode="wb", compresslevel=compresslevel, mtime=0) \
+            if compress else None
+        self.upload_id = None
+        self.parts = []
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.closed = False
+
+    def object_args(self):
+        args = {"ContentType": self.content_type}
+        if self.compress:
+            args["ContentEncoding"] = "gzip"
+        return args
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.raw_bytes += len(data)
+        (self.gzip or self.buffer).write(data)
+        if self.buffer.tell() >= self.part_size:
+            self.flush_part()
+
+    def writelines(self, chunks):
+        for chunk in chunks:
+            self.write(chunk)
+
+    def flush_part(self):
+        data = self.buffer.getvalue()
+        if not data:
+            return
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.object_args())["UploadId"]
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=number, Body=data)
+        self.parts.append({"PartNumber": number, "ETag": response["ETag"]})
+        self.stored_bytes += len(data)
+        # GzipFile vẫn giữ tham chiếu tới buffer → xóa nội dung tại chỗ thay vì tạo buffer mới
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.gzip is not None:
+            self.gzip.close()
+        data = self.buffer.getvalue()
+        if self.upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=data, **self.object_args())
+            self.stored_bytes += len(data)
+        else:
+            self.flush_part()
+            self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                              MultipartUpload={"Parts": self.parts})
+        self.closed = True
+        logger.info(f"[s3_stream] s3://{self.bucket}/{self.key}: {self.raw_bytes} → {self.stored_bytes} bytes "
+                    f"in {max(1, len(self.parts))} part(s)")
+
+    def abort(self):
+        self.closed = True
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Không để lại multipart upload dở dang (S3 vẫn tính phí lưu các part)
+            self.abort()
+        return False
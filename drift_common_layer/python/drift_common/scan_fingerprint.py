@@ -0,0 +1,70 @@
+# ========================================
+# scan_fingerprint.py — FINGERPRINT NỘI DUNG ĐẦU VÀO CỦA 1 SCAN (DOCUMENT IaC + SNAPSHOT AWS STATE)
+# ========================================
+# Chỉ dùng listing S3 (key + ETag + size), không tải object: ETag đổi khi nội dung object đổi.
+# fingerprint = sha256(version, listing iac_config/{repo_prefix}/, listing aws_state/{region}/)
+# → giống lần scan trước (scanFingerprint trong repoSubscriptions) thì report cũ vẫn đúng, không cần scan lại.
+# version gồm PROMPT_VERSION + SCAN_FINGERPRINT_SALT: đổi prompt/logic detection → mọi repo được scan lại.
+import hashlib
+import logging
+import os
+
+from drift_common.prompt_composer import PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def listing_digest(s3, bucket: str, prefix: str):
+    """sha256 của (key, ETag, size) mọi object dưới prefix; sidecar *.metadata.json bỏ qua như kb_source."""
+    entries = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        page = s3.list_objects_v2(**kwargs)
+        entries.extend(f"{obj['Key']}\0{obj.get('ETag', '')}\0{obj.get('Size', 0)}"
+                       for obj in page.get("Contents", []) if not obj["Key"].endswith(".metadata.json"))
+        if not page.get("IsTruncated"):
+            break
+        kwargs["ContinuationToken"] = page["NextContinuationToken"]
+    digest = hashlib.sha256()
+    for entry in sorted(entries):
+        digest.update(entry.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest(), len(entries)
+
+
+class ScanFingerprinter:
+    """Fingerprint theo repo; listing aws_state/{region}/ dùng chung mọi repo nên chỉ tính 1 lần mỗi lượt."""
+
+    def __init__(self, s3, bucket: str, region: str = "us-east-1", salt: str = ""):
+        self.s3 = s3
+        self.bucket = bucket
+        self.region = region
+        self.version = f"prompt-v{PROMPT_VERSION}:{salt}"
+        self.state_digest = None
+
+    def reset(self):
+        # Gọi đầu mỗi lượt (lambda warm start) để đọc lại snapshot AWS State
+        self.state_digest = None
+
+    def __call__(self, repo_url: str):
+        try:
+            if self.state_digest is None:
+                self.state_digest, _ = listing_digest(self.s3, self.bucket, f"aws_state/{self.region}/")
+            repo_prefix = repo_url.rstrip("/").split("/")[-1]
+            iac_digest, iac_objects = listing_digest(self.s3, self.bucket, f"iac_config/{repo_prefix}/")
+        except Exception as e:
+            # Không đọc được listing → không có fingerprint → scan như bình thường
+            logger.warning(f"[scan_fingerprint] {repo_url}: {e}")
+            return None
+        if not iac_objects:
+            return None
+        return hashlib.sha256(f"{self.version}\n{iac_digest}\n{self.state_digest}".encode("utf-8")).hexdigest()
+
+
+def build_fingerprinter(s3):
+    """Env: SCAN_DEDUP (true), KB_BUCKET (rỗng → tắt), SCAN_STATE_REGION (us-east-1), SCAN_FINGERPRINT_SALT."""
+    bucket = os.environ.get("KB_BUCKET", "")
+    if not bucket or os.environ.get("SCAN_DEDUP", "true").lower() != "true":
+        return None
+    return ScanFingerprinter(s3, bucket, os.environ.get("SCAN_STATE_REGION", "us-east-1"),
+                             os.environ.get("SCAN_FINGERPRINT_SALT", ""))
@@ -0,0 +1,69 @@
+# ========================================
+# scan_metrics.py — ĐO THỜI GIAN / TOKEN / SỐ RESOURCE CỦA TỪNG STAGE, CHUYỂN THEO OUTPUT TỚI REPORT
+# ========================================
+# Mỗi stage gắn "scan_metrics" = {stage: {...}} vào output, kèm metrics của các stage trước tìm được trong event
+# → report lambda có đủ số đo của cả scan và ghi vào repoSubscriptions (scan_scheduler.record_scan_cost).
+# Token là ước lượng (ký tự / 4, như prompt_compaction) của prompt + completion các lần gọi agent thật (không tính cache hit).
+import threading
+import time
+
+from drift_common.prompt_compaction import estimate_tokens
+
+METRICS_KEY = "scan_metrics"
+
+
+class StageMeter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Gọi đầu mỗi lần invoke (lambda warm start giữ lại biến global)
+        with self._lock:
+            self.started = time.perf_counter()
+            self.tokens = 0
+            self.agent_calls = 0
+
+    def add_call(self, prompt: str, completion: str):
+        tokens = estimate_tokens(prompt or "") + estimate_tokens(completion or "")
+        with self._lock:
+            self.tokens += tokens
+            self.agent_calls += 1
+
+    def snapshot(self, **extra):
+        with self._lock:
+            return {"sec": round(time.perf_counter() - self.started, 3), "tokens": self.tokens,
+                    "agent_calls": self.agent_calls, **extra}
+
+
+def collect_scan_metrics(obj, found=None):
+    """Gộp mọi "scan_metrics" trong event (parallel branch lặp lại metrics của stage trước → gộp theo tên stage)."""
+    found = {} if found is None else found
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k == METRICS_KEY and isinstance(v, dict):
+                found.update(v)
+            else:
+                collect_scan_metrics(v, found)
+    elif isinstance(obj, list):
+        for item in obj:
+            collect_scan_metrics(item, found)
+    return found
+
+
+def attach_scan_metrics(output, event, stage: str, meter: StageMeter, **extra):
+    if isinstance(output, dict):
+        metrics = collect_scan_metrics(event)
+        metrics[stage] = meter.snapshot(**extra)
+        output[METRICS_KEY] = metrics
+    return output
+
+
+def summarize_scan_metrics(metrics: dict):
+    """→ {"tokens", "agent_calls", "resources", "stages": {stage: sec}} cho lịch sử scan của repo."""
+    return {
+        "tokens": sum(m.get("tokens", 0) for m in metrics.values()),
+        "agent_calls": sum(m.get("agent_calls", 0) for m in metrics.values()),
+        "resources": max((m.get("resources", 0) for m in metrics.values()), default=0),
+        "stages": {stage: m.get("sec", 0) for stage, m in metrics.items()},
+    }
@@ -0,0 +1,429 @@
+# ========================================
+# scan_scheduler.py — LEASE NHIỀU REPO CÙNG LÚC TRONG repoSubscriptions (THAY CHUỖI ScanNextRepo)
+# ========================================
+# Trạng thái repo: PENDING → SCANNING (có lease) → DONE / FAILED; cycle mới đưa DONE/FAILED về PENDING.
+# - acquire: update có điều kiện scanStatus = PENDING hoặc (SCANNING và lease đã hết hạn) → 2 scheduler chạy
+#   song song không bao giờ lease trùng 1 repo; scan bị treo (lambda timeout, execution chết) tự được lấy lại.
+# - Giới hạn concurrency: đếm lease còn hạn; khi có slot store (kv_store, env SCAN_SLOT_TABLE) mỗi scan giữ
+#   thêm 1 slot "scan-slot#k" (k < concurrency, put_if_absent) → giới hạn cứng kể cả khi nhiều scheduler chạy.
+# - Concurrency mặc định suy ra từ budget Bedrock: RATE_LIMIT_RPS / SCAN_AGENT_RPS_PER_REPO.
+# - Scan lỗi quá SCAN_MAX_ATTEMPTS lần (lease hết hạn liên tiếp) → FAILED, không chặn slot mãi.
+# - Thứ tự lease (SCAN_ORDER=sejf): shortest-expected-job-first theo chi phí dự đoán từ lịch sử scan của repo
+#   (EWMA thời gian lease → xong, token, số resource; ghi khi trả lease), trừ đi SCAN_AGING_FACTOR × thời gian đã
+#   chờ → repo nhỏ có report sớm, repo lớn chờ càng lâu càng được ưu tiên nên không bị bỏ đói.
+# - Dedup (scan_fingerprint): fingerprint đầu vào lúc lease được giữ theo lease, scan xong → scanFingerprint +
+#   lastReportUrl; lần sau fingerprint không đổi → repo DONE ngay với report cũ, không start execution, không tốn slot.
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from drift_common.kv_store import EXPIRES_AT, DynamoDBStore, from_dynamodb, to_dynamodb
+
+logger = logging.getLogger(__name__)
+
+PENDING = "PENDING"
+SCANNING = "SCANNING"
+DONE = "DONE"
+FAILED = "FAILED"
+LEASE_FIELDS = ("leaseId", "leaseExpiresAt", "scanSlot", "leaseFingerprint")
+SLOT_PREFIX = "scan-slot#"
+# Lease tối thiểu = SCAN_LEASE_SEC; repo có lịch sử: ít nhất gấp 3 lần thời gian scan dự đoán
+LEASE_COST_MULTIPLIER = 3
+
+
+def format_time(epoch: float):
+    # Cùng định dạng lastScanAt/updatedAt mà report lambda vẫn ghi
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def lease_expired(item: dict, now: float):
+    return float(item.get("leaseExpiresAt") or 0) <= now
+
+
+def is_active(item: dict, now: float):
+    return item.get("scanStatus") == SCANNING and not lease_expired(item, now)
+
+
+def is_candidate(item: dict, now: float):
+    return item.get("scanStatus") == PENDING or (item.get("scanStatus") == SCANNING and lease_expired(item, now))
+
+
+class InMemoryRepoStore:
+    """Stand-in local cho DynamoDBRepoStore (test, local pipeline, benchmark)."""
+
+    def __init__(self, repo_urls=()):
+        self.items = {}
+        self._lock = threading.Lock()
+        for repo_url in repo_urls:
+            self.add_repo(repo_url)
+
+    def add_repo(self, repo_url: str, **fields):
+        with self._lock:
+            self.items[repo_url] = {"repoUrl": repo_url, "scanStatus": PENDING, **fields}
+
+    def scan_repos(self):
+        with self._lock:
+            return [dict(item) for item in self.items.values()]
+
+    def acquire(self, repo_url: str, lease_id: str, expires_at: float, now: float, slot=None, fingerprint=None):
+        with self._lock:
+            item = self.items.get(repo_url)
+            if item is None or not is_candidate(item, now):
+                return False
+            item.update(scanStatus=SCANNING, leaseId=lease_id, leaseExpiresAt=int(expires_at), scanStartedAt=int(now),
+                        scanAttempts=item.get("scanAttempts", 0) + 1, updatedAt=format_time(now))
+            for field, value in (("scanSlot", slot), ("leaseFingerprint", fingerprint)):
+                item.pop(field, None)
+                if value is not None:
+                    item[field] = value
+            return True
+
+    def release(self, repo_url: str, lease_id, status: str, now: float):
+        """→ item trước khi release (None nếu repo không còn lease này)."""
+        with self._lock:
+            item = self.items.get(repo_url)
+            if item is None or item.get("scanStatus") != SCANNING:
+                return None
+            if lease_id is not None and item.get("leaseId") != lease_id:
+                return None
+            old = dict(item)
+            for field in LEASE_FIELDS:
+                item.pop(field, None)
+            item.update(scanStatus=status, updatedAt=format_time(now))
+            if status == DONE:
+                item.update(lastScanAt=format_time(now), scanAttempts=0)
+            return old
+
+    def reset(self, repo_url: str, from_status: str, now: float):
+        with self._lock:
+            item = self.items.get(repo_url)
+            if item is None or item.get("scanStatus") != from_status:
+                return False
+            item.update(scanStatus=PENDING, scanAttempts=0, queuedAt=int(now), updatedAt=format_time(now))
+            return True
+
+    def record(self, repo_url: str, fields: dict):
+        with self._lock:
+            if repo_url in self.items:
+                self.items[repo_url].update(fields)
+
+
+class DynamoDBRepoStore:
+    """Bảng repoSubscriptions (partition key repoUrl); mọi chuyển trạng thái là update_item có điều kiện."""
+
+    def __init__(self, table, key_name: str = "repoUrl"):
+        self.table = table
+        self.key_name = key_name
+
+    def scan_repos(self):
+        items, kwargs = [], {"ConsistentRead": True}
+        while True:
+            response = self.table.scan(**kwargs)
+            items.extend(from_dynamodb(item) for item in response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def conditional_update(self, repo_url, **kwargs):
+        try:
+            return self.table.update_item(Key={self.key_name: repo_url}, **kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return None
+
+    def acquire(self, repo_url: str, lease_id: str, expires_at: float, now: float, slot=None, fingerprint=None):
+        values = {":pending": PENDING, ":scanning": SCANNING, ":lease": lease_id, ":exp": int(expires_at),
+                  ":now": int(now), ":one": 1, ":t": format_time(now)}
+        update = "SET scanStatus = :scanning, leaseId = :lease, leaseExpiresAt = :exp, scanStartedAt = :now, " \
+                 "updatedAt = :t"
+        removed = []
+        for field, placeholder, value in (("scanSlot", ":slot", slot), ("leaseFingerprint", ":fp", fingerprint)):
+            if value is not None:
+                update += f", {field} = {placeholder}"
+                values[placeholder] = value
+            else:
+                removed.append(field)
+        if removed:
+            update += " REMOVE " + ", ".join(removed)
+        response = self.conditional_update(
+            repo_url,
+            UpdateExpression=update + " ADD scanAttempts :one",
+            ConditionExpression=f"attribute_exists({self.key_name}) AND (scanStatus = :pending OR "
+                                "(scanStatus = :scanning AND leaseExpiresAt <= :now))",
+            ExpressionAttributeValues=values,
+        )
+        return response is not None
+
+    def release(self, repo_url: str, lease_id, status: str, now: float):
+        values = {":scanning": SCANNING, ":status": status, ":t": format_time(now)}
+        condition = "scanStatus = :scanning"
+        if lease_id is not None:
+            condition += " AND leaseId = :lease"
+            values[":lease"] = lease_id
+        update = "SET scanStatus = :status, updatedAt = :t"
+        if status == DONE:
+            update += ", lastScanAt = :t, scanAttempts = :zero"
+            values[":zero"] = 0
+        response = self.conditional_update(
+            repo_url,
+            UpdateExpression=update + " REMOVE " + ", ".join(LEASE_FIELDS),
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_OLD",
+        )
+        return None if response is None else from_dynamodb(response.get("Attributes", {}))
+
+    def reset(self, repo_url: str, from_status: str, now: float):
+        response = self.conditional_update(
+            repo_url,
+            UpdateExpression="SET scanStatus = :pending, scanAttempts = :zero, queuedAt = :now, updatedAt = :t",
+            ConditionExpression="scanStatus = :from",
+            ExpressionAttributeValues={":pending": PENDING, ":zero": 0, ":now": int(now), ":t": format_time(now),
+                                       ":from": from_status},
+        )
+        return response is not None
+
+    def record(self, repo_url: str, fields: dict):
+        names = {f"#f{i}": name for i, name in enumerate(fields)}
+        self.table.update_item(
+            Key={self.key_name: repo_url},
+            UpdateExpression="SET " + ", ".join(f"#f{i} = :v{i}" for i in range(len(fields))),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={f":v{i}": to_dynamodb(v) for i, v in enumerate(fields.values())},
+        )
+
+
+def ewma(previous, value: float, alpha: float):
+    return round(value if previous is None else alpha * value + (1 - alpha) * float(previous), 3)
+
+
+def critical_path_sec(stages: dict):
+    # Stage song song ("detection.normal", "detection.policy", ...) → lấy nhánh lâu nhất của mỗi stage
+    longest = {}
+    for stage, sec in stages.items():
+        group = stage.split(".")[0]
+        longest[group] = max(longest.get(group, 0), sec)
+    return sum(longest.values())
+
+
+def scan_cost_fields(old: dict, summary: dict, now: float, alpha: float):
+    """Lịch sử chi phí của repo sau 1 scan xong. summary: scan_metrics.summarize_scan_metrics (có thể rỗng)."""
+    stages = summary.get("stages") or {}
+    # Thời gian thật từ lúc lease tới lúc xong (gồm cả chờ rate limit); scan không qua scheduler → cộng các stage
+    sec = now - float(old["scanStartedAt"]) if old.get("scanStartedAt") else critical_path_sec(stages)
+    fields = {
+        "scanCount": int(old.get("scanCount", 0)) + 1,
+        "lastScanSec": round(sec, 3),
+        "costSec": ewma(old.get("costSec"), sec, alpha),
+    }
+    if summary:
+        fields.update(lastScanTokens=summary.get("tokens", 0), stageSec=stages,
+                      costTokens=ewma(old.get("costTokens"), summary.get("tokens", 0), alpha))
+        if summary.get("resources"):
+            fields["resourceCount"] = summary["resources"]
+    return fields
+
+
+def predict_cost(item: dict, default_sec: float):
+    return float(item["costSec"]) if item.get("costSec") is not None else default_sec
+
+
+def release_scan(repos, slots, repo_url: str, lease_id=None, status: str = DONE, now: float = None,
+                 summary: dict = None, alpha: float = None, report_url: str = None, failed_detections=None):
+    """Trả lease của repo (và slot nếu có). lease_id None → trả lease hiện tại bất kể ai giữ.
+    Scan xong (DONE) → ghi lịch sử chi phí (summary: số đo các stage, xem scan_metrics) và report_url
+    kèm fingerprint đầu vào của lease (dedup lần scan sau). Có detection lỗi (failed_detections) → report
+    thiếu, không ghi report_url và xóa fingerprint để lần sau scan lại."""
+    now = time.time() if now is None else now
+    old = repos.release(repo_url, lease_id, status, now)
+    if old is None:
+        logger.warning(f"[scan_scheduler] {repo_url}: lease {lease_id} no longer held, nothing to release")
+        return False
+    if slots is not None and old.get("scanSlot") is not None:
+        slots.delete_if(f"{SLOT_PREFIX}{old['scanSlot']}", "leaseId", old.get("leaseId"))
+    logger.info(f"[scan_scheduler] {repo_url}: {SCANNING} → {status}")
+    if status == DONE:
+        alpha = float(os.environ.get("SCAN_COST_ALPHA", "0.5")) if alpha is None else alpha
+        fields = scan_cost_fields(old, summary or {}, now, alpha)
+        if failed_detections:
+            logger.info(f"[scan_scheduler] {repo_url}: detection failed for {failed_detections}, report not reusable")
+            fields.update(scanFingerprint="")
+        elif report_url:
+            # Lease không có fingerprint (dedup tắt) → xóa fingerprint cũ để không ghép nhầm với report mới
+            fields.update(lastReportUrl=report_url, scanFingerprint=old.get("leaseFingerprint") or "")
+        repos.record(repo_url, fields)
+        logger.info(f"[scan_scheduler] {repo_url}: cost {fields}")
+    return True
+
+
+class ScanScheduler:
+    def __init__(self, repos, start_scan, concurrency: int, lease_sec: int = 3600, max_attempts: int = 3,
+                 slots=None, clock=time.time, order_by: str = "sejf", aging: float = 1.0,
+                 default_cost_sec: float = 300.0, cost_alpha: float = 0.5, fingerprint=None):
+        """start_scan(repo_url, lease_id): khởi động 1 scan (vd. Step Functions execution).
+        order_by: "sejf" (chi phí dự đoán − aging × thời gian chờ) hoặc "oldest" (lastScanAt cũ nhất trước).
+        fingerprint(repo_url) → str | None: fingerprint đầu vào của scan (scan_fingerprint), None = không dedup."""
+        self.repos = repos
+        self.start_scan = start_scan
+        self.concurrency = max(1, concurrency)
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.slots = slots
+        self.clock = clock
+        self.order_by = order_by
+        self.aging = aging
+        self.default_cost_sec = default_cost_sec
+        self.cost_alpha = cost_alpha
+        self.fingerprint = fingerprint
+
+    def order(self, candidates, items, now: float):
+        if self.order_by != "sejf":
+            # Repo chưa scan lần nào trước, sau đó lastScanAt cũ nhất
+            return sorted(candidates, key=lambda item: item.get("lastScanAt") or "")
+        # Repo chưa có lịch sử → chi phí trung vị của các repo đã biết
+        known = sorted(float(item["costSec"]) for item in items if item.get("costSec") is not None)
+        default = known[len(known) // 2] if known else self.default_cost_sec
+
+        def priority(item):
+            waited = now - float(item["queuedAt"]) if item.get("queuedAt") else 0.0
+            return predict_cost(item, default) - self.aging * waited, item.get("lastScanAt") or ""
+        return sorted(candidates, key=priority)
+
+    def lease_for(self, item: dict):
+        # Repo lớn (lịch sử scan lâu) được lease dài hơn → không bị coi là treo giữa chừng;
+        # lease trước đã hết hạn (scan chưa có lịch sử nhưng lâu hơn lease) → gấp đôi mỗi lần lấy lại
+        expired_attempts = item.get("scanAttempts", 0) if item.get("scanStatus") == SCANNING else 0
+        return max(self.lease_sec * 2 ** expired_attempts, LEASE_COST_MULTIPLIER * predict_cost(item, 0.0))
+
+    def take_slot(self, lease_id: str, repo_url: str, now: float, lease_sec: float):
+        for slot in range(self.concurrency):
+            item = {"leaseId": lease_id, "repoUrl": repo_url, EXPIRES_AT: int(now + lease_sec)}
+            if self.slots.put_if_absent(f"{SLOT_PREFIX}{slot}", item):
+                return slot
+        return None
+
+    def skip_unchanged(self, item: dict, now: float):
+        """Đầu vào giống lần scan trước → DONE ngay với report cũ. → (skipped, fingerprint)."""
+        fingerprint = self.fingerprint(item["repoUrl"]) if self.fingerprint else None
+        if not fingerprint or fingerprint != item.get("scanFingerprint") or not item.get("lastReportUrl"):
+            return False, fingerprint
+        # Lease rồi trả ngay: scheduler khác đang lease repo này thì bỏ qua
+        lease_id = uuid.uuid4().hex
+        if not self.repos.acquire(item["repoUrl"], lease_id, now + self.lease_sec, now):
+            return False, None
+        self.repos.release(item["repoUrl"], lease_id, DONE, now)
+        logger.info(f"[scan_scheduler] {item['repoUrl']}: unchanged since last scan, reuse {item['lastReportUrl']}")
+        return True, fingerprint
+
+    def free_slot(self, slot, lease_id: str):
+        if slot is not None:
+            self.slots.delete_if(f"{SLOT_PREFIX}{slot}", "leaseId", lease_id)
+
+    def fill(self, sweep: bool = False):
+        """Lease repo cho tới khi đủ concurrency slot → {"active", "started", "failed", "skipped", "waiting"}.
+        sweep: hết slot vẫn duyệt tiếp mọi repo để đánh dấu DONE các repo không đổi (đầu cycle)."""
+        now = self.clock()
+        if hasattr(self.fingerprint, "reset"):
+            self.fingerprint.reset()
+        items = self.repos.scan_repos()
+        active = sum(1 for item in items if is_active(item, now))
+        free = self.concurrency - active
+        started, failed, skipped = [], [], []
+        candidates = self.order([item for item in items if is_candidate(item, now)], items, now)
+        for item in candidates:
+            if free <= 0 and not (sweep and self.fingerprint):
+                break
+            repo_url = item["repoUrl"]
+            unchanged, fingerprint = self.skip_unchanged(item, now)
+            if unchanged:
+                skipped.append(repo_url)
+                continue
+            if free <= 0:
+                continue
+            if item.get("scanStatus") == SCANNING and item.get("scanAttempts", 0) >= self.max_attempts:
+                # Lease hết hạn quá nhiều lần → bỏ repo khỏi cycle này
+                if release_scan(self.repos, self.slots, repo_url, item.get("leaseId"), FAILED, now):
+                    failed.append(repo_url)
+                continue
+            lease_id = uuid.uuid4().hex
+            lease_sec = self.lease_for(item)
+            slot = None
+            if self.slots is not None:
+                slot = self.take_slot(lease_id, repo_url, now, lease_sec)
+                if slot is None:
+                    # Scheduler khác đã lấy hết slot (sweep vẫn tiếp tục đánh dấu repo không đổi)
+                    free = 0
+                    continue
+            if not self.repos.acquire(repo_url, lease_id, now + lease_sec, now, slot, fingerprint):
+                # Scheduler khác vừa lease repo này
+                self.free_slot(slot, lease_id)
+                continue
+            try:
+                self.start_scan(repo_url, lease_id)
+            except Exception as e:
+                logger.error(f"[scan_scheduler] start scan {repo_url} failed: {e}")
+                self.repos.release(repo_url, lease_id, PENDING, now)
+                self.free_slot(slot, lease_id)
+                continue
+            started.append(repo_url)
+            free -= 1
+        waiting = len(candidates) - len(started) - len(failed) - len(skipped)
+        logger.info(f"[scan_scheduler] active={active} started={len(started)} failed={len(failed)} "
+                    f"skipped={len(skipped)} waiting={waiting} limit={self.concurrency}")
+        return {"active": active + len(started), "started": started, "failed": failed, "skipped": skipped,
+                "waiting": waiting}
+
+    def start_cycle(self):
+        """Cycle mới (vd. nightly): DONE/FAILED → PENDING rồi fill."""
+        now = self.clock()
+        reset = sum(1 for item in self.repos.scan_repos() if item.get("scanStatus") in (DONE, FAILED)
+                    and self.repos.reset(item["repoUrl"], item["scanStatus"], now))
+        logger.info(f"[scan_scheduler] new cycle: {reset} repo(s) back to {PENDING}")
+        return {"reset": reset, **self.fill(sweep=True)}
+
+    def finish(self, repo_url: str, lease_id=None, status: str = DONE, summary: dict = None, report_url: str = None,
+               failed_detections=None):
+        return release_scan(self.repos, self.slots, repo_url, lease_id, status, self.clock(), summary,
+                            self.cost_alpha, report_url, failed_detections)
+
+
+def scan_concurrency():
+    """SCAN_CONCURRENCY nếu có; không thì RATE_LIMIT_RPS / SCAN_AGENT_RPS_PER_REPO (giới hạn SCAN_MAX_CONCURRENCY)."""
+    explicit = os.environ.get("SCAN_CONCURRENCY", "")
+    if explicit:
+        return max(1, int(explicit))
+    budget_rps = float(os.environ.get("RATE_LIMIT_RPS", "2"))
+    per_repo_rps = float(os.environ.get("SCAN_AGENT_RPS_PER_REPO", "0.25"))
+    limit = int(os.environ.get("SCAN_MAX_CONCURRENCY", "25"))
+    return max(1, min(limit, int(budget_rps / per_repo_rps)))
+
+
+def build_slot_store():
+    # Slot store dùng chung giữa các scheduler; rỗng → chỉ đếm lease (đủ khi scheduler có reserved concurrency 1)
+    table_name = os.environ.get("SCAN_SLOT_TABLE", "")
+    return DynamoDBStore.from_table_name(table_name) if table_name else None
+
+
+def build_scan_scheduler(repos, start_scan, slots=None, fingerprint=None):
+    """Cấu hình từ env: SCAN_CONCURRENCY / SCAN_AGENT_RPS_PER_REPO (0.25) / SCAN_MAX_CONCURRENCY (25),
+    SCAN_LEASE_SEC (3600), SCAN_MAX_ATTEMPTS (3), SCAN_SLOT_TABLE,
+    SCAN_ORDER (sejf | oldest), SCAN_AGING_FACTOR (1.0), SCAN_DEFAULT_COST_SEC (300), SCAN_COST_ALPHA (0.5).
+    fingerprint: xem scan_fingerprint.build_fingerprinter (env SCAN_DEDUP, KB_BUCKET)."""
+    return ScanScheduler(
+        repos, start_scan,
+        concurrency=scan_concurrency(),
+        lease_sec=int(os.environ.get("SCAN_LEASE_SEC", "3600")),
+        max_attempts=int(os.environ.get("SCAN_MAX_ATTEMPTS", "3")),
+        slots=build_slot_store() if slots is None else slots,
+        order_by=os.environ.get("SCAN_ORDER", "sejf"),
+        aging=float(os.environ.get("SCAN_AGING_FACTOR", "1.0")),
+        default_cost_sec=float(os.environ.get("SCAN_DEFAULT_COST_SEC", "300")),
+        cost_alpha=float(os.environ.get("SCAN_COST_ALPHA", "0.5")),
+        fingerprint=fingerprint,
+    )
@@ -0,0 +1,115 @@
+# ========================================
+# sharding.py — CHIA INPUT DETECTION THÀNH SHARD THEO TOKEN, GHÉP KẾT QUẢ BẰNG TOP-K TOÀN CỤC
+# ========================================
+# Repo lớn: 1 prompt chứa mọi resource → tràn context, agent chỉ trả "top 50" trong phần nó kịp xem.
+# Shard: mỗi đơn vị = 1 địa chỉ IaC kèm cặp đã ghép (IaC ↔ State) / 1 identifier State lẻ, không bao giờ tách cặp;
+#        đơn vị sắp theo resource type (resource liên quan nằm chung shard) rồi xếp tham lam tới ngân sách token.
+# Merge: mỗi shard sắp theo risk_score, k-way merge bằng heap, bỏ trùng resource_address, dừng ở K.
+# Ngân sách shard mặc định = context của model − phần cố định của prompt − phần dành cho KB/output:
+# input vừa 1 lời gọi thì không chia (chia thêm chỉ tốn lời gọi agent và quota rate limiter).
+import heapq
+import json
+
+from drift_common.incremental import resource_key
+from drift_common.prompt_compaction import estimate_tokens
+from drift_common.prompt_composer import CONTEXT_TEMPLATE, STATIC_PREFIX, TASKS, render_task
+from drift_common.relevance import resource_types_of
+from drift_common.resource_types import ATTRIBUTE_RISK
+
+RISK_SCORE = {"high": 100, "medium": 50, "low": 10}
+# Attribute rủi ro cao được nhắc trong issue → cộng điểm (tối đa 9, không vượt mức risk kế trên)
+HIGH_RISK_ATTRIBUTES = tuple(attr for attr, risk in ATTRIBUTE_RISK.items() if risk == "high")
+SHARD_FIELDS = ("iac_data", "state_data", "resource_pairs", "unmatched_iac")
+
+
+def fixed_prompt_tokens():
+    """Token của phần prompt không phụ thuộc dữ liệu: prefix tĩnh + task dài nhất + khung CONTEXT."""
+    empty = {key: "" for key in ("repo_url", "repo_prefix", "region", "resource_pairs", "unmatched_iac",
+                                 "iac_data", "state_data", "cicd_drift")}
+    task = max((render_task(t) for t in TASKS), key=len)
+    return estimate_tokens(f"{STATIC_PREFIX}\n\n{task}\n\n{CONTEXT_TEMPLATE.format(**empty)}")
+
+
+def shard_token_budget(context_tokens: int, reserved_tokens: int):
+    """Token dữ liệu tối đa mỗi shard; reserved_tokens = kết quả tra KB + output của agent."""
+    return max(1, context_tokens - reserved_tokens - fixed_prompt_tokens())
+
+
+def shard_units(prompt_args: dict):
+    """→ [{iac_data, state_data, resource_pairs, unmatched_iac}], mỗi phần tử là 1 resource (hoặc 1 cặp)."""
+    state_data = list(dict.fromkeys(prompt_args.get("state_data") or []))
+    states = set(state_data)
+    unmatched = set(prompt_args.get("unmatched_iac") or [])
+    pairs_by_iac = {}
+    for pair in prompt_args.get("resource_pairs") or []:
+        pairs_by_iac.setdefault(pair[0], []).append(pair)
+
+    units = []
+    for address in dict.fromkeys(prompt_args.get("iac_data") or []):
+        pairs = pairs_by_iac.pop(address, [])
+        units.append({"iac_data": [address], "state_data": [p[1] for p in pairs if p[1] in states],
+                      "resource_pairs": pairs, "unmatched_iac": [address] if address in unmatched else []})
+    for pairs in pairs_by_iac.values():
+        # Cặp có IaC không nằm trong iac_data (vd. đã bị lọc) vẫn đi cùng identifier State của nó
+        units.append({"iac_data": [], "state_data": [p[1] for p in pairs if p[1] in states],
+                      "resource_pairs": pairs, "unmatched_iac": []})
+    used = {state_id for unit in units for state_id in unit["state_data"]}
+    units.extend({"iac_data": [], "state_data": [state_id], "resource_pairs": [], "unmatched_iac": []}
+                 for state_id in state_data if state_id not in used)
+    return units
+
+
+def unit_type(unit: dict):
+    value = (unit["iac_data"] or unit["state_data"] or [p[0] for p in unit["resource_pairs"]] or [""])[0]
+    types = resource_types_of(value) if value else []
+    # AWS type → Terraform type nếu có để IaC và State cùng type đứng cạnh nhau
+    return types[-1] if types else ""
+
+
+def shard_prompt_args(prompt_args: dict, max_tokens: int):
+    """Chia input full_scan thành các prompt_args con ≤ max_tokens (ước lượng); vừa 1 shard → [prompt_args]."""
+    if max_tokens <= 0 or not isinstance(prompt_args.get("iac_data"), list):
+        return [prompt_args]
+    units = shard_units(prompt_args)
+    sizes = [estimate_tokens(json.dumps(unit, ensure_ascii=False, separators=(",", ":"))) for unit in units]
+    if sum(sizes) <= max_tokens:
+        return [prompt_args]
+
+    shards, current, current_tokens = [], [], 0
+    for size, unit in sorted(zip(sizes, units), key=lambda item: unit_type(item[1])):
+        if current and current_tokens + size > max_tokens:
+            shards.append(current)
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += size
+    if current:
+        shards.append(current)
+    return [{**prompt_args, **{field: [v for unit in shard for v in unit[field]] for field in SHARD_FIELDS}}
+            for shard in shards]
+
+
+def risk_score(drift: dict):
+    risk = str(drift.get("risk", "medium")).lower()
+    issue = str(drift.get("issue", "")).lower()
+    mentioned = sum(1 for attr in HIGH_RISK_ATTRIBUTES if attr in issue)
+    return RISK_SCORE.get(risk, RISK_SCORE["medium"]) + min(mentioned, 9)
+
+
+def rank_key(drift: dict):
+    # Điểm cao trước; hòa → theo địa chỉ rồi issue để thứ tự không phụ thuộc shard nào trả về trước
+    return -risk_score(drift), str(resource_key(drift.get("resource_address", ""))), str(drift.get("issue", ""))
+
+
+def merge_top_k(shard_drifts, k: int):
+    """shard_drifts: [[drift, ...] của từng shard] → top-K toàn cục, mỗi resource_address 1 lần."""
+    ranked = [sorted((d for d in drifts or [] if isinstance(d, dict)), key=rank_key) for drifts in shard_drifts]
+    merged, seen = [], set()
+    for drift in heapq.merge(*ranked, key=rank_key):
+        address = resource_key(drift.get("resource_address", ""))
+        if address in seen:
+            continue
+        seen.add(address)
+        merged.append(drift)
+        if len(merged) >= k:
+            break
+    return merged
@@ -0,0 +1,62 @@
+# ========================================
+# short_circuit.py — BỎ QUA STAGE KHI RUN "SẠCH" (KHÔNG CÓ DRIFT)
+# ========================================
+# Policy (env SHORT_CIRCUIT, mặc định "detection,remediation,report"; "off" = tắt):
+#   detection  : parser báo clean (CICD log hợp lệ, drifted = [] và unmanaged = []) → không chạy 7 detector
+#   remediation: mọi drifted_resources đều rỗng và không detector nào lỗi → không gom remediation
+#   report     : 2 report remediation không có suggestion → report "clean" dựng sẵn, không gọi agent
+# Mỗi lambda tự kiểm tra (an toàn kể cả khi state machine chưa có Choice state); state machine / local runner
+# dùng cùng các hàm này để bỏ hẳn việc invoke stage.
+import os
+
+from drift_common.remediation import collect_detection_reports
+
+STAGES = ("detection", "remediation", "report")
+# Detector không parse được output agent (throttling, output bị cắt) → report rỗng nhưng KHÔNG clean
+PARSE_FAILED_SUMMARY = "No drift detected or parsing failed"
+
+
+def load_short_circuit_policy():
+    value = os.environ.get("SHORT_CIRCUIT", ",".join(STAGES)).strip().lower()
+    if value in ("", "off", "none", "false"):
+        return frozenset()
+    return frozenset(s.strip() for s in value.split(",") if s.strip() in STAGES)
+
+
+def cicd_drift_is_clean(cicd_drift):
+    return isinstance(cicd_drift, dict) and cicd_drift.get("drifted") == [] and cicd_drift.get("unmanaged") == []
+
+
+def clean_detection_report(detection_type: str, type_: str):
+    return {
+        "detection_type": detection_type,
+        "type": type_,
+        "drifted_resources": [],
+        "summary": "No drift: parser found no drifted or unmanaged resources",
+        "source": "short_circuit",
+    }
+
+
+def detection_failed(report: dict):
+    return report.get("failed") is True or report.get("summary") == PARSE_FAILED_SUMMARY
+
+
+def failed_detections(event):
+    """Detection type có report lỗi (thiếu kết quả) trong event."""
+    return sorted(t for t, r in collect_detection_reports(event).items() if detection_failed(r))
+
+
+def detections_are_clean(event):
+    reports = collect_detection_reports(event)
+    return bool(reports) and all(not r["drifted_resources"] and not detection_failed(r) for r in reports.values())
+
+
+def clean_remediation(remediation_type: str):
+    return {"remediation_type": remediation_type, "summary": "No remediation needed", "source": "short_circuit"}
+
+
+def remediation_is_clean(remediation_report):
+    if not isinstance(remediation_report, dict) or remediation_report.get("failed_detections"):
+        return False
+    return not any(isinstance(section, dict) and section.get("remediation_suggestions")
+                   for section in remediation_report.values())
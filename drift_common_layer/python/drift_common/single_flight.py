@@ -0,0 +1,115 @@
+# ========================================
+# single_flight.py — GỘP CÁC LỜI GỌI AGENT TRÙNG PROMPT ĐANG CHẠY CÙNG LÚC
+# ========================================
+# - Trong 1 process: lời gọi đầu tiên (leader) gọi agent, các lời gọi cùng key đến sau chờ và nhận chung kết quả/lỗi
+# - Giữa các worker (tùy chọn): leader giữ lease trong kv_store; worker khác poll lookup() (tầng cache shared)
+#   cho tới khi có kết quả, lease được trả (leader lỗi / output không cache được) hoặc hết hạn → tự gọi
+import logging
+import threading
+import time
+import uuid
+
+from drift_common.kv_store import EXPIRES_AT
+
+logger = logging.getLogger(__name__)
+
+
+class InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, lease_store=None, lease_ttl_sec: int = 300, poll_interval_sec: float = 0.5,
+                 key_prefix: str = "agent-lease#"):
+        self.lease_store = lease_store
+        self.lease_ttl_sec = lease_ttl_sec
+        self.poll_interval_sec = poll_interval_sec
+        self.key_prefix = key_prefix
+        self.owner = uuid.uuid4().hex
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "coalesced": 0, "lease_waits": 0, "lease_hits": 0}
+
+    def do(self, key: str, call, lookup=None):
+        """Chạy call() 1 lần cho mỗi key đang in-flight; lookup() đọc kết quả worker khác đã ghi (None = chưa có)."""
+        with self._lock:
+            in_flight = self._calls.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._calls[key] = InFlightCall()
+            self.stats["leaders" if leader else "coalesced"] += 1
+
+        if not leader:
+            logger.info(f"[single_flight] wait for in-flight call {key[:12]}")
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value
+
+        try:
+            in_flight.value = self._call_with_lease(key, call, lookup)
+            return in_flight.value
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            in_flight.done.set()
+
+    def _call_with_lease(self, key, call, lookup):
+        if self.lease_store is None:
+            return call()
+        lease_key = self.key_prefix + key
+        deadline = time.time() + self.lease_ttl_sec
+        while time.time() < deadline:
+            if self._acquire(lease_key):
+                try:
+                    return call()
+                finally:
+                    self._release(lease_key)
+            # Worker khác đang gọi cùng prompt → chờ kết quả qua lookup
+            self._count("lease_waits")
+            while time.time() < deadline:
+                time.sleep(self.poll_interval_sec)
+                # Đọc lease trước lookup: leader ghi cache rồi mới trả lease
+                released = self._lease_released(lease_key)
+                value = lookup() if lookup else None
+                if value is not None:
+                    self._count("lease_hits")
+                    return value
+                if released:
+                    break
+        logger.warning(f"[single_flight] lease wait timed out for {key[:12]}, call directly")
+        return call()
+
+    def _acquire(self, lease_key):
+        try:
+            return self.lease_store.put_if_absent(lease_key, {
+                "owner": self.owner,
+                EXPIRES_AT: int(time.time() + self.lease_ttl_sec),
+            })
+        except Exception as e:
+            # Store lỗi → không chặn lời gọi agent
+            logger.warning(f"[single_flight] acquire lease error: {e}")
+            return True
+
+    def _release(self, lease_key):
+        try:
+            self.lease_store.delete_if(lease_key, "owner", self.owner)
+        except Exception as e:
+            logger.warning(f"[single_flight] release lease error: {e}")
+
+    def _lease_released(self, lease_key):
+        try:
+            return self.lease_store.get(lease_key) is None
+        except Exception as e:
+            logger.warning(f"[single_flight] read lease error: {e}")
+            return True
+
+    def _count(self, metric):
+        with self._lock:
+            self.stats[metric] += 1
@@ -5,6 +5,23 @@ import boto3
 import logging
 import time
 import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from drift_common.agent_cache import KB_FINGERPRINT_KEY, build_agent_cache, find_kb_fingerprint
+from drift_common.attribute_diff import diff_iac_and_state
+from drift_common.incremental import (
+    build_scan_cache, changed_keys, filter_to_keys, group_findings, merge_findings, merged_summary)
+from drift_common.json_repair import extract_json_from_text, is_complete_json
+from drift_common.json_stream import JsonStreamParser
+from drift_common.kb_source import load_kb_documents
+from drift_common.prompt_compaction import KEY_LEGEND, compact_prompt_args
+from drift_common.prompt_composer import PREFIX_HASH, PROMPT_VERSION, TASKS, compose_prompt
+from drift_common.rate_limiter import build_rate_limiter
+from drift_common.relevance import filter_inputs, load_relevance_filters, nothing_relevant
+from drift_common.scan_metrics import StageMeter, attach_scan_metrics
+from drift_common.sharding import merge_top_k, shard_prompt_args, shard_token_budget
+from drift_common.short_circuit import PARSE_FAILED_SUMMARY, clean_detection_report, load_short_circuit_policy
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -14,446 +31,78 @@ REGION = os.environ.get("AWS_REGION", "us-east-1")
 AGENT_ID = os.environ.get("AGENT_ID", "LBQSCKGFJM")
 AGENT_ALIAS_ID = os.environ.get("AGENT_ALIAS_ID", "NTCPG9HUZF")
 DETECTION_TYPE = os.environ.get("DETECTION_TYPE", "behavioral")
+# VD: "normal,policy,version" hoặc "all" → chạy nhiều detection trong 1 lần invoke
+DETECTION_TYPES = os.environ.get("DETECTION_TYPES", "")
+MAX_CONCURRENT_DETECTIONS = int(os.environ.get("MAX_CONCURRENT_DETECTIONS", "7"))
+# Normal drift so sánh attribute tại chỗ từ document nguồn của KB (bucket S3), không cần agent
+LOCAL_NORMAL_DIFF = os.environ.get("LOCAL_NORMAL_DIFF", "true").lower() == "true"
+KB_BUCKET = os.environ.get("KB_BUCKET", "")
+MAX_LOCAL_DRIFTS = int(os.environ.get("MAX_LOCAL_DRIFTS", "50"))
+# "template": remediation sinh bằng template; "agent": agent chỉ viết lại remediation text
+LOCAL_DIFF_REMEDIATION = os.environ.get("LOCAL_DIFF_REMEDIATION", "template")
+# Mỗi detection type chỉ nhận resource liên quan (ghi đè qua env RELEVANCE_FILTERS_JSON)
+RELEVANCE_FILTERS = load_relevance_filters()
+# Dữ liệu trong prompt dạng JSON minify, bỏ giá trị rỗng/trùng; PROMPT_KEY_LEGEND rút gọn key kèm legend
+PROMPT_COMPACTION = os.environ.get("PROMPT_COMPACTION", "true").lower() == "true"
+PROMPT_KEY_LEGEND = os.environ.get("PROMPT_KEY_LEGEND", "false").lower() == "true"
+COMPACTED_FIELDS = ("iac_data", "state_data", "cicd_drift", "resource_pairs", "unmatched_iac")
+# Parser báo clean (CICD log không có drift) → trả report rỗng, không gọi agent (env SHORT_CIRCUIT)
+SHORT_CIRCUIT = load_short_circuit_policy()
+# Detection chỉ phân tích resource đổi từ lần scan trước (parser gửi delta khi có SCAN_CACHE_BUCKET);
+# cross drift phụ thuộc quan hệ giữa các resource → mặc định luôn chạy full
+INCREMENTAL_TYPES = [t.strip() for t in os.environ.get(
+    "INCREMENTAL_TYPES", ",".join(t for t in TASKS if t != "cross")).split(",") if t.strip()]
+# Input lớn → chia shard ≤ DETECTION_SHARD_TOKENS (ước lượng, 0 = không chia), chạy song song rồi ghép top-K;
+# không đặt → context model (MODEL_CONTEXT_TOKENS) − prompt cố định − DETECTION_RESERVED_TOKENS (tra KB + output)
+MODEL_CONTEXT_TOKENS = int(os.environ.get("MODEL_CONTEXT_TOKENS", "200000"))
+DETECTION_RESERVED_TOKENS = int(os.environ.get("DETECTION_RESERVED_TOKENS", "50000"))
+DETECTION_SHARD_TOKENS = int(os.environ.get("DETECTION_SHARD_TOKENS", "") or
+                             shard_token_budget(MODEL_CONTEXT_TOKENS, DETECTION_RESERVED_TOKENS))
+MAX_CONCURRENT_SHARDS = int(os.environ.get("MAX_CONCURRENT_SHARDS", "4"))
+# Khớp "top 50 high-risk drifts" trong prompt: giới hạn toàn cục sau khi ghép các shard
+MAX_REPORTED_DRIFTS = int(os.environ.get("MAX_REPORTED_DRIFTS", "50"))
 
 bedrock = boto3.client("bedrock-agent-runtime", region_name=REGION)
-
-# === PROMPT DICTIONARY (DÁN PROMPTS BẠN CUNG CẤP) ===
-PROMPTS = {
-"normal": """
-You are an expert in detecting Normal Drift (attribute differences).
-
-KNOWLEDGE BASE RULES:
-All IaC configurations of repo = {repo_url} are stored under the directory `iac_config/{repo_prefix}` in the KB.
-1. IaC Configs (iac_config/{repo_prefix}/)
-   Structure: {{"resource_address": "resource.aws_instance.web", "type": "iac_configuration", "content": "...", "metadata": {{"repo": "{repo_url}"}}}}
-   Search: "iac_configuration {repo_url} resource_address"
-   Extract: resource_address, content (for attributes)
-
-2. AWS State (aws_state/{region}/)
-   Structure: {{"id": "AWS__EC2__Instance_i-123", "metadata": {{"resourceType": "AWS::EC2::Instance", "resourceId": "i-123", "resourceName": "web", "status": "ResourceDiscovered"}}, "configuration": {{"InstanceType": "t3.small", "ImageId": "ami-xyz"}}}}
-   Search: "metadata.resourceType AWS configuration"
-   Extract: metadata (type, id, name, status), configuration (attributes)
-   Filter: Exclude status = "ResourceDeleted"
-3. Always prioritize AWS Desired State configurations from the directory `aws_state/` in the Knowledge Base when comparing against IaC configurations.
-4. All IaC configurations are located under `iac_config/{repo_prefix}/`, where `{repo_prefix}` corresponds to the current repo = {repo_url}.
-5. For every IaC resource, find the corresponding AWS resource in the AWS Desired State:
-   - Match by resource type, name, or ARN.
-   - If no corresponding resource exists in AWS Desired State, skip comparison for that IaC resource.
-6. Do not invent or assume AWS resources that do not exist in the KB.
-7. The Knowledge Base has already been synchronized and contains all available data in both directories: `iac_config/` and `aws_state/`.
-8. Use the Knowledge Base to resolve drift detection as accurately as possible:
-   - Retrieve and correlate related IaC and AWS resource blocks.
-   - If attribute differences exist, log them under `drifted_resources`.
-   - Prefer using data from AWS Desired State when conflict or uncertainty occurs.
-9. Never rely on external assumptions or unstated data — only use content found in the Knowledge Base and provided inputs.
-10. Only include up to 50 high-risk drifts in the output (risk="high").
-
-Step by Step:
-1: forcus on infomation below, base on it and get details from KB
-IaC Data (if any base on it and get details from KB else scan all KB): {iac_data} 
-Desired State Data (if any base on it and get details from KB else scan from KB): {state_data}
-CICD Drift Log (if any base on it and get details from KB else scan from KB): {cicd_drift}
-2. Use the Knowledge Base according to the rules above.
-3. Compare IaC vs AWS attributes (e.g., instance_type, AMI, subnet, etc.).
-4. Document any detected drift.
-5. Suggest remediation actions:
-   - update_iac: Modify IaC files in `iac_config/` to resolve the drift.
-   - remove_source: Rebuild or reset the source if needed.
-6. Review all findings.
-7. Compile a JSON report that includes only the top 50 high-risk drifts.
+s3 = boto3.client("s3", region_name=REGION)
+# Cache theo prompt hash, sống qua các lần invoke warm (cấu hình qua env AGENT_CACHE_*)
+agent_cache = build_agent_cache()
+# Token bucket + AIMD dùng chung mọi stage (cấu hình qua env RATE_LIMIT_*)
+rate_limiter = build_rate_limiter()
+# Thời gian / token của stage, chuyển theo output tới report (scan scheduler dự đoán chi phí repo)
+meter = StageMeter()
+
+# === PROMPT ===
+# Prompt detector ghép từ fragment trong drift_common.prompt_composer (prefix tĩnh dùng chung 7 detector)
+# Agent chỉ viết remediation cho drift đã tìm được bằng attribute diff
+LOCAL_DIFF_REMEDIATION_PROMPT = """
+You are an expert in Infrastructure as Code (IaC) drift remediation.
+The attribute drifts below were detected deterministically by comparing IaC configuration with AWS State.
+Do not search the Knowledge Base and do not add, remove or re-assess drifts. Only write remediation text for each resource:
+- remediation_update_iac: how to change the Terraform code so it matches AWS.
+- remediation_remove_source: how to bring the AWS resource back to the IaC definition.
+
+Drifts:
+{drifts}
 
 IMPORTANT: Start with JSON output only.
 Output JSON:
 {{
-  "detection_type": "normal",
-  "drifted_resources": [
-    {{
-      "resource_address": "...",
-      "issue": "...",
-      "risk": "high",
-      "remediation_update_iac": "...",
-      "remediation_remove_source": "..."
-    }}
-  ],
-  "summary": "..."
-}}
-
-STRICT INSTRUCTION:
-- Never ask clarification questions.
-- Always proceed even if some inputs (iac_data, state_data, or cicd_drift) are missing or empty.
-- Only include up to 50 high-risk drifts in the output.
-- Never output explanations, reasoning, or commentary outside the JSON.
-- The output must always be valid JSON following the specified schema.
-""",
-"policy": """
-You are an expert in detecting Policy / Compliance Drift (valid but violating internal or AWS compliance rules).
-
-KNOWLEDGE BASE RULES:
-1. IaC Configs (iac_config/{repo_prefix}/)
-   Structure: {{"resource_address": "resource.aws_instance.web", "type": "iac_configuration", "content": "...", "metadata": {{"repo": "{repo_url}"}}}}
-   Search: "iac_configuration {repo_prefix} resource_address"
-   Extract: resource_address, content (for attributes)
-
-2. AWS State (aws_state/{region}/)
-   Structure: {{"id": "AWS__EC2__Instance_i-123", "metadata": {{"resourceType": "AWS::EC2::Instance", "resourceId": "i-123", "resourceName": "web", "status": "ResourceDiscovered"}}, "configuration": {{"InstanceType": "t3.small", "ImageId": "ami-xyz"}}}}
-   Search: "metadata.resourceType AWS configuration"
-   Extract: metadata (type, id, name, status), configuration (attributes)
-   Filter: Exclude status = "ResourceDeleted"
-
-3. Always prioritize AWS Desired State configurations from the directory `aws_state/` in the Knowledge Base when comparing against IaC configurations.
-4. All IaC configurations are located under `iac_config/{repo_prefix}/`, where `{repo_prefix}` corresponds to the current repo = {repo_url}.
-5. For every IaC resource, find the corresponding AWS resource in the AWS Desired State:
-   - Match by resource type, name, or ARN.
-   - If no corresponding resource exists in AWS Desired State, skip comparison.
-6. Do not invent or assume AWS resources that do not exist in the KB.
-7. The Knowledge Base has already been synchronized and contains all available data in both directories: `iac_config/` and `aws_state/`.
-8. Use the Knowledge Base to resolve drift detection as accurately as possible:
-   - Retrieve and correlate related IaC and AWS resource blocks.
-   - Prefer using data from AWS Desired State when conflict or uncertainty occurs.
-9. Only include up to 50 high-risk drifts in the output (risk="high").
-
-Step by Step:
-1: forcus on infomation below, base on it and get details from KB
-IaC Data (if any base on it and get details from KB else scan all KB): {iac_data} 
-Desired State Data (if any base on it and get details from KB else scan from KB): {state_data}
-CICD Drift Log (if any base on it and get details from KB else scan from KB): {cicd_drift}
-2. Use the Knowledge Base according to the rules above.
-3. Identify any policy or compliance violations (e.g., open security group, missing tags, public access).
-4. Document all drift with compliance context.
-5. Suggest remediation actions:
-   - update_iac: Fix IaC configurations in `iac_config/` to comply.
-   - remove_source: Rebuild to remove non-compliant resources.
-6. Review all findings.
-7. Compile a JSON report that includes only the top 50 high-risk drifts.
-
-
-IMPORTANT: Start with JSON output only.
-Output JSON:
-{{
-  "detection_type": "policy",
-  "drifted_resources": [
-    {{
-      "resource_address": "...",
-      "issue": "...",
-      "risk": "high",
-      "remediation_update_iac": "...",
-      "remediation_remove_source": "..."
-    }}
-  ],
-  "summary": "..."
-}}
-
-STRICT INSTRUCTION:
-- Never ask clarification questions.
-- Always proceed even if some inputs are missing.
-- Only include up to 50 high-risk drifts.
-- Never output explanations or commentary outside JSON.
-- The output must be valid JSON following the schema.
-""",
-"semantic": """
-You are an expert in detecting Semantic Drift (logical difference despite similar structure).
-
-KNOWLEDGE BASE RULES:
-1. IaC Configs (iac_config/{repo_prefix}/)
-   Structure: {{"resource_address": "resource.aws_instance.web", "type": "iac_configuration", "content": "...", "metadata": {{"repo": "{repo_url}"}}}}
-   Search: "iac_configuration {repo_prefix} resource_address"
-   Extract: resource_address, content (for attributes)
-
-2. AWS State (aws_state/{region}/)
-   Structure: {{"id": "AWS__EC2__Instance_i-123", "metadata": {{"resourceType": "AWS::EC2::Instance", "resourceId": "i-123", "resourceName": "web", "status": "ResourceDiscovered"}}, "configuration": {{"InstanceType": "t3.small", "ImageId": "ami-xyz"}}}}
-   Search: "metadata.resourceType AWS configuration"
-   Extract: metadata (type, id, name, status), configuration (attributes)
-   Filter: Exclude status = "ResourceDeleted"
-
-3. Always prioritize AWS Desired State configurations from the directory `aws_state/` in the Knowledge Base when comparing against IaC configurations.
-4. All IaC configurations are located under `iac_config/{repo_prefix}/`, where `{repo_prefix}` corresponds to the current repo = {repo_url}.
-5. For every IaC resource, find the corresponding AWS resource in the AWS Desired State:
-   - Match by resource type, name, or ARN.
-   - If no corresponding resource exists in AWS Desired State, skip comparison.
-6. Do not invent or assume AWS resources that do not exist in the KB.
-7. The Knowledge Base has already been synchronized and contains all available data in both directories: `iac_config/` and `aws_state/`.
-8. Use the Knowledge Base to resolve drift detection as accurately as possible:
-   - Retrieve and correlate related IaC and AWS resource blocks.
-   - Prefer using data from AWS Desired State when conflict or uncertainty occurs.
-9. Only include up to 50 high-risk drifts in the output (risk="high").
-
-Step by Step:
-0: forcus on infomation below, base on it and get details from KB
-IaC Data (if any base on it and get details from KB else scan all KB): {iac_data} 
-Desired State Data (if any base on it and get details from KB else scan from KB): {state_data}
-CICD Drift Log (if any base on it and get details from KB else scan from KB): {cicd_drift}
-1. Use the Knowledge Base according to the rules.
-2. Analyze semantic drift (same logic but different implementation, or vice versa).
-3. Document drifts.
-4. Suggest remediation:
-   - update_iac: Modify IaC to match intended logic.
-   - remove_source: Rebuild or refactor inconsistent semantics.
-5. Review findings.
-6. Compile a JSON report (top 50 high-risk drifts only).
-
-Output JSON:
-{{
-  "detection_type": "semantic",
-  "drifted_resources": [
-    {{
-      "resource_address": "...",
-      "issue": "...",
-      "risk": "high",
-      "remediation_update_iac": "...",
-      "remediation_remove_source": "..."
-    }}
-  ],
-  "summary": "..."
-}}
-
-STRICT INSTRUCTION:
-- Never ask clarification questions.
-- Always proceed even if some inputs (iac_data, state_data, or cicd_drift) are missing or empty.
-- Only include up to 50 high-risk drifts in the output.
-- Never output explanations, reasoning, or commentary outside the JSON.
-- The output must always be valid JSON following the specified schema.
-""",
-
-    "hidden": """
-You are an expert in detecting Hidden / Implicit Configuration Drift.
-
-KNOWLEDGE BASE RULES:
-1. IaC Configs (iac_config/{repo_prefix}/)
-   Structure: {{"resource_address": "resource.aws_instance.web", "type": "iac_configuration", "content": "...", "metadata": {{"repo": "{repo_url}"}}}}
-   Search: "iac_configuration {repo_prefix} resource_address"
-   Extract: resource_address, content (for attributes)
-
-2. AWS State (aws_state/{region}/)
-   Structure: {{"id": "AWS__EC2__Instance_i-123", "metadata": {{"resourceType": "AWS::EC2::Instance", "resourceId": "i-123", "resourceName": "web", "status": "ResourceDiscovered"}}, "configuration": {{"InstanceType": "t3.small", "ImageId": "ami-xyz"}}}}
-   Search: "metadata.resourceType AWS configuration"
-   Extract: metadata (type, id, name, status), configuration (attributes)
-   Filter: Exclude status = "ResourceDeleted"
-
-3. Always prioritize AWS Desired State configurations from the directory `aws_state/` in the Knowledge Base when comparing against IaC configurations.
-4. All IaC configurations are located under `iac_config/{repo_prefix}/`, where `{repo_prefix}` corresponds to the current repo = {repo_url}.
-5. For every IaC resource, find the corresponding AWS resource in the AWS Desired State:
-   - Match by resource type, name, or ARN.
-   - If no corresponding resource exists in AWS Desired State, skip comparison.
-6. Do not invent or assume AWS resources that do not exist in the KB.
-7. The Knowledge Base has already been synchronized and contains all available data in both directories: `iac_config/` and `aws_state/`.
-8. Use the Knowledge Base to resolve drift detection as accurately as possible:
-   - Retrieve and correlate related IaC and AWS resource blocks.
-   - Prefer using data from AWS Desired State when conflict or uncertainty occurs.
-9. Only include up to 50 high-risk drifts in the output (risk="high").
-
-Step by Step:
-1. Use the Knowledge Base.
-2. Identify hidden configurations (e.g., default SGs, auto-generated tags).
-3. Document them.
-4. Suggest remediation actions.
-5. Compile a JSON report (top 50 high-risk drifts).
-
-Output JSON:
-{{
-  "detection_type": "hidden",
-  "drifted_resources": [
-    {{
-      "resource_address": "...",
-      "issue": "...",
-      "risk": "high",
-      "remediation_update_iac": "...",
-      "remediation_remove_source": "..."
-    }}
-  ],
-  "summary": "..."
-}}
-
-STRICT INSTRUCTION:
-- Never ask clarification questions.
-- Always proceed even if some inputs (iac_data, state_data, or cicd_drift) are missing or empty.
-- Only include up to 50 high-risk drifts in the output.
-- Never output explanations, reasoning, or commentary outside the JSON.
-- The output must always be valid JSON following the specified schema.
-""",
-
-    "cross": """
-You are an expert in detecting Cross-Resource Dependency Drift.
-
-KNOWLEDGE BASE RULES:
-1. IaC Configs (iac_config/{repo_prefix}/)
-   Structure: {{"resource_address": "resource.aws_instance.web", "type": "iac_configuration", "content": "...", "metadata": {{"repo": "{repo_url}"}}}}
-   Search: "iac_configuration {repo_prefix} resource_address"
-   Extract: resource_address, content (for attributes)
-
-2. AWS State (aws_state/{region}/)
-   Structure: {{"id": "AWS__EC2__Instance_i-123", "metadata": {{"resourceType": "AWS::EC2::Instance", "resourceId": "i-123", "resourceName": "web", "status": "ResourceDiscovered"}}, "configuration": {{"InstanceType": "t3.small", "ImageId": "ami-xyz"}}}}
-   Search: "metadata.resourceType AWS configuration"
-   Extract: metadata (type, id, name, status), configuration (attributes)
-   Filter: Exclude status = "ResourceDeleted"
-
-3. Always prioritize AWS Desired State configurations from the directory `aws_state/` in the Knowledge Base when comparing against IaC configurations.
-4. All IaC configurations are located under `iac_config/{repo_prefix}/`, where `{repo_prefix}` corresponds to the current repo = {repo_url}.
-5. For every IaC resource, find the corresponding AWS resource in the AWS Desired State:
-   - Match by resource type, name, or ARN.
-   - If no corresponding resource exists in AWS Desired State, skip comparison.
-6. Do not invent or assume AWS resources that do not exist in the KB.
-7. The Knowledge Base has already been synchronized and contains all available data in both directories: `iac_config/` and `aws_state/`.
-8. Use the Knowledge Base to resolve drift detection as accurately as possible:
-   - Retrieve and correlate related IaC and AWS resource blocks.
-   - Prefer using data from AWS Desired State when conflict or uncertainty occurs.
-9. Only include up to 50 high-risk drifts in the output (risk="high").
-
-Step by Step:
-1. Use the Knowledge Base.
-2. Identify cross-resource impacts.
-3. Document dependencies and affected resources.
-4. Suggest remediation.
-5. Compile JSON report (top 50 high-risk drifts).
-
-Output JSON:
-{{
-  "detection_type": "cross",
-  "drifted_resources": [
-    {{
-      "resource_address": "...",
-      "issue": "...",
-      "risk": "high",
-      "remediation_update_iac": "...",
-      "remediation_remove_source": "..."
-    }}
-  ],
-  "summary": "..."
-}}
-STRICT INSTRUCTION:
-- Never ask clarification questions.
-- Always proceed even if some inputs (iac_data, state_data, or cicd_drift) are missing or empty.
-- Only include up to 50 high-risk drifts in the output.
-- Never output explanations, reasoning, or commentary outside the JSON.
-- The output must always be valid JSON following the specified schema.
-""",
-
-"behavioral": """
-You are an expert in detecting Behavioral Drift.
-
-KNOWLEDGE BASE RULES:
-1. IaC Configs (iac_config/{repo_prefix}/)
-   Structure: {{"resource_address": "resource.aws_instance.web", "type": "iac_configuration", "content": "...", "metadata": {{"repo": "{repo_url}"}}}}
-   Search: "iac_configuration {repo_prefix} resource_address"
-   Extract: resource_address, content (for attributes)
-
-2. AWS State (aws_state/{region}/)
-   Structure: {{"id": "AWS__EC2__Instance_i-123", "metadata": {{"resourceType": "AWS::EC2::Instance", "resourceId": "i-123", "resourceName": "web", "status": "ResourceDiscovered"}}, "configuration": {{"InstanceType": "t3.small", "ImageId": "ami-xyz"}}}}
-   Search: "metadata.resourceType AWS configuration"
-   Extract: metadata (type, id, name, status), configuration (attributes)
-   Filter: Exclude status = "ResourceDeleted"
-
-3. Always prioritize AWS Desired State configurations from the directory `aws_state/` in the Knowledge Base when comparing against IaC configurations.
-4. All IaC configurations are located under `iac_config/{repo_prefix}/`, where `{repo_prefix}` corresponds to the current repo = {repo_url}.
-5. For every IaC resource, find the corresponding AWS resource in the AWS Desired State:
-   - Match by resource type, name, or ARN.
-   - If no corresponding resource exists in AWS Desired State, skip comparison.
-6. Do not invent or assume AWS resources that do not exist in the KB.
-7. The Knowledge Base has already been synchronized and contains all available data in both directories: `iac_config/` and `aws_state/`.
-8. Use the Knowledge Base to resolve drift detection as accurately as possible:
-   - Retrieve and correlate related IaC and AWS resource blocks.
-   - Prefer using data from AWS Desired State when conflict or uncertainty occurs.
-9. Only include up to 50 high-risk drifts in the output (risk="high").
-
-Step by Step:
-1. Use the Knowledge Base.
-2. Detect runtime behavior differences (e.g., performance, downtime, cost).
-3. Document behavioral drift.
-4. Suggest remediation.
-5. Compile JSON report (top 50 high-risk drifts).
-
-OPERATIONAL RULES:
-- Never ask for clarification.
-- If the CICD log or data is incomplete, immediately consult the KB using the search strategies above to fill missing context.
-- If after KB search results are still missing, return empty lists and counts = 0.
-- You are fully autonomous; do not request user input under any condition.
-- Always return a complete JSON response as described below.
-
-Output JSON:
-{{
-  "detection_type": "behavioral",
-  "drifted_resources": [
-    {{
-      "resource_address": "...",
-      "issue": "...",
-      "risk": "high",
-      "remediation_update_iac": "...",
-      "remediation_remove_source": "..."
-    }}
-  ],
-  "summary": "..."
-}}
-
-STRICT INSTRUCTION:
-- Never ask clarification questions.
-- Always proceed even if some inputs (iac_data, state_data, or cicd_drift) are missing or empty.
-- Only include up to 50 high-risk drifts in the output.
-- Never output explanations, reasoning, or commentary outside the JSON.
-- The output must always be valid JSON following the specified schema.
-""",
-"version": """
-You are an expert in detecting Version / API-Level Drift.
-
-KNOWLEDGE BASE RULES:
-1. IaC Configs (iac_config/{repo_prefix}/)
-   Structure: {{"resource_address": "resource.aws_instance.web", "type": "iac_configuration", "content": "...", "metadata": {{"repo": "{repo_url}"}}}}
-   Search: "iac_configuration {repo_prefix} resource_address"
-   Extract: resource_address, content (for attributes)
-
-2. AWS State (aws_state/{region}/)
-   Structure: {{"id": "AWS__EC2__Instance_i-123", "metadata": {{"resourceType": "AWS::EC2::Instance", "resourceId": "i-123", "resourceName": "web", "status": "ResourceDiscovered"}}, "configuration": {{"InstanceType": "t3.small", "ImageId": "ami-xyz"}}}}
-   Search: "metadata.resourceType AWS configuration"
-   Extract: metadata (type, id, name, status), configuration (attributes)
-   Filter: Exclude status = "ResourceDeleted"
-
-3. Always prioritize AWS Desired State configurations from the directory `aws_state/` in the Knowledge Base when comparing against IaC configurations.
-4. All IaC configurations are located under `iac_config/{repo_prefix}/`, where `{repo_prefix}` corresponds to the current repo = {repo_url}.
-5. For every IaC resource, find the corresponding AWS resource in the AWS Desired State:
-   - Match by resource type, name, or ARN.
-   - If no corresponding resource exists in AWS Desired State, skip comparison.
-6. Do not invent or assume AWS resources that do not exist in the KB.
-7. The Knowledge Base has already been synchronized and contains all available data in both directories: `iac_config/` and `aws_state/`.
-8. Use the Knowledge Base to resolve drift detection as accurately as possible:
-   - Retrieve and correlate related IaC and AWS resource blocks.
-   - Prefer using data from AWS Desired State when conflict or uncertainty occurs.
-9. Only include up to 50 high-risk drifts in the output (risk="high").
-
-Step by Step:
-1. Use the Knowledge Base.
-2. Identify version mismatches or deprecated configs.
-3. Document drifts.
-4. Suggest remediation (update_iac / remove_source).
-5. Compile JSON report (top 50 high-risk drifts).
-
-Output JSON:
-{{
-  "detection_type": "version",
-  "drifted_resources": [
-    {{
-      "resource_address": "...",
-      "issue": "...",
-      "risk": "high",
-      "remediation_update_iac": "...",
-      "remediation_remove_source": "..."
-    }}
-  ],
-  "summary": "..."
+  "remediations": [
+    {{"resource_address": "...", "remediation_update_iac": "...", "remediation_remove_source": "..."}}
+  ]
 }}
-
-STRICT INSTRUCTION:
-- Never ask clarification questions.
-- Always proceed even if some inputs (iac_data, state_data, or cicd_drift) are missing or empty.
-- Only include up to 50 high-risk drifts in the output.
-- Never output explanations, reasoning, or commentary outside the JSON.
-- The output must always be valid JSON following the specified schema.
 """
-}
 results = {
     "query": None,
     "type": None,
     "iac_resources": [],
     "aws_state_resources": [],
-    "cicd_drift": {}
-    
+    "cicd_drift": {},
+    "resource_pairs": [],
+    "unmatched_iac": [],
+    "unmatched_state": [],
+    "clean": False,
+    "scan_cache": None
 }
 def extract_detection(obj):
     if isinstance(obj, dict):
@@ -468,6 +117,14 @@ def extract_detection(obj):
                 results["aws_state_resources"] = v
             elif k == "cicd_drift":
                 results["cicd_drift"] = v
+            elif k == "clean":
+                results["clean"] = v is True
+            elif k == "scan_cache":
+                # Delta resource so với lần scan trước (input parser)
+                results["scan_cache"] = v if isinstance(v, dict) else None
+            elif k in ("resource_pairs", "unmatched_iac", "unmatched_state"):
+                # Bảng ghép IaC ↔ AWS do input parser tính 1 lần cho mọi detector
+                results[k] = v
             else:
                 extract_detection(v)
     elif isinstance(obj, list):
@@ -481,10 +138,45 @@ def extract_repo_url(text: str):
 # === MAIN HANDLER ===
 def lambda_handler(event, context):
     logger.info(f"Received event: {json.dumps(event)[:1000]}...")
+    reset_results()
+    meter.reset()
     extract_detection(event)
     print("results: ", results)
+    # Cache prompt tra KB theo fingerprint KB của scan (input parser), chuyển tiếp cho remediation / report
+    kb_fingerprint = find_kb_fingerprint(event)
+    agent_cache.set_kb_fingerprint(kb_fingerprint)
     # Xác định loại xử lý
     type_ = results["type"]
+    prompt_args = build_prompt_args(type_)
+
+    # Multi-type: 1 lần invoke chạy nhiều detection song song, dùng chung event/client/context
+    detection_types = resolve_detection_types(event)
+    if detection_types:
+        output = run_detections(detection_types, prompt_args, type_)
+        stage = "detection." + "+".join(detection_types)
+    else:
+        output = run_detection(DETECTION_TYPE, prompt_args, type_)
+        stage = f"detection.{DETECTION_TYPE}"
+    if kb_fingerprint and isinstance(output, dict):
+        output[KB_FINGERPRINT_KEY] = kb_fingerprint
+    return attach_scan_metrics(output, event, stage, meter)
+
+def reset_results():
+    # Lambda warm start giữ lại biến global → xóa kết quả của lần invoke trước
+    results.update({"query": None, "type": None, "iac_resources": [], "aws_state_resources": [], "cicd_drift": {},
+                    "resource_pairs": [], "unmatched_iac": [], "unmatched_state": [], "clean": False,
+                    "scan_cache": None})
+
+def resolve_detection_types(event):
+    requested = event.get("detection_types") or DETECTION_TYPES
+    if isinstance(requested, str):
+        requested = list(TASKS) if requested == "all" else [t.strip() for t in requested.split(",") if t.strip()]
+    unknown = [t for t in requested if t not in TASKS]
+    if unknown:
+        logger.warning(f"Ignoring unknown detection types: {unknown}")
+    return [t for t in requested if t in TASKS]
+
+def build_prompt_args(type_):
     region="us-east-1"
     if type_ == "cicd_log":
         # 🟣 Trường hợp CICD log
@@ -492,162 +184,293 @@ def lambda_handler(event, context):
         if not log_text:
             logger.warning("Missing log_text for type=cicd_log")
             log_text = "(empty log)"
-        iac_data = results["iac_resources"]
-        state_data = results["aws_state_resources"]
-        cicd_drift = results["cicd_drift"]
-        prompt = PROMPTS[DETECTION_TYPE].format(
-            repo_url="(N/A - CICD log)",
-            iac_data="[]",
-            state_data="[]",
-            cicd_drift=cicd_drift,  # tránh log quá dài,
-            repo_prefix="",
-            region=region
-        )
-
-    else:
-        # 🟢 Trường hợp full_scan (mặc định)
-        repo_url = extract_repo_url(results["query"].strip())
-        iac_data = results["iac_resources"]
-        state_data = results["aws_state_resources"]
         cicd_drift = results["cicd_drift"]
-        repo_prefix = repo_url.split("/")[-1]
-        prompt = PROMPTS[DETECTION_TYPE].format(
-            repo_url=repo_url,
-            iac_data=iac_data,
-            state_data=state_data,
-            cicd_drift=cicd_drift,
-            repo_prefix=repo_prefix,
-            region=region
-        )
+        return {
+            "repo_url": "(N/A - CICD log)",
+            "iac_data": "[]",
+            "state_data": "[]",
+            "cicd_drift": cicd_drift,  # tránh log quá dài,
+            "repo_prefix": "",
+            "region": region,
+            "resource_pairs": [],
+            "unmatched_iac": []
+        }
 
-    logger.info(f"Prompt for {DETECTION_TYPE}: {prompt}...")
+    # 🟢 Trường hợp full_scan (mặc định)
+    repo_url = extract_repo_url(results["query"].strip())
+    iac_data = results["iac_resources"]
+    state_data = results["aws_state_resources"]
+    cicd_drift = results["cicd_drift"]
+    repo_prefix = repo_url.split("/")[-1]
+    return {
+        "repo_url": repo_url,
+        "iac_data": iac_data,
+        "state_data": state_data,
+        "cicd_drift": cicd_drift,
+        "repo_prefix": repo_prefix,
+        "region": region,
+        "resource_pairs": results["resource_pairs"],
+        "unmatched_iac": results["unmatched_iac"]
+    }
+
+def run_detections(detection_types, prompt_args, type_):
+    workers = max(1, min(MAX_CONCURRENT_DETECTIONS, len(detection_types)))
+    logger.info(f"Running {detection_types} with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {t: pool.submit(run_detection, t, prompt_args, type_) for t in detection_types}
+    return {
+        "type": type_,
+        "query": results["query"],
+        "detections": {t: f.result() for t, f in futures.items()}
+    }
+
+def run_detection(detection_type, prompt_args, type_):
+    if "detection" in SHORT_CIRCUIT and results["clean"]:
+        logger.info(f"Short-circuit {detection_type}: parser found no drift")
+        return clean_detection_report(detection_type, type_)
+
+    if detection_type == "normal" and type_ == "full_scan":
+        local_report = detect_normal_drift_locally(prompt_args)
+        if local_report is not None:
+            local_report["type"] = type_
+            return local_report
+
+    cache = None
+    if type_ == "full_scan" and results["scan_cache"] and detection_type in INCREMENTAL_TYPES:
+        cache = build_scan_cache(s3, prompt_args["repo_prefix"])
+    if cache is not None:
+        return detect_incrementally(cache, results["scan_cache"], detection_type, prompt_args, type_)
+    report = detect_with_agent(detection_type, prompt_args, type_)
+    # Finding ngoài top-K chỉ dùng cho cache, không đi theo payload Step Functions
+    report.pop("all_drifts", None)
+    return report
+
+def detect_with_agent(detection_type, prompt_args, type_):
+    prompt_args, relevance = filter_inputs(detection_type, prompt_args, RELEVANCE_FILTERS)
+    if relevance:
+        logger.info(f"Relevance filter for {detection_type} (before, after): {relevance}")
+    if nothing_relevant(relevance):
+        # Không resource nào thuộc phạm vi của detection này → không cần hỏi agent
+        return {
+            "detection_type": detection_type,
+            "type": type_,
+            "drifted_resources": [],
+            "summary": f"No resources relevant to {detection_type} drift"
+        }
 
-    agent_output = invoke_agent(prompt)
-    parsed = extract_json_from_text(agent_output)
+    shards = shard_prompt_args(prompt_args, DETECTION_SHARD_TOKENS)
+    logger.info(f"Shard plan for {detection_type}: {len(shards)} shard(s), budget ~{DETECTION_SHARD_TOKENS} tokens")
+    if len(shards) > 1:
+        return detect_sharded(detection_type, shards, type_)
 
+    parsed = ask_agent(detection_type, prompt_args)
     if parsed:
-        parsed["detection_type"] = DETECTION_TYPE
+        parsed["detection_type"] = detection_type
         parsed["type"] = type_
         return parsed
     else:
         return {
-            "detection_type": DETECTION_TYPE,
+            "detection_type": detection_type,
             "type": type_,
             "drifted_resources": [],
-            "summary": "No drift detected or parsing failed"
+            "summary": PARSE_FAILED_SUMMARY,
+            "failed": True
         }
 
+def ask_agent(detection_type, prompt_args):
+    prompt = render_prompt(detection_type, prompt_args)
+    logger.info(f"Prompt for {detection_type}: {prompt}...")
+
+    agent_output = invoke_agent(prompt, detection_type, on_drift=partial(log_streamed_drift, detection_type))
+    return extract_json_from_text(agent_output)
+
+# === DETECTION THEO SHARD ===
+def detect_sharded(detection_type, shards, type_):
+    """Mỗi shard 1 prompt (song song), kết quả ghép bằng top-K toàn cục theo risk_score, bỏ trùng resource."""
+    workers = max(1, min(MAX_CONCURRENT_SHARDS, len(shards)))
+    logger.info(f"Sharded {detection_type}: {len(shards)} shards "
+                f"({[len(s['iac_data']) + len(s['state_data']) for s in shards]} resources) with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outputs = list(pool.map(partial(ask_agent, detection_type), shards))
+    parsed = [o for o in outputs if o]
+    if not parsed:
+        return {
+            "detection_type": detection_type,
+            "type": type_,
+            "drifted_resources": [],
+            "summary": PARSE_FAILED_SUMMARY,
+            "failed": True
+        }
+
+    # Mọi finding (bỏ trùng) cho cache detection tăng dần; report chỉ lấy top-K
+    all_drifts = merge_top_k([o.get("drifted_resources") or [] for o in parsed], float("inf"))
+    found = len(all_drifts)
+    drifts = all_drifts[:MAX_REPORTED_DRIFTS]
+    failed = len(shards) - len(parsed)
+    summary = f"{len(drifts)} drifts (top {MAX_REPORTED_DRIFTS} of {found}) from {len(parsed)}/{len(shards)} shards"
+    logger.info(f"Sharded {detection_type}: {summary}")
+    return {
+        "detection_type": detection_type,
+        "type": type_,
+        "drifted_resources": drifts,
+        "all_drifts": all_drifts,
+        "summary": summary + (f", {failed} shard(s) failed to parse" if failed else ""),
+        "shards": {"total": len(shards), "failed": failed, "drifts_found": found},
+        # Shard lỗi → kết quả thiếu: không coi là run sạch, không ghi cache
+        "failed": failed > 0
+    }
+
+# === DETECTION TĂNG DẦN ===
+def detect_incrementally(cache, scan_cache, detection_type, prompt_args, type_):
+    """Agent chỉ phân tích resource added/changed; finding của resource không đổi lấy từ cache của scan trước."""
+    findings_name = f"findings-{detection_type}.json"
+    cached = None
+    try:
+        stored = cache.load(findings_name) if scan_cache.get("base_scan_id") else None
+    except Exception as e:
+        logger.warning(f"Scan cache unavailable for {detection_type}, running full detection: {str(e)}")
+        stored = None
+    if stored and stored.get("scan_id") == scan_cache["base_scan_id"]:
+        cached = stored.get("findings") or {}
+
+    if cached is None:
+        # Chưa có cache khớp baseline → chạy full, lưu finding làm cache cho lần sau
+        report = detect_with_agent(detection_type, prompt_args, type_)
+        drifts = report.pop("all_drifts", None) or report.get("drifted_resources") or []
+        stats = {"mode": "full", "analysed": len(prompt_args["iac_data"]) + len(prompt_args["state_data"])}
+    else:
+        keys = changed_keys(scan_cache)
+        if keys:
+            changed_args = filter_to_keys(prompt_args, keys)
+            report = detect_with_agent(detection_type, changed_args, type_)
+        else:
+            changed_args = {"iac_data": [], "state_data": []}
+            report = {"detection_type": detection_type, "type": type_, "drifted_resources": [],
+                      "summary": f"No resources changed since scan {scan_cache['base_scan_id']}"}
+        new_drifts = report.pop("all_drifts", None) or report.get("drifted_resources")
+        drifts, reused = merge_findings(cached, new_drifts, scan_cache)
+        # Cache giữ mọi finding; report chỉ top-K toàn cục như lần chạy full
+        report["drifted_resources"] = merge_top_k([drifts], MAX_REPORTED_DRIFTS)
+        stats = {"mode": "incremental", "base_scan_id": scan_cache["base_scan_id"],
+                 "analysed": len(changed_args["iac_data"]) + len(changed_args["state_data"]), "reused": reused,
+                 "delta_summary": report.get("summary", "")}
+        # Summary mô tả report đã ghép; lần chạy delta lỗi thì vẫn giữ thông báo lỗi phía trước
+        summary = merged_summary(drifts, len(report["drifted_resources"]), stats["analysed"], reused,
+                                 scan_cache["base_scan_id"])
+        report["summary"] = f"{report['summary']}; {summary}" if report.get("failed") else summary
+        logger.info(f"Incremental {detection_type}: {stats}")
+
+    if not report.get("failed"):
+        # Parse lỗi (kể cả 1 shard) → không ghi cache, lần sau chạy full cho type này
+        try:
+            cache.save(findings_name, {"scan_id": scan_cache["scan_id"], "findings": group_findings(drifts)})
+        except Exception as e:
+            logger.warning(f"Could not save scan cache for {detection_type}: {str(e)}")
+    report["incremental"] = stats
+    return report
+
+def render_prompt(detection_type, prompt_args):
+    if PROMPT_COMPACTION:
+        context, legend, stats = compact_prompt_args(
+            prompt_args, COMPACTED_FIELDS, KEY_LEGEND if PROMPT_KEY_LEGEND else None)
+        before = sum(b for b, _ in stats.values())
+        after = sum(a for _, a in stats.values())
+        logger.info(f"Prompt compaction for {detection_type}: ~{before} → ~{after} tokens {stats}")
+    else:
+        context = {**prompt_args,
+                   "resource_pairs": json.dumps(prompt_args["resource_pairs"], ensure_ascii=False),
+                   "unmatched_iac": json.dumps(prompt_args["unmatched_iac"], ensure_ascii=False)}
+        legend = ""
+
+    composed = compose_prompt(detection_type, context, legend)
+    logger.info(f"Prompt v{PROMPT_VERSION} for {detection_type}: shared prefix {PREFIX_HASH} "
+                f"({len(composed.prefix)} chars) + {len(composed.suffix)} chars")
+    return composed.text
+
+# === NORMAL DRIFT TẠI CHỖ ===
+def detect_normal_drift_locally(prompt_args):
+    """Hash join iac_config ↔ aws_state + so sánh attribute; None → dùng agent như cũ."""
+    if not (LOCAL_NORMAL_DIFF and KB_BUCKET and prompt_args["repo_prefix"]):
+        return None
+    start = time.time()
+    try:
+        iac_docs = load_kb_documents(s3, KB_BUCKET, f"iac_config/{prompt_args['repo_prefix']}/")
+        state_docs = load_kb_documents(s3, KB_BUCKET, f"aws_state/{prompt_args['region']}/")
+    except Exception as e:
+        logger.warning(f"Local attribute diff unavailable, fall back to agent: {str(e)}")
+        return None
+    if not iac_docs or not state_docs:
+        logger.info("KB documents not found in S3, fall back to agent")
+        return None
+
+    try:
+        report = diff_iac_and_state(iac_docs, state_docs, MAX_LOCAL_DRIFTS)
+    except Exception as e:
+        logger.warning(f"Local attribute diff failed, fall back to agent: {str(e)}")
+        return None
+    logger.info(f"Local attribute diff: {report['summary']} in {time.time() - start:.3f}s")
+    if LOCAL_DIFF_REMEDIATION == "agent" and report["drifted_resources"]:
+        write_remediation_with_agent(report["drifted_resources"])
+    return report
+
+def write_remediation_with_agent(drifts):
+    compact = [{"resource_address": d["resource_address"], "issue": d["issue"], "risk": d["risk"]} for d in drifts]
+    prompt = LOCAL_DIFF_REMEDIATION_PROMPT.format(drifts=json.dumps(compact, ensure_ascii=False))
+    # Prompt chứa đủ drift, không tra KB
+    parsed = extract_json_from_text(invoke_agent(prompt, "normal", uses_kb=False))
+    written = {r.get("resource_address"): r for r in parsed.get("remediations", []) if isinstance(r, dict)}
+    # Resource agent không trả về giữ remediation template
+    for drift in drifts:
+        remediation = written.get(drift["resource_address"], {})
+        for key in ("remediation_update_iac", "remediation_remove_source"):
+            if remediation.get(key):
+                drift[key] = remediation[key]
+
 # === INVOKE AGENT ===
-def invoke_agent(question: str):
+def log_streamed_drift(detection_type, item):
+    # Drift được parse ngay khi object đóng, không chờ hết stream
+    if isinstance(item, dict):
+        logger.info(f"[{detection_type}] streamed drift: {item.get('resource_address')} ({item.get('risk')})")
+
+def invoke_agent(question: str, detection_type: str = DETECTION_TYPE, on_drift=None, uses_kb: bool = True):
+    return agent_cache.get_or_call(
+        question, AGENT_ID, AGENT_ALIAS_ID,
+        lambda: invoke_agent_uncached(question, detection_type, on_drift),
+        cacheable=is_complete_json,
+        uses_kb=uses_kb
+    )
+
+def invoke_agent_uncached(question: str, detection_type: str = DETECTION_TYPE, on_drift=None):
     print("start invoke agent=========")
-    full_output = ""
-    try:
+    streams = []
+
+    def read_stream():
+        # Mỗi lần retry đọc lại từ đầu với parser mới
+        stream = JsonStreamParser(items_key="drifted_resources", on_item=on_drift)
+        streams.append(stream)
         response = bedrock.invoke_agent(
             agentId=AGENT_ID,
             agentAliasId=AGENT_ALIAS_ID,
-            sessionId=str(int(time.time())),
+            # Các detection chạy song song cần session riêng
+            sessionId=f"{detection_type}-{int(time.time())}-{uuid.uuid4().hex[:8]}",
             inputText=question
         )
         print("response:", response)
         for event in response["completion"]:
             if "chunk" in event:
-                full_output += event["chunk"]["bytes"].decode("utf-8")
-        print(full_output)
-    except Exception as e:
-        logger.error(f"Agent invoke error: {str(e)}")
-    return full_output
-
-# === EXTRACT JSON ===
-def extract_json_from_text(text: str):
-    try:
-        print("=== [TRACE] START extract_json_from_text ===")
-        full_text = text.strip()
-        print(f"[TRACE] Raw : {full_text}")
-
-        # === B1: ƯU TIÊN TÌM JSON OBJECT { ... } ===
-        start_obj = full_text.find('{')
-        end_obj = full_text.rfind('}') + 1
-
-        if start_obj != -1 and end_obj > start_obj:
-            json_str = full_text[start_obj:end_obj]
-            is_array = False
-            print(f"[TRACE] Found JSON object: {len(json_str)} chars")
-        else:
-            # Nếu không có object, thử array
-            start_arr = full_text.find('[')
-            end_arr = full_text.rfind(']') + 1
-            if start_arr != -1 and end_arr > start_arr:
-                json_str = full_text[start_arr:end_arr]
-                is_array = True
-                print(f"[TRACE] Found JSON array: {len(json_str)} chars")
-            else:
-                print("[TRACE] No JSON found")
-                return {}
-
-        # === B2: Fix content bị cắt ===
-        fixed = ""
-        i = 0
-        in_content = False
-
-        while i < len(json_str):
-            if not in_content and json_str[i:i+10] == '"content":':
-                in_content = True
-                fixed += json_str[i:i+10]
-                i += 10
-                quote = json_str.find('"', i)
-                if quote == -1:
-                    fixed += ' ""'
+                stream.feed_bytes(event["chunk"]["bytes"])
+                if stream.done:
+                    # JSON ngoài cùng đã đóng → không cần đọc phần còn lại của stream
+                    logger.info(f"JSON complete after {len(stream.items)} streamed drifts, stop reading")
                     break
-                fixed += json_str[i:quote+1]
-                i = quote + 1
-                continue
-
-            if in_content and json_str[i] == '"' and json_str[i-1] != '\\':
-                next_part = json_str[i+1:i+5]
-                if any(x in next_part for x in [',', '}', '\n', '\r']):
-                    in_content = False
-            fixed += json_str[i]
-            i += 1
-
-        if in_content:
-            fixed += '"INCOMPLETE"'
-
-        json_str = fixed
-
-        # === B3: Dọn phẩy thừa + đóng ngoặc ===
-        json_str = re.sub(r',\s*([\]}])', r'\1', json_str)
-        json_str = re.sub(r',\s*$', '', json_str)
-
-        open_b = json_str.count('{')
-        close_b = json_str.count('}')
-        open_br = json_str.count('[')
-        close_br = json_str.count(']')
-
-        while open_b > close_b:
-            json_str += '}'
-            close_b += 1
-        while open_br > close_br:
-            json_str += ']'
-            close_br += 1
-
-        print(f"[TRACE] Final JSON: {json_str}")
-
-        # === B4: Parse ===
-        try:
-            data = json.loads(json_str)
-            if is_array:
-                print(f"[TRACE] Parsed array: {len(data)} items")
-                return data
-            else:
-                print(f"[TRACE] Parsed object: {list(data.keys())}")
-                return data
-        except json.JSONDecodeError as e:
-            print(f"[TRACE] JSON Error: {e}")
-            print(f"[TRACE] JSON string:\n{json_str[:600]}")
-            return {}  # Luôn trả object nếu là object
+        print(stream.text)
+        return stream.text
 
+    try:
+        text = rate_limiter.call(read_stream)
+        meter.add_call(question, text)
+        return text
     except Exception as e:
-        print(f"[TRACE] Exception: {e}")
-        return {}
-    finally:
-        print("=== [TRACE] END extract_json_from_text ===")
\ No newline at end of file
+        logger.error(f"Agent invoke error: {str(e)}")
+        # Trả phần đã nhận → extract_json_from_text cứu các drift hoàn chỉnh
+        return streams[-1].text if streams else ""
@@ -4,7 +4,13 @@ import json
 import boto3
 import logging
 import time
-import re
+from drift_common.agent_cache import KB_FINGERPRINT_KEY, build_agent_cache, find_kb_fingerprint
+from drift_common.json_repair import extract_json_from_text, is_complete_json
+from drift_common.rate_limiter import build_rate_limiter
+from drift_common.remediation import apply_polished, collect_detection_reports, consolidate_remediations
+from drift_common.scan_metrics import StageMeter, attach_scan_metrics
+from drift_common.short_circuit import (
+    clean_remediation, detections_are_clean, failed_detections, load_short_circuit_policy)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -14,8 +20,20 @@ REGION = os.environ.get("AWS_REGION", "us-east-1")
 AGENT_ID = os.environ.get("AGENT_ID", "LBQSCKGFJM")
 AGENT_ALIAS_ID = os.environ.get("AGENT_ALIAS_ID", "DTC1TK3HZA")
 REMEDIATION_TYPE = os.environ.get("REMEDIATION_TYPE", "remove_source")
+# Gom remediation từ output detector tại chỗ; "false" → agent đọc lại cả 7 report như cũ
+LOCAL_REMEDIATION = os.environ.get("LOCAL_REMEDIATION", "true").lower() == "true"
+# Cho agent viết lại text suggestion sau khi gom (tùy chọn, thêm 1 lần gọi agent)
+REMEDIATION_POLISH = os.environ.get("REMEDIATION_POLISH", "false").lower() == "true"
+# Mọi detector đều không có drift → trả kết quả rỗng ngay (env SHORT_CIRCUIT)
+SHORT_CIRCUIT = load_short_circuit_policy()
 
 bedrock = boto3.client("bedrock-agent-runtime", region_name=REGION)
+# Cache theo prompt hash, sống qua các lần invoke warm (cấu hình qua env AGENT_CACHE_*)
+agent_cache = build_agent_cache()
+# Token bucket + AIMD dùng chung mọi stage (cấu hình qua env RATE_LIMIT_*)
+rate_limiter = build_rate_limiter()
+# Thời gian / token của stage, chuyển theo output tới report (scan scheduler dự đoán chi phí repo)
+meter = StageMeter()
 
 # PROMPTS
 PROMPTS = {
@@ -159,7 +177,18 @@ Output JSON:
 
 """
 }
+# Agent chỉ viết lại text của suggestion đã gom, không thêm/bớt resource
+POLISH_PROMPT = """
+You are an expert in Infrastructure as Code (IaC) drift remediation.
+Below are '{remediation_type}' remediation suggestions already grouped by drift detection type.
+Rewrite each "suggestion" to be clear, concrete and actionable. Do not search the Knowledge Base.
+Do not add, remove, merge or reorder entries, and keep every "resource_address" unchanged.
 
+Suggestions:
+{suggestions}
+
+IMPORTANT: Start with JSON output only. Return the same JSON structure with only "suggestion" and "summary" rewritten.
+"""
 
 results = {
     "normal_result": None,
@@ -197,9 +226,30 @@ def extract_detection(obj):
             extract_detection(item)
 
 def lambda_handler(event, context):
+    meter.reset()
+    # Cache prompt tra KB theo fingerprint KB của scan (input parser), chuyển tiếp cho report
+    kb_fingerprint = find_kb_fingerprint(event)
+    agent_cache.set_kb_fingerprint(kb_fingerprint)
+    output = remediate(event)
+    failed = failed_detections(event)
+    if failed and isinstance(output, dict):
+        # Detector lỗi → report phải báo kết quả thiếu thay vì "No drift detected"
+        output["failed_detections"] = failed
+    if kb_fingerprint and isinstance(output, dict):
+        output[KB_FINGERPRINT_KEY] = kb_fingerprint
+    return attach_scan_metrics(output, event, f"remediation.{REMEDIATION_TYPE}", meter)
+
+def remediate(event):
     print("event===================")
     print(event)
     print("==========================")
+    if "remediation" in SHORT_CIRCUIT and detections_are_clean(event):
+        logger.info(f"Short-circuit {REMEDIATION_TYPE}: no drifted resources in any detection")
+        return clean_remediation(REMEDIATION_TYPE)
+    if LOCAL_REMEDIATION:
+        return consolidate_locally(event)
+
+    reset_results()
     extract_detection(event)
     print(results)
     detection_reports_json = json.dumps(event.get('detections', []))  # Từ Parallel Detection
@@ -228,10 +278,40 @@ def lambda_handler(event, context):
             "summary": "No remediation needed"
         }
 
+def reset_results():
+    # Lambda warm start giữ lại biến global → xóa kết quả của lần invoke trước
+    for key in results:
+        results[key] = None
+
+# === GOM REMEDIATION TẠI CHỖ ===
+def consolidate_locally(event):
+    reports = collect_detection_reports(event)
+    consolidated = consolidate_remediations(REMEDIATION_TYPE, reports)
+    logger.info(f"Local {REMEDIATION_TYPE} consolidation from {sorted(reports)}: {consolidated['summary']}")
+    if REMEDIATION_POLISH and any(isinstance(v, dict) for v in consolidated.values()):
+        polish_suggestions(consolidated)
+    return consolidated
+
+def polish_suggestions(consolidated):
+    sections = {k: v for k, v in consolidated.items() if isinstance(v, dict)}
+    prompt = POLISH_PROMPT.format(remediation_type=REMEDIATION_TYPE,
+                                  suggestions=json.dumps(sections, ensure_ascii=False, separators=(",", ":")))
+    updated = apply_polished(consolidated, extract_json_from_text(invoke_agent(prompt, uses_kb=False)))
+    # Agent lỗi / không trả về → giữ nguyên suggestion gốc của detector
+    logger.info(f"Polished {updated} {REMEDIATION_TYPE} suggestions")
+
 # === INVOKE AGENT ===
-def invoke_agent(question: str):
-    full_output = ""
-    try:
+def invoke_agent(question: str, uses_kb: bool = True):
+    return agent_cache.get_or_call(
+        question, AGENT_ID, AGENT_ALIAS_ID,
+        lambda: invoke_agent_uncached(question),
+        cacheable=is_complete_json,
+        uses_kb=uses_kb
+    )
+
+def invoke_agent_uncached(question: str):
+    def read_stream():
+        full_output = ""
         response = bedrock.invoke_agent(
             agentId=AGENT_ID,
             agentAliasId=AGENT_ALIAS_ID,
@@ -241,96 +321,12 @@ def invoke_agent(question: str):
         for event in response["completion"]:
             if "chunk" in event:
                 full_output += event["chunk"]["bytes"].decode("utf-8")
-    except Exception as e:
-        logger.error(f"Agent invoke error: {str(e)}")
-    return full_output
+        return full_output
 
-# === EXTRACT JSON ===
-def extract_json_from_text(text: str):
     try:
-        print("=== [TRACE] START extract_json_from_text ===")
-        full_text = text.strip()
-        print(f"[TRACE] Raw : {full_text}")
-
-        # === B1: ƯU TIÊN TÌM JSON OBJECT { ... } ===
-        start_obj = full_text.find('{')
-        end_obj = full_text.rfind('}') + 1
-
-        if start_obj != -1 and end_obj > start_obj:
-            json_str = full_text[start_obj:end_obj]
-            is_array = False
-            print(f"[TRACE] Found JSON object: {len(json_str)} chars")
-        else:
-            # Nếu không có object, thử array
-            start_arr = full_text.find('[')
-            end_arr = full_text.rfind(']') + 1
-            if start_arr != -1 and end_arr > start_arr:
-                json_str = full_text[start_arr:end_arr]
-                is_array = True
-                print(f"[TRACE] Found JSON array: {len(json_str)} chars")
-            else:
-                print("[TRACE] No JSON found")
-                return {}
-
-        # === B2: Fix content bị cắt ===
-        fixed = ""
-        i = 0
-        in_content = False
-
-        while i < len(json_str):
-            if not in_content and json_str[i:i+10] == '"content":':
-                in_content = True
-                fixed += json_str[i:i+10]
-                i += 10
-                quote = json_str.find('"', i)
-                if quote == -1:
-                    fixed += ' ""'
-                    break
-                fixed += json_str[i:quote+1]
-                i = quote + 1
-                continue
-
-            if in_content and json_str[i] == '"' and json_str[i-1] != '\\':
-                next_part = json_str[i+1:i+5]
-                if any(x in next_part for x in [',', '}', '\n', '\r']):
-                    in_content = False
-            fixed += json_str[i]
-            i += 1
-
-        if in_content:
-            fixed += '"INCOMPLETE"'
-
-        json_str = fixed
-
-        # === B3: Dọn phẩy thừa + đóng ngoặc ===
-        json_str = re.sub(r',\s*([\]}])', r'\1', json_str)
-        json_str = re.sub(r',\s*$', '', json_str)
-
-        open_b = json_str.count('{')
-        close_b = json_str.count('}')
-        open_br = json_str.count('[')
-        close_br = json_str.count(']')
-
-        while open_b > close_b:
-            json_str += '}'
-            close_b += 1
-        while open_br > close_br:
-            json_str += ']'
-            close_br += 1
-
-        print(f"[TRACE] Final JSON: {json_str}")
-
-        # === B4: Parse ===
-        try:
-            data = json.loads(json_str)
-            return data
-        except json.JSONDecodeError as e:
-            print(f"[TRACE] JSON Error: {e}")
-            print(f"[TRACE] JSON string:\n{json_str[:600]}")
-            return {}  # Luôn trả object nếu là object
-
+        full_output = rate_limiter.call(read_stream)
+        meter.add_call(question, full_output)
+        return full_output
     except Exception as e:
-        print(f"[TRACE] Exception: {e}")
-        return {}
-    finally:
-        print("=== [TRACE] END extract_json_from_text ===")
\ No newline at end of file
+        logger.error(f"Agent invoke error: {str(e)}")
+        return ""
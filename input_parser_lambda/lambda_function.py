@@ -2,17 +2,32 @@
 # input-parser-light.py — HỖ TRỢ 2 TYPE
 # ========================================
 import os
+import io
 import json
 import time
+import uuid
 import logging
 import boto3
 import re
 from botocore.config import Config
-
+from plan_log_parser import parse_plan_log
+from drift_common.agent_cache import KB_FINGERPRINT_KEY, build_agent_cache
+from drift_common.json_repair import extract_json_from_text, is_complete_json
+from drift_common.rate_limiter import build_rate_limiter
+from drift_common.address_set import AddressSet
+from drift_common.incremental import build_scan_cache, plan_scan_cache
+from drift_common.kb_source import iter_kb_documents, load_kb_documents
+from drift_common.resource_matcher import match_resources
+from drift_common.resource_types import render_type_mapping
+from drift_common.scan_fingerprint import ScanFingerprinter
+from drift_common.scan_metrics import StageMeter, attach_scan_metrics
+from drift_common.short_circuit import cicd_drift_is_clean
+
+# Throttling do rate_limiter xử lý (dùng chung mọi stage); botocore chỉ retry lỗi kết nối/5xx
 config = Config(
     retries={
-        'max_attempts': 10,  # Default is 3
-        'mode': 'adaptive'
+        'max_attempts': 3,
+        'mode': 'standard'
     }
 )
 
@@ -27,34 +42,162 @@ def log_info(obj):
 REGION = os.environ.get("AWS_REGION", "us-east-1")
 AGENT_ID = os.environ.get("AGENT_ID", "LBQSCKGFJM")
 AGENT_ALIAS_ID = os.environ.get("AGENT_ALIAS_ID", "DTC1TK3HZA")
+# Parse Terraform log tại chỗ, chỉ gọi agent cho resource không tự resolve được
+LOCAL_PLAN_PARSER = os.environ.get("LOCAL_PLAN_PARSER", "true").lower() == "true"
+# Bucket nguồn của KB: có → ghép IaC ↔ AWS State tại chỗ 1 lần cho cả 7 detector, không cần agent
+KB_BUCKET = os.environ.get("KB_BUCKET", "")
+# Unmanaged (cicd_log) = resource được refresh nhưng không có trong iac_config/ của KB; quá ngưỡng → chỉ dùng Bloom filter
+# (bộ nhớ cố định; ~UNMANAGED_BLOOM_ERROR_RATE resource unmanaged có thể bị bỏ sót, không báo nhầm)
+UNMANAGED_EXACT_LIMIT = int(os.environ.get("UNMANAGED_EXACT_LIMIT", "1000000"))
+UNMANAGED_BLOOM_ERROR_RATE = float(os.environ.get("UNMANAGED_BLOOM_ERROR_RATE", "0.001"))
+# Có SCAN_CACHE_BUCKET → detector chỉ phân tích resource đổi từ lần scan trước; full định kỳ / khi đổi quá nhiều
+INCREMENTAL_FULL_EVERY = int(os.environ.get("INCREMENTAL_FULL_EVERY", "7"))
+INCREMENTAL_MAX_CHANGED_RATIO = float(os.environ.get("INCREMENTAL_MAX_CHANGED_RATIO", "0.5"))
 bedrock = boto3.client("bedrock-agent-runtime", region_name=REGION, config=config)
+s3 = boto3.client("s3", region_name=REGION)
+# Cache theo prompt hash, sống qua các lần invoke warm (cấu hình qua env AGENT_CACHE_*)
+agent_cache = build_agent_cache()
+# Token bucket + AIMD dùng chung mọi stage (cấu hình qua env RATE_LIMIT_*)
+rate_limiter = build_rate_limiter()
+# Thời gian / token của stage, chuyển theo output tới report (scan scheduler dự đoán chi phí repo)
+meter = StageMeter()
 
 # ========================================
 def lambda_handler(event, context):
     start_time = time.time()
+    meter.reset()
+    agent_cache.set_kb_fingerprint(None)
     query = event.get("query", "").strip()
     query_type = event.get("type", "full_scan")
 
     log_info({"step": "start", "type": query_type, "query_length": len(query)})
 
     if query_type == "cicd_log":
-        result = parse_cicd_log(query)
+        # Log lớn (tới ~100 MB) được đọc stream từ S3 thay vì nhét vào event
+        log_s3_uri = event.get("log_s3_uri")
+        if log_s3_uri:
+            result = parse_cicd_log(query, lines=iter_s3_lines(log_s3_uri))
+        else:
+            result = parse_cicd_log(query)
     elif query_type == "full_scan":
         repo_url = extract_repo_url(query)
         if not repo_url:
             return {"error": "No repo_url found", "type": query_type}
+        kb_fingerprint = compute_kb_fingerprint(repo_url)
+        agent_cache.set_kb_fingerprint(kb_fingerprint)
         result = retrieve_iac_and_state(repo_url)
+        if kb_fingerprint:
+            # Các stage sau cache prompt tra KB theo fingerprint này (KB đổi → key đổi)
+            result[KB_FINGERPRINT_KEY] = kb_fingerprint
     else:
         return {"error": "Invalid type", "type": query_type}
 
     result["type"] = query_type
     result["latency_sec"] = round(time.time() - start_time, 3)
     log_info({"step": "completed", "result": result})
-    return result
+    return attach_scan_metrics(result, event, "parser", meter, resources=count_resources(result))
+
+
+def compute_kb_fingerprint(repo_url: str):
+    """Fingerprint nội dung KB của repo (listing S3 iac_config + aws_state); None → prompt tra KB không được cache."""
+    if not KB_BUCKET:
+        return None
+    return ScanFingerprinter(s3, KB_BUCKET, "us-east-1")(repo_url)
+
+
+def count_resources(result: dict):
+    cicd_drift = result.get("cicd_drift") if isinstance(result.get("cicd_drift"), dict) else {}
+    return len(result.get("iac_resources") or []) + len(result.get("aws_state_resources") or []) + \
+        len(cicd_drift.get("drifted") or []) + len(cicd_drift.get("unmanaged") or [])
 
 
 # ========================================
-def parse_cicd_log(log_text: str):
+def parse_cicd_log(log_text: str, lines=None):
+    if not LOCAL_PLAN_PARSER:
+        return parse_cicd_log_with_agent(log_text)
+
+    parsed = parse_plan_log(lines if lines is not None else io.StringIO(log_text), load_iac_addresses())
+    log_info({"step": "local_plan_parser", "recognized": parsed["recognized"],
+              "summary": parsed["summary"], "unresolved": len(parsed["unresolved"])})
+
+    if not parsed["recognized"]:
+        if lines is not None:
+            # Log từ S3 quá lớn để gửi cho agent
+            return {"cicd_drift": parsed["cicd_drift"], "summary": "Log not recognized as Terraform output"}
+        return parse_cicd_log_with_agent(log_text)
+
+    if parsed["unresolved"]:
+        resolve_identifiers_with_agent(parsed)
+
+    # clean → các stage sau được bỏ qua theo SHORT_CIRCUIT (chỉ tin kết quả của parser local)
+    return {"cicd_drift": parsed["cicd_drift"], "summary": parsed["summary"],
+            "clean": cicd_drift_is_clean(parsed["cicd_drift"])}
+
+
+# ========================================
+def load_iac_addresses():
+    """Mọi resource_address trong iac_config/ của KB (stream từng object); None nếu không cấu hình / lỗi."""
+    if not KB_BUCKET:
+        return None
+    addresses = AddressSet(UNMANAGED_EXACT_LIMIT, error_rate=UNMANAGED_BLOOM_ERROR_RATE)
+    try:
+        for doc in iter_kb_documents(s3, KB_BUCKET, "iac_config/"):
+            if doc.get("resource_address"):
+                addresses.add(doc["resource_address"])
+    except Exception as e:
+        log_info({"step": "iac_addresses", "error": str(e)})
+        return None
+    log_info({"step": "iac_addresses", "count": len(addresses), "bloom": addresses.bloom_enabled,
+              "false_positive_rate": round(addresses.estimated_error_rate, 6)})
+    return addresses if len(addresses) else None
+
+
+# ========================================
+def iter_s3_lines(s3_uri: str):
+    bucket, _, key = s3_uri.replace("s3://", "", 1).partition("/")
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    return body.iter_lines()
+
+
+# ========================================
+def resolve_identifiers_with_agent(parsed: dict):
+    """Chỉ hỏi agent AWS identifier của các resource parser không map được."""
+    region = "us-east-1"
+    prompt = f"""
+TASK:
+Resolve the AWS identifier of each Terraform resource below using the Knowledge Base.
+
+AWS State (aws_state/{region}/)
+Format: {{"id": "AWS__EC2__Instance_i-123", "metadata": {{"resourceType": "AWS::EC2::Instance", "resourceId": "i-123", "resourceName": "web", "status": "ResourceDiscovered"}}}}
+Search: Use query "metadata.resourceType AWS resourceId"
+Identifier: the "id" field of the matching AWS state document.
+
+Resources (resource_address + Terraform id if known):
+{json.dumps(parsed["unresolved"], ensure_ascii=False)}
+
+OUTPUT (mandatory JSON only):
+{{
+"resolved": [{{"resource_address": "...", "aws_identifier": "AWS__EC2__Instance_i-123"}}]
+}}
+
+STRICT RULES:
+- Never ask clarification
+- Never include explanations outside JSON
+- Use null for aws_identifier if not found in the KB
+"""
+    answer = agent_query(prompt)
+    resolved = {
+        item.get("resource_address"): item.get("aws_identifier")
+        for item in ((answer.get("resolved") or []) if isinstance(answer, dict) else [])
+        if isinstance(item, dict)
+    }
+    for entry in parsed["cicd_drift"]["drifted"]:
+        if entry["aws_identifier"] is None and resolved.get(entry["resource_address"]):
+            entry["aws_identifier"] = resolved[entry["resource_address"]]
+
+
+# ========================================
+def parse_cicd_log_with_agent(log_text: str):
     region= "us-east-1"
     prompt = f"""
 SYSTEM INSTRUCTION:
@@ -156,6 +299,10 @@ STRICT INSTRUCTION:
 def retrieve_iac_and_state(repo_url: str):
     repo_prefix = repo_url.split("/")[-1]
     region = "us-east-1"
+    if KB_BUCKET:
+        paired = match_iac_and_state(repo_prefix, region)
+        if paired is not None:
+            return paired
     prompt = f"""
 TASK:
 Compare IaC and AWS State resources for repository: {repo_url}, 
@@ -174,11 +321,7 @@ Extract: Construct identifier from metadata.resourceType + (metadata.resourceNam
 Filter: Exclude where metadata.status = "ResourceDeleted"
 
 RESOURCE TYPE MAPPING:
-- aws_instance ↔ AWS::EC2::Instance
-- aws_s3_bucket ↔ AWS::S3::Bucket
-- aws_security_group ↔ AWS::EC2::SecurityGroup
-- aws_db_instance ↔ AWS::RDS::DBInstance
-- aws_vpc ↔ AWS::EC2::VPC
+{render_type_mapping()}
 
 SEARCH RULES:
 1. Maximum 3 KB searches per request
@@ -207,6 +350,43 @@ STRICT RULES:
     return agent_query(prompt)
 
 
+# ========================================
+def match_iac_and_state(repo_prefix: str, region: str):
+    """Cùng output với retrieve_iac_and_state + bảng ghép resource_pairs / unmatched_*; None → dùng agent."""
+    try:
+        iac_docs = load_kb_documents(s3, KB_BUCKET, f"iac_config/{repo_prefix}/")
+        state_docs = load_kb_documents(s3, KB_BUCKET, f"aws_state/{region}/")
+        if not iac_docs or not state_docs:
+            return None
+        match = match_resources(iac_docs, state_docs)
+        table = match.pairing_table()
+    except Exception as e:
+        # Load / ghép lỗi → retrieve_iac_and_state hỏi agent như cũ
+        log_info({"step": "resource_matcher", "error": str(e)})
+        return None
+    log_info({"step": "resource_matcher", "pairs": len(match.pairs),
+              "unmatched_iac": len(match.unmatched_iac), "unmatched_state": len(match.unmatched_state)})
+    result = {
+        "repo_url": repo_prefix,
+        "iac_resources": [doc.get("resource_address", "") for doc in iac_docs],
+        "aws_state_resources": [pair[1] for pair in table["resource_pairs"]] + table["unmatched_state"],
+        "total_iac": len(iac_docs),
+        "total_state": match.active_state,
+        **table,
+        "summary": f"{len(iac_docs)} IaC, {match.active_state} AWS. {len(match.pairs)} common.",
+    }
+    cache = build_scan_cache(s3, repo_prefix)
+    if cache is not None:
+        try:
+            # Fingerprint từng resource so với baseline của lần scan trước → delta cho detector
+            result["scan_cache"] = plan_scan_cache(cache, match, uuid.uuid4().hex[:12], INCREMENTAL_FULL_EVERY,
+                                                   INCREMENTAL_MAX_CHANGED_RATIO)
+        except Exception as e:
+            # Cache lỗi → detector chạy full như cũ
+            log_info({"step": "scan_cache", "error": str(e)})
+    return result
+
+
 # ========================================
 def extract_repo_url(text: str):
     m = re.search(r"https?://github\.com/[a-zA-Z0-9_\-]+/[a-zA-Z0-9_\-]+", text)
@@ -218,22 +398,11 @@ def agent_query(prompt: str):
     print("Invoking Bedrock Agent...")
     log_info(prompt)
     try:
-        response = bedrock.invoke_agent(
-            agentId=AGENT_ID,
-            agentAliasId=AGENT_ALIAS_ID,
-            sessionId=f"parser-{int(time.time())}",
-            inputText=prompt
+        full_output = agent_cache.get_or_call(
+            prompt, AGENT_ID, AGENT_ALIAS_ID,
+            lambda: agent_query_raw(prompt),
+            cacheable=is_complete_json
         )
-        
-        full_output = ""
-        seen = set()
-        for event in response.get("completion", []):
-            if "chunk" in event:
-                chunk = event["chunk"]["bytes"].decode("utf-8")
-                h = hash(chunk)
-                if h not in seen:
-                    seen.add(h)
-                    full_output += chunk
         print("=== [TRACE] Full output ===", full_output)
         return extract_json_from_text(full_output)
         
@@ -242,97 +411,27 @@ def agent_query(prompt: str):
         return {"error": "Agent failed: "+ str(e)}
 
 
-# ========================================
-def extract_json_from_text(full_text: str):
-    try:
-        print("=== [TRACE] START extract_json_from_text ===", full_text)
-        full_text = full_text.strip()
-        print(f"[TRACE] Raw length: {len(full_text)}")
-
-        # === B1: ƯU TIÊN TÌM JSON OBJECT { ... } ===
-        start_obj = full_text.find('{')
-        end_obj = full_text.rfind('}') + 1
-
-        if start_obj != -1 and end_obj > start_obj:
-            json_str = full_text[start_obj:end_obj]
-            is_array = False
-            print(f"[TRACE] Found JSON object: {len(json_str)} chars")
-        else:
-            # Nếu không có object, thử array
-            start_arr = full_text.find('[')
-            end_arr = full_text.rfind(']') + 1
-            if start_arr != -1 and end_arr > start_arr:
-                json_str = full_text[start_arr:end_arr]
-                is_array = True
-                print(f"[TRACE] Found JSON array: {len(json_str)} chars")
-            else:
-                print("[TRACE] No JSON found")
-                return {}
-
-        # === B2: Fix content bị cắt ===
-        fixed = ""
-        i = 0
-        in_content = False
-
-        while i < len(json_str):
-            if not in_content and json_str[i:i+10] == '"content":':
-                in_content = True
-                fixed += json_str[i:i+10]
-                i += 10
-                quote = json_str.find('"', i)
-                if quote == -1:
-                    fixed += ' ""'
-                    break
-                fixed += json_str[i:quote+1]
-                i = quote + 1
-                continue
-
-            if in_content and json_str[i] == '"' and json_str[i-1] != '\\':
-                next_part = json_str[i+1:i+5]
-                if any(x in next_part for x in [',', '}', '\n', '\r']):
-                    in_content = False
-            fixed += json_str[i]
-            i += 1
-
-        if in_content:
-            fixed += '"INCOMPLETE"'
-
-        json_str = fixed
-
-        # === B3: Dọn phẩy thừa + đóng ngoặc ===
-        json_str = re.sub(r',\s*([\]}])', r'\1', json_str)
-        json_str = re.sub(r',\s*$', '', json_str)
-
-        open_b = json_str.count('{')
-        close_b = json_str.count('}')
-        open_br = json_str.count('[')
-        close_br = json_str.count(']')
-
-        while open_b > close_b:
-            json_str += '}'
-            close_b += 1
-        while open_br > close_br:
-            json_str += ']'
-            close_br += 1
-
-        print(f"[TRACE] Final JSON: {json_str}")
-
-        # === B4: Parse ===
-        try:
-            data = json.loads(json_str)
-            if is_array:
-                print(f"[TRACE] Parsed array: {len(data)} items")
-                return data
-            else:
-                print(f"[TRACE] Parsed object: {list(data.keys())}")
-                return data
-        except json.JSONDecodeError as e:
-            print(f"[TRACE] JSON Error: {e}")
-            print(f"[TRACE] JSON string:\n{json_str[:600]}")
-            return {}  # Luôn trả object nếu là object
-
-    except Exception as e:
-        print(f"[TRACE] Exception: {e}")
-        return {}
-    finally:
-        print("=== [TRACE] END extract_json_from_text ===")
\ No newline at end of file
+def agent_query_raw(prompt: str):
+    full_output = rate_limiter.call(lambda: read_agent_stream(prompt))
+    meter.add_call(prompt, full_output)
+    return full_output
+
+
+def read_agent_stream(prompt: str):
+    response = bedrock.invoke_agent(
+        agentId=AGENT_ID,
+        agentAliasId=AGENT_ALIAS_ID,
+        sessionId=f"parser-{int(time.time())}",
+        inputText=prompt
+    )
+
+    full_output = ""
+    seen = set()
+    for event in response.get("completion", []):
+        if "chunk" in event:
+            chunk = event["chunk"]["bytes"].decode("utf-8")
+            h = hash(chunk)
+            if h not in seen:
+                seen.add(h)
+                full_output += chunk
+    return full_output
@@ -0,0 +1,214 @@
+# ========================================
+# plan_log_parser.py — PARSE TERRAFORM CICD LOG TẠI CHỖ (KHÔNG CẦN AGENT)
+# ========================================
+# Đọc log từng dòng (state machine), không giữ toàn bộ log trong bộ nhớ:
+#   - "<addr>: Refreshing state... [id=...]"       → total_refreshed + AWS id
+#   - "# <addr> will be updated in-place / created / destroyed / must be replaced"
+#   - "# <addr> has changed / has been deleted"     → drift ngoài Terraform
+#   - "(because <addr> is not in configuration)"   → unmanaged
+#   - có tập địa chỉ IaC (AddressSet) → resource được refresh mà không có trong IaC cũng là unmanaged
+import re
+
+from drift_common.resource_types import TF_TO_AWS_TYPE
+
+MAX_DETAIL_LINES = 5
+MAX_DETAIL_CHARS = 300
+
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+# Prefix timestamp của CI runner (GitHub Actions, GitLab, ...)
+TIMESTAMP_RE = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?Z?\s+")
+REFRESH_RE = re.compile(r"^(?P<addr>[\w\-.\[\]\"]+): Refreshing state\.\.\.(?:\s*\[id=(?P<id>[^\]]+)\])?")
+HEADER_RE = re.compile(
+    r"^# (?P<addr>[\w\-.\[\]\"]+) (?P<verb>will be updated in-place|will be created|will be destroyed"
+    r"|must be replaced|will be replaced|has changed|has been deleted|will be read during apply)"
+)
+NOT_IN_CONFIG_RE = re.compile(r"^# \(because (?P<addr>[\w\-.\[\]\"]+) is not in configuration\)")
+BLOCK_START_RE = re.compile(r"^(?P<symbol>-/\+|\+/-|<=|[~+\-]) (?:resource|data) \"")
+ATTR_CHANGE_RE = re.compile(r"^(?P<symbol>[~+\-]) (?P<body>\w[\w\-]* .*)$")
+PLAN_SUMMARY_RE = re.compile(r"^Plan: (?P<add>\d+) to add, (?P<change>\d+) to change, (?P<destroy>\d+) to destroy")
+NO_CHANGES_RE = re.compile(r"^No changes\.")
+
+SYMBOL_TO_CHANGE_TYPE = {
+    "~": "update_in_place",
+    "+": "add",
+    "-": "destroy",
+    "-/+": "replace",
+    "+/-": "replace",
+}
+VERB_TO_SYMBOL = {
+    "will be updated in-place": "~",
+    "will be created": "+",
+    "will be destroyed": "-",
+    "must be replaced": "-/+",
+    "will be replaced": "-/+",
+    "has changed": "~",
+    "has been deleted": "-",
+}
+OUTSIDE_TERRAFORM_VERBS = ("has changed", "has been deleted")
+
+
+def resource_type_of(address: str):
+    """`module.sg.aws_security_group.app[0]` → `aws_security_group` (None cho data source)."""
+    parts = re.sub(r"\[[^\]]*\]", "", address).split(".")
+    if "data" in parts:
+        return None
+    for i in range(len(parts) - 1):
+        if parts[i] == "module":
+            continue
+        if i > 0 and parts[i - 1] == "module":
+            continue
+        if parts[i] == "resource":
+            continue
+        return parts[i]
+    return None
+
+
+def build_aws_identifier(address: str, aws_id: str):
+    """Giống identifier trong KB: AWS__EC2__SecurityGroup_sg-123. None nếu không map được."""
+    aws_type = TF_TO_AWS_TYPE.get(resource_type_of(address) or "")
+    if not aws_type or not aws_id:
+        return None
+    return f"{aws_type.replace('::', '__')}_{aws_id}"
+
+
+class PlanLogParser:
+    def __init__(self):
+        self.refreshed = {}          # address -> AWS id
+        self.drifted = {}            # address -> entry (giữ thứ tự xuất hiện)
+        self.not_in_config = []
+        self.plan_summary = None
+        self.recognized = False      # có thấy dấu hiệu của Terraform log không
+        self._current = None         # entry đang đọc block thay đổi
+        self._outside = False
+        self._details = []
+
+    # === STATE MACHINE ===
+    def feed_line(self, raw):
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8", errors="replace")
+        line = TIMESTAMP_RE.sub("", ANSI_RE.sub("", raw.rstrip("\r\n"))).strip()
+        if not line:
+            return
+
+        m = REFRESH_RE.match(line)
+        if m:
+            self.recognized = True
+            self._close_block()
+            if not m.group("addr").startswith("data."):
+                self.refreshed[m.group("addr")] = m.group("id")
+            return
+
+        m = HEADER_RE.match(line)
+        if m:
+            self.recognized = True
+            self._close_block()
+            verb = m.group("verb")
+            if verb in VERB_TO_SYMBOL and not m.group("addr").startswith("data."):
+                self._current = self._entry(m.group("addr"), VERB_TO_SYMBOL[verb], verb in OUTSIDE_TERRAFORM_VERBS)
+                self._outside = verb in OUTSIDE_TERRAFORM_VERBS
+            return
+
+        m = NOT_IN_CONFIG_RE.match(line)
+        if m:
+            self.not_in_config.append(m.group("addr"))
+            return
+
+        m = PLAN_SUMMARY_RE.match(line)
+        if m:
+            self.recognized = True
+            self._close_block()
+            self.plan_summary = {k: int(v) for k, v in m.groupdict().items()}
+            return
+
+        if NO_CHANGES_RE.match(line):
+            self.recognized = True
+            self._close_block()
+            return
+
+        if self._current is None:
+            return
+        m = BLOCK_START_RE.match(line)
+        if m:
+            # "-/+ resource ..." chính xác hơn verb của header
+            if m.group("symbol") in SYMBOL_TO_CHANGE_TYPE and not self._outside:
+                self._current["change_type"] = SYMBOL_TO_CHANGE_TYPE[m.group("symbol")]
+            return
+        if len(self._details) < MAX_DETAIL_LINES:
+            m = ATTR_CHANGE_RE.match(line)
+            if m:
+                body = re.sub(r"\s+", " ", m.group("body")).replace(" # forces replacement", " (forces replacement)")
+                self._details.append(f"{m.group('symbol')} {body}")
+
+    def _entry(self, address, symbol, outside):
+        entry = self.drifted.get(address)
+        if entry is None:
+            entry = {
+                "resource_address": address,
+                "aws_identifier": None,
+                "change_type": SYMBOL_TO_CHANGE_TYPE[symbol],
+                "drift_details": "",
+            }
+            self.drifted[address] = entry
+        elif not outside:
+            # Plan action (update/destroy/replace) ưu tiên hơn "has changed"
+            entry["change_type"] = SYMBOL_TO_CHANGE_TYPE[symbol]
+        return entry
+
+    def _close_block(self):
+        if self._current is not None and self._details:
+            prefix = "Changed outside of Terraform: " if self._outside else ""
+            detail = prefix + "; ".join(self._details)
+            existing = self._current["drift_details"]
+            detail = f"{existing} | {detail}" if existing else detail
+            self._current["drift_details"] = detail[:MAX_DETAIL_CHARS]
+        self._current = None
+        self._outside = False
+        self._details = []
+
+    # === KẾT QUẢ ===
+    def result(self, iac_addresses=None):
+        self._close_block()
+        unresolved = []
+        for address, entry in self.drifted.items():
+            aws_id = self.refreshed.get(address)
+            entry["aws_identifier"] = build_aws_identifier(address, aws_id)
+            # Resource sắp tạo mới chưa tồn tại trên AWS → không cần identifier
+            if entry["aws_identifier"] is None and entry["change_type"] != "add":
+                unresolved.append({"resource_address": address, "aws_id": aws_id})
+            if not entry["drift_details"]:
+                entry["drift_details"] = entry["change_type"].replace("_", " ")
+
+        unmanaged_addresses = list(dict.fromkeys(self.not_in_config))
+        if iac_addresses is not None:
+            # Set difference: refreshed − IaC, 1 lần tra O(1) mỗi resource
+            seen = set(unmanaged_addresses)
+            unmanaged_addresses += [a for a in self.refreshed if a not in seen and a not in iac_addresses]
+        unmanaged = []
+        for address in unmanaged_addresses:
+            unmanaged.append({
+                "resource_address": address,
+                "aws_identifier": build_aws_identifier(address, self.refreshed.get(address)),
+                "reason": "Found in AWS but missing in IaC",
+            })
+
+        total = len(self.refreshed)
+        drifted = list(self.drifted.values())
+        return {
+            "cicd_drift": {
+                "total_refreshed": total,
+                "managed_count": total - len(unmanaged),
+                "drifted": drifted,
+                "unmanaged": unmanaged,
+            },
+            "summary": f"{total} refreshed, {len(drifted)} drifted, {len(unmanaged)} unmanaged",
+            "unresolved": unresolved,
+            "recognized": self.recognized,
+        }
+
+
+def parse_plan_log(lines, iac_addresses=None):
+    """lines: iterable of str/bytes (file, StringIO, S3 StreamingBody.iter_lines()); iac_addresses: AddressSet."""
+    parser = PlanLogParser()
+    for line in lines:
+        parser.feed_line(line)
+    return parser.result(iac_addresses)
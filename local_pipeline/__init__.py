@@ -0,0 +1 @@
+# local_pipeline — chạy pipeline DriftReportAgentASL (parser → 7 detector → 2 remediation → report) ngoài AWS
@@ -0,0 +1,32 @@
+# ========================================
+# backends.py — AGENT BACKEND CẮM VÀO CÁC LAMBDA (thay biến global `bedrock`)
+# ========================================
+# Backend chỉ cần method invoke_agent(**kwargs) trả về {"completion": iterable các event
+# {"chunk": {"bytes": b"..."}}} — giống boto3 client "bedrock-agent-runtime".
+import os
+
+from local_pipeline.fake_bedrock import (FakeBedrockAgentRuntime, RecordingAgentBackend, default_responder,
+                                         load_recordings)
+
+
+def bedrock_backend(region: str = None):
+    """Bedrock thật (cần AWS credentials)."""
+    import boto3
+    return boto3.client("bedrock-agent-runtime", region_name=region or os.environ.get("AWS_REGION", "us-east-1"))
+
+
+def fake_backend(recordings_path: str = None, strict_replay: bool = False, responder=default_responder, **options):
+    """Fake Bedrock: replay recordings, prompt chưa ghi → responder (hoặc lỗi nếu strict_replay)."""
+    return FakeBedrockAgentRuntime(
+        recordings=load_recordings(recordings_path),
+        responder=None if strict_replay else responder,
+        **options,
+    )
+
+
+def build_backend(name: str, recordings_path: str = None, **fake_options):
+    if name == "bedrock":
+        return bedrock_backend()
+    if name == "record":
+        return RecordingAgentBackend(bedrock_backend(), recordings_path)
+    return fake_backend(recordings_path, **fake_options)
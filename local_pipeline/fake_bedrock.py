@@ -0,0 +1,165 @@
+# ========================================
+# fake_bedrock.py — STAND-IN CHO boto3 "bedrock-agent-runtime" (invoke_agent) ĐỂ BENCHMARK OFFLINE
+# ========================================
+# - Replay completion đã ghi, key = replay_hash(prompt) (prompt đã che timestamp, không phụ thuộc agent/session)
+# - Cấu hình được: time-to-first-chunk, tốc độ chunk, xác suất throttling, quota req/s, lỗi trước/giữa stream
+# - Seed cố định → chuỗi throttle/lỗi lặp lại được giữa các lần chạy
+# - RecordingAgentBackend bọc Bedrock thật để ghi lại completion cho lần replay sau
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+from drift_common.prompt_hash import normalize_prompt, replay_hash
+
+REQUIRED_PARAMS = ("agentId", "agentAliasId", "sessionId", "inputText")
+
+
+def default_responder(prompt: str):
+    # Output rỗng hợp lệ → mỗi stage đi theo nhánh "không có drift"
+    return json.dumps({"drifted_resources": [], "summary": "local fake agent"})
+
+
+def load_recordings(path: str):
+    """File JSON {hash: {"completion": "...", "prompt_preview": "..."}}; không có file → {}."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_recordings(path: str, recordings: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(recordings, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def client_error(code: str, message: str):
+    return ClientError({"Error": {"Code": code, "Message": message}}, "InvokeAgent")
+
+
+class FakeBedrockAgentRuntime:
+    def __init__(self, recordings: dict = None, responder=default_responder,
+                 time_to_first_chunk: float = 0.0, chunk_size: int = 256, chunks_per_sec: float = None,
+                 throttle_probability: float = 0.0, error_probability: float = 0.0,
+                 stream_error_probability: float = 0.0, quota_rps: float = None, seed: int = None,
+                 sleep=time.sleep):
+        self.recordings = recordings or {}
+        self.responder = responder          # None → prompt chưa ghi sẽ lỗi ResourceNotFound
+        self.time_to_first_chunk = time_to_first_chunk
+        self.chunk_size = chunk_size
+        self.chunks_per_sec = chunks_per_sec
+        self.throttle_probability = throttle_probability
+        self.error_probability = error_probability
+        self.stream_error_probability = stream_error_probability
+        self.quota_rps = quota_rps          # giống quota InvokeAgent: vượt quá số request/giây → throttling
+        self._recent_calls = deque()
+        self.sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "replayed": 0, "generated": 0, "throttled": 0, "errors": 0, "stream_errors": 0}
+
+    def _roll(self, probability):
+        if probability <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < probability
+
+    def _over_quota(self):
+        if not self.quota_rps:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            while self._recent_calls and self._recent_calls[0] <= now - 1.0:
+                self._recent_calls.popleft()
+            if len(self._recent_calls) >= self.quota_rps:
+                return True
+            self._recent_calls.append(now)
+            return False
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def invoke_agent(self, **kwargs):
+        missing = [p for p in REQUIRED_PARAMS if not kwargs.get(p)]
+        if missing:
+            raise client_error("ValidationException", f"Missing required parameters: {missing}")
+        self._count("calls")
+
+        if self._over_quota() or self._roll(self.throttle_probability):
+            self._count("throttled")
+            raise client_error("throttlingException", "Your request rate is too high. Reduce the frequency of requests.")
+        if self._roll(self.error_probability):
+            self._count("errors")
+            raise client_error("internalServerException", "Injected error")
+
+        prompt = kwargs["inputText"]
+        recorded = self.recordings.get(replay_hash(prompt))
+        if recorded is not None:
+            self._count("replayed")
+            text = recorded["completion"]
+        elif self.responder is not None:
+            self._count("generated")
+            text = self.responder(prompt)
+        else:
+            raise client_error("ResourceNotFoundException", f"No recording for prompt {replay_hash(prompt)[:12]}")
+
+        fail_mid_stream = self._roll(self.stream_error_probability)
+        return {
+            "completion": self._stream(text.encode("utf-8"), fail_mid_stream),
+            "contentType": "application/json",
+            "sessionId": kwargs["sessionId"],
+        }
+
+    def _stream(self, data: bytes, fail_mid_stream: bool):
+        # Generator: độ trễ xảy ra khi đọc stream, giống EventStream thật
+        chunks = [data[i:i + self.chunk_size] for i in range(0, len(data), self.chunk_size)] or [b""]
+        interval = 1.0 / self.chunks_per_sec if self.chunks_per_sec else 0.0
+        if self.time_to_first_chunk:
+            self.sleep(self.time_to_first_chunk)
+        for index, chunk in enumerate(chunks):
+            if index and interval:
+                self.sleep(interval)
+            if fail_mid_stream and index == len(chunks) // 2:
+                self._count("stream_errors")
+                raise client_error("internalServerException", "Injected error during response stream")
+            yield {"chunk": {"bytes": chunk}}
+
+
+class RecordingAgentBackend:
+    """Bọc backend thật, ghi completion theo replay_hash vào file để replay offline."""
+
+    def __init__(self, inner, path: str):
+        self.inner = inner
+        self.path = path
+        self.recordings = load_recordings(path)
+        self._lock = threading.Lock()
+
+    def invoke_agent(self, **kwargs):
+        response = self.inner.invoke_agent(**kwargs)
+        return {**response, "completion": self._tee(kwargs["inputText"], response["completion"])}
+
+    def _tee(self, prompt, completion):
+        parts = []
+        try:
+            for event in completion:
+                if "chunk" in event:
+                    parts.append(event["chunk"]["bytes"])
+                yield event
+        finally:
+            # Detector dừng đọc khi JSON đã đủ → vẫn ghi phần đã nhận
+            self._save(prompt, parts)
+
+    def _save(self, prompt, parts):
+        with self._lock:
+            self.recordings[replay_hash(prompt)] = {
+                "completion": b"".join(parts).decode("utf-8", errors="replace"),
+                "prompt_preview": normalize_prompt(prompt)[:200],
+            }
+            save_recordings(self.path, self.recordings)
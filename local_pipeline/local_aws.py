@@ -0,0 +1,162 @@
+# ========================================
+# local_aws.py — STAND-IN CHO CÁC AWS CLIENT MÀ LAMBDA DÙNG (S3, DynamoDB Table, Lambda)
+# ========================================
+import gzip
+import os
+import threading
+import uuid
+
+from botocore.exceptions import ClientError
+
+
+class LocalS3:
+    """put_object/get_object/list_objects_v2/multipart upload trong bộ nhớ, có thể ghi ra thư mục để mở file report."""
+
+    def __init__(self, out_dir: str = None):
+        self.out_dir = out_dir
+        self.objects = {}
+        self.uploads = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        body = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        with self._lock:
+            self.objects[(Bucket, Key)] = {"Body": body, **kwargs}
+        self._write_file(Bucket, Key, body, kwargs.get("ContentEncoding"))
+        return {"ETag": f'"{hash(body) & 0xffffffff:08x}"'}
+
+    def _write_file(self, bucket, key, body, content_encoding=None):
+        if not self.out_dir:
+            return
+        path = os.path.join(self.out_dir, bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Trình duyệt tự giải nén khi S3 trả Content-Encoding: gzip; file local thì ghi bản đã giải nén để mở trực tiếp
+        if content_encoding == "gzip":
+            body = gzip.decompress(body)
+        with open(path, "wb") as f:
+            f.write(body)
+
+    # === Multipart upload (cùng ràng buộc kích thước part như S3) ===
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {"Bucket": Bucket, "Key": Key, "args": kwargs, "parts": {}}
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        body = bytes(Body)
+        etag = f'"{hash(body) & 0xffffffff:08x}"'
+        with self._lock:
+            self.uploads[UploadId]["parts"][PartNumber] = (etag, body)
+        return {"ETag": etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self._lock:
+            upload = self.uploads.pop(UploadId)
+        parts = MultipartUpload["Parts"]
+        for index, part in enumerate(parts):
+            etag, body = upload["parts"][part["PartNumber"]]
+            if etag != part["ETag"]:
+                raise ValueError(f"InvalidPart: ETag mismatch for part {part['PartNumber']}")
+            if index < len(parts) - 1 and len(body) < 5 * 1024 * 1024:
+                raise ValueError(f"EntityTooSmall: part {part['PartNumber']} is {len(body)} bytes")
+        body = b"".join(upload["parts"][p["PartNumber"]][1] for p in parts)
+        with self._lock:
+            self.objects[(Bucket, Key)] = {"Body": body, **upload["args"]}
+        self._write_file(Bucket, Key, body, upload["args"].get("ContentEncoding"))
+        return {"Bucket": Bucket, "Key": Key, "ETag": f'"{hash(body) & 0xffffffff:08x}-{len(parts)}"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            # Giống S3 thật: object không tồn tại → ClientError NoSuchKey
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": f"{Key} does not exist"}}, "GetObject")
+        return {"Body": _Body(obj["Body"]), **{k: v for k, v in obj.items() if k != "Body"}}
+
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        with self._lock:
+            keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {"Contents": [{"Key": k, "Size": len(self.objects[(Bucket, k)]["Body"]),
+                                  "ETag": f'"{hash(self.objects[(Bucket, k)]["Body"]) & 0xffffffff:08x}"'} for k in page],
+                    "KeyCount": len(page), "IsTruncated": start + MaxKeys < len(keys)}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def load_directory(self, Bucket, directory: str):
+        """Nạp mọi file trong thư mục (vd. bản copy của bucket nguồn KB) thành object, key = đường dẫn tương đối."""
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    self.objects[(Bucket, key)] = {"Body": f.read()}
+
+    def save_directory(self, Bucket, directory: str):
+        """Ngược lại của load_directory: ghi mọi object của bucket ra thư mục."""
+        with self._lock:
+            objects = [(k, obj["Body"]) for (b, k), obj in self.objects.items() if b == Bucket]
+        for key, body in objects:
+            path = os.path.join(directory, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(body)
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+    def iter_lines(self):
+        return iter(self._data.splitlines())
+
+
+class LocalTable:
+    """DynamoDB Table tối giản: get_item / put_item / update_item (SET a = :v, ...)."""
+
+    def __init__(self, key_name: str = "repoUrl"):
+        self.key_name = key_name
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def get_item(self, Key, **kwargs):
+        with self._lock:
+            item = self.items.get(Key[self.key_name])
+            return {"Item": dict(item)} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        with self._lock:
+            self.items[Item[self.key_name]] = dict(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, **kwargs):
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            item = self.items.setdefault(Key[self.key_name], dict(Key))
+            assignments = UpdateExpression.strip()[len("SET "):].split(",")
+            for assignment in assignments:
+                name, _, placeholder = assignment.partition("=")
+                item[name.strip()] = values[placeholder.strip()]
+        return {}
+
+
+class LocalLambdaClient:
+    """Ghi lại các lần invoke (vd. ScanNextRepo) thay vì gọi lambda thật."""
+
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"", **kwargs):
+        self.invocations.append({"FunctionName": FunctionName, "InvocationType": InvocationType, "Payload": Payload})
+        return {"StatusCode": 202 if InvocationType == "Event" else 200}
@@ -0,0 +1,288 @@
+# ========================================
+# runner.py — CHẠY STATE MACHINE DriftReportAgentASL TRONG 1 PROCESS
+# ========================================
+# input_parser → (song song) 7 drift_detection_* → (song song) 2 drift_remediation_* → drift-combined-report
+# Mỗi lambda được load từ thư mục của nó; biến global `bedrock` được thay bằng agent backend,
+# các client S3/DynamoDB/Lambda của report được thay bằng stand-in local.
+#
+# Chạy:
+#   python -m local_pipeline.runner --query "scan https://github.com/org/repo"
+#   python -m local_pipeline.runner --type cicd_log --log-file plan.log --backend bedrock
+#   python -m local_pipeline.runner --query "..." --runs 20 --concurrency 4     (load test)
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER_PATH = os.path.join(ROOT, "drift_common_layer", "python")
+if LAYER_PATH not in sys.path:
+    sys.path.insert(0, LAYER_PATH)
+
+from drift_common.agent_cache import AgentResponseCache, MemoryTier, SharedTier  # noqa: E402
+from drift_common.single_flight import SingleFlight  # noqa: E402
+from drift_common.rate_limiter import AdaptiveRateLimiter  # noqa: E402
+from drift_common.kv_store import InMemoryStore  # noqa: E402
+from drift_common.scan_scheduler import InMemoryRepoStore  # noqa: E402
+from drift_common.short_circuit import (  # noqa: E402
+    clean_detection_report, clean_remediation, detections_are_clean, load_short_circuit_policy)
+from local_pipeline.backends import build_backend  # noqa: E402
+from local_pipeline.local_aws import LocalLambdaClient, LocalS3, LocalTable  # noqa: E402
+
+PARSER_DIR = "input_parser_lambda"
+DETECTION_DIRS = {
+    "normal": "drift_detection_normal_lambda",
+    "policy": "drift_detection_policy_lambda",
+    "semantic": "drift_detection_semantic_lambda",
+    "hidden": "drift_detection_hidden_lambda",
+    "cross": "drift_detection_cross_lambda",
+    "behavioral": "drift_detection_behavioral_lambda",
+    "version": "drift_detection_version_lambda",
+}
+REMEDIATION_DIRS = {
+    "update_remediation": "drift_remediation_update_lambda",
+    "remove_remediation": "drift_remediation_remove_lambda",
+}
+REPORT_DIR = "drift-combined-report"
+LOCAL_KB_BUCKET = "local-kb"
+LOCAL_SCAN_CACHE_BUCKET = "local-scan-cache"
+
+
+class LocalContext:
+    """Lambda context tối giản."""
+
+    def __init__(self, function_name: str, timeout_sec: int = 900):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self._deadline = time.time() + timeout_sec
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.time()) * 1000))
+
+
+def load_lambda(dir_name: str):
+    """Import lambda_function.py của 1 thư mục thành module riêng (các lambda đều tên lambda_function)."""
+    lambda_dir = os.path.join(ROOT, dir_name)
+    # Env DETECTION_TYPE/REMEDIATION_TYPE của shell sẽ ghi đè default của từng thư mục
+    saved = {k: os.environ.pop(k) for k in ("DETECTION_TYPE", "REMEDIATION_TYPE", "DETECTION_TYPES") if k in os.environ}
+    sys.path.insert(0, lambda_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            f"lambda_{dir_name.replace('-', '_')}", os.path.join(lambda_dir, "lambda_function.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(lambda_dir)
+        os.environ.update(saved)
+    return module
+
+
+class LocalPipeline:
+    def __init__(self, backend, s3=None, table=None, lambda_client=None, agent_cache=None, rate_limiter=None,
+                 max_workers: int = 7, short_circuit=None, repo_store=None, scan_slots=None):
+        self.backend = backend
+        # Choice state giữa các stage: run sạch → bỏ qua stage (mặc định theo env SHORT_CIRCUIT)
+        self.short_circuit = load_short_circuit_policy() if short_circuit is None else frozenset(short_circuit)
+        # Mặc định tắt cache để benchmark lặp lại được; truyền cache vào để dùng chung giữa các stage
+        self.agent_cache = agent_cache or AgentResponseCache([])
+        # 1 limiter cho mọi stage, giống bảng RATE_LIMIT_TABLE dùng chung trên AWS
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.s3 = s3 or LocalS3()
+        self.table = table or LocalTable()
+        self.lambda_client = lambda_client or LocalLambdaClient()
+        # Lease của scan scheduler (repoSubscriptions); scan_slots None = chỉ đếm lease
+        self.repo_store = repo_store or InMemoryRepoStore()
+        self.scan_slots = scan_slots
+        self.max_workers = max_workers
+
+        self.parser = self._load(PARSER_DIR)
+        self.detectors = {t: self._load(d) for t, d in DETECTION_DIRS.items()}
+        self.remediations = {k: self._load(d) for k, d in REMEDIATION_DIRS.items()}
+        self.report = self._load(REPORT_DIR)
+
+    def _load(self, dir_name):
+        module = load_lambda(dir_name)
+        module.bedrock = self.backend
+        stand_ins = (("s3", self.s3), ("table", self.table), ("lambda_client", self.lambda_client),
+                     ("agent_cache", self.agent_cache), ("rate_limiter", self.rate_limiter),
+                     ("repo_store", self.repo_store), ("scan_slots", self.scan_slots))
+        for name, stand_in in stand_ins:
+            if hasattr(module, name):
+                setattr(module, name, stand_in)
+        return module
+
+    def run(self, query: str, query_type: str = "full_scan", extra_event: dict = None):
+        timings = {}
+        base_event = {"query": query, "type": query_type, **(extra_event or {})}
+
+        # === 1. Input parser ===
+        parsed = self._timed(timings, "parser", self.parser.lambda_handler, base_event, PARSER_DIR)
+        if "error" in parsed:
+            return {"status": "failed", "stage": "parser", "parser": parsed, "timings": timings}
+
+        # === 2. Parallel detection (7 nhánh) ===
+        detection_event = {"query": query, "type": query_type, "parsed": parsed}
+        if "detection" in self.short_circuit and parsed.get("clean"):
+            detections = {t: clean_detection_report(t, query_type) for t in self.detectors}
+            timings["detection"] = 0.0
+        else:
+            detections = self._parallel(timings, "detection", {
+                t: (m.lambda_handler, detection_event, DETECTION_DIRS[t]) for t, m in self.detectors.items()
+            })
+
+        # === 3. Parallel remediation (update_iac / remove_source) ===
+        remediation_event = {"query": query, "type": query_type, "detections": detections}
+        if "remediation" in self.short_circuit and detections_are_clean(detections):
+            remediations = {k: clean_remediation(m.REMEDIATION_TYPE) for k, m in self.remediations.items()}
+            timings["remediation"] = 0.0
+        else:
+            remediations = self._parallel(timings, "remediation", {
+                k: (m.lambda_handler, remediation_event, REMEDIATION_DIRS[k]) for k, m in self.remediations.items()
+            })
+
+        # === 4. Combined report ===
+        report_event = {"query": query, "type": query_type, **remediations}
+        if "lease_id" in base_event:
+            # Input execution đi tới report để trả đúng lease của scan scheduler
+            report_event["lease_id"] = base_event["lease_id"]
+        report_url = self._timed(timings, "report", self.report.lambda_handler, report_event, REPORT_DIR)
+
+        return {
+            "status": "succeeded",
+            "parser": parsed,
+            "detections": detections,
+            "remediations": remediations,
+            "report_url": report_url,
+            "timings": timings,
+        }
+
+    def _timed(self, timings, stage, handler, event, function_name):
+        start = time.perf_counter()
+        try:
+            return handler(event, LocalContext(function_name))
+        finally:
+            timings[stage] = round(time.perf_counter() - start, 3)
+
+    def _parallel(self, timings, stage, branches):
+        # Giống state Parallel: chờ tất cả nhánh, lỗi ở 1 nhánh làm fail cả state
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(branches))) as pool:
+            futures = {
+                key: pool.submit(self._timed, timings, f"{stage}.{key}", handler, event, name)
+                for key, (handler, event, name) in branches.items()
+            }
+            outputs = {key: f.result() for key, f in futures.items()}
+        timings[stage] = round(time.perf_counter() - start, 3)
+        return outputs
+
+
+# ========================================
+def run_one(args_dict):
+    # Chạy trong process riêng: các lambda dùng biến global nên không chạy song song 2 pipeline trong 1 process
+    backend = build_backend(args_dict["backend"], args_dict.get("recordings"), **args_dict.get("fake_options", {}))
+    agent_cache = None
+    if args_dict.get("cache"):
+        shared_store = InMemoryStore()
+        agent_cache = AgentResponseCache([MemoryTier(), SharedTier(shared_store)],
+                                         single_flight=SingleFlight(shared_store))
+    s3 = LocalS3(args_dict["out_dir"])
+    if args_dict.get("kb_dir"):
+        # Detector normal đọc document KB từ bucket này (env đọc lúc import lambda)
+        s3.load_directory(LOCAL_KB_BUCKET, args_dict["kb_dir"])
+        os.environ["KB_BUCKET"] = LOCAL_KB_BUCKET
+    scan_cache_dir = args_dict.get("scan_cache_dir")
+    if scan_cache_dir:
+        # Cache detection tăng dần lưu ra thư mục → lần chạy sau chỉ phân tích resource đổi trong --kb-dir
+        if os.path.isdir(scan_cache_dir):
+            s3.load_directory(LOCAL_SCAN_CACHE_BUCKET, scan_cache_dir)
+        os.environ["SCAN_CACHE_BUCKET"] = LOCAL_SCAN_CACHE_BUCKET
+    if args_dict.get("no_short_circuit"):
+        # Tắt cả Choice state của runner lẫn kiểm tra trong từng lambda
+        os.environ["SHORT_CIRCUIT"] = "off"
+    pipeline = LocalPipeline(backend, s3=s3, agent_cache=agent_cache)
+    if not args_dict.get("quiet"):
+        result = pipeline.run(args_dict["query"], args_dict["type"], args_dict.get("extra_event"))
+    else:
+        # Các lambda print rất nhiều trace → tắt khi load test
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = pipeline.run(args_dict["query"], args_dict["type"], args_dict.get("extra_event"))
+    if scan_cache_dir:
+        s3.save_directory(LOCAL_SCAN_CACHE_BUCKET, scan_cache_dir)
+    return result
+
+
+def summarize(results):
+    stages = sorted({stage for r in results for stage in r["timings"]})
+    print(f"{'stage':<36}{'p50 (s)':>10}{'p95 (s)':>10}{'max (s)':>10}")
+    for stage in stages:
+        values = sorted(r["timings"][stage] for r in results if stage in r["timings"])
+        p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+        print(f"{stage:<36}{statistics.median(values):>10.3f}{p95:>10.3f}{values[-1]:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the drift pipeline locally")
+    parser.add_argument("--query", default="")
+    parser.add_argument("--type", default="full_scan", choices=["full_scan", "cicd_log"])
+    parser.add_argument("--log-file", help="Terraform CICD log (type=cicd_log)")
+    parser.add_argument("--backend", default="fake", choices=["fake", "bedrock", "record"])
+    parser.add_argument("--recordings", help="File JSON completion đã ghi (fake: replay, record: ghi thêm)")
+    parser.add_argument("--strict-replay", action="store_true", help="fake: prompt chưa ghi → lỗi")
+    parser.add_argument("--ttfc", type=float, default=0.0, help="fake: time-to-first-chunk (s)")
+    parser.add_argument("--chunk-rate", type=float, default=None, help="fake: chunk/s (mặc định: không giới hạn)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="fake: bytes/chunk")
+    parser.add_argument("--throttle", type=float, default=0.0, help="fake: xác suất throttlingException")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake: xác suất lỗi trước stream")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="fake: xác suất lỗi giữa stream")
+    parser.add_argument("--quota-rps", type=float, default=None, help="fake: quota request/s, vượt → throttling")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--out-dir", default=None, help="Ghi report HTML ra thư mục này")
+    parser.add_argument("--quiet", action="store_true", help="Ẩn trace print của các lambda")
+    parser.add_argument("--cache", action="store_true", help="Bật agent cache (memory + shared stand-in)")
+    parser.add_argument("--kb-dir", help="Thư mục chứa iac_config/ và aws_state/ (bản copy bucket nguồn KB)")
+    parser.add_argument("--scan-cache-dir",
+                        help="Thư mục lưu cache detection tăng dần giữa các lần chạy (cần --kb-dir)")
+    parser.add_argument("--no-short-circuit", action="store_true", help="Luôn chạy mọi stage kể cả khi run sạch")
+    args = parser.parse_args()
+
+    query = args.query
+    if args.type == "cicd_log" and args.log_file:
+        with open(args.log_file, encoding="utf-8") as f:
+            query = f.read()
+    job = {
+        "backend": args.backend, "recordings": args.recordings,
+        "query": query, "type": args.type, "out_dir": args.out_dir, "quiet": args.quiet,
+        "cache": args.cache, "kb_dir": args.kb_dir, "no_short_circuit": args.no_short_circuit,
+        "scan_cache_dir": args.scan_cache_dir,
+        "fake_options": {
+            "strict_replay": args.strict_replay, "time_to_first_chunk": args.ttfc,
+            "chunks_per_sec": args.chunk_rate, "chunk_size": args.chunk_size,
+            "throttle_probability": args.throttle, "error_probability": args.error_rate,
+            "stream_error_probability": args.stream_error_rate, "quota_rps": args.quota_rps, "seed": args.seed,
+        },
+    }
+
+    start = time.perf_counter()
+    if args.runs == 1 and args.concurrency == 1:
+        results = [run_one(job)]
+    else:
+        with ProcessPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(run_one, [job] * args.runs))
+    elapsed = time.perf_counter() - start
+
+    if args.runs == 1:
+        print(json.dumps(results[0], indent=2, ensure_ascii=False, default=str))
+    summarize(results)
+    print(f"{args.runs} run(s) in {elapsed:.2f}s ({args.runs / elapsed:.2f} pipelines/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# ========================================
+# scan-scheduler.py — CHẠY NHIỀU SCAN REPO SONG SONG (THAY CHUỖI ScanNextRepo TỪNG REPO MỘT)
+# ========================================
+# Event:
+#   {"eventName": "StartScanCycle"}                 : cycle mới (EventBridge nightly) → DONE/FAILED về PENDING rồi fill
+#   {"eventName": "FillScanSlots"} / "ScanNextRepo" : lease repo PENDING (hoặc lease hết hạn) cho tới khi đủ slot
+# Repo có IaC + AWS State không đổi từ lần scan trước → DONE ngay, lastReportUrl vẫn là report hiện hành.
+# Report lambda trả lease khi scan xong rồi gọi lại FillScanSlots; nên có thêm rule EventBridge định kỳ (vd. 15')
+# gọi FillScanSlots để lấy lại slot của scan bị treo.
+import os
+import json
+import re
+import time
+import logging
+import boto3
+from drift_common.scan_fingerprint import build_fingerprinter
+from drift_common.scan_scheduler import DynamoDBRepoStore, build_scan_scheduler, build_slot_store
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# CONFIG
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(os.environ.get("REPO_TABLE", "repoSubscriptions"))
+sf = boto3.client("stepfunctions")
+s3 = boto3.client("s3")
+STEP_FUNCTION_ARN = os.environ.get("STEP_FUNCTION_ARN", "arn:aws:states:us-east-1:933000400558:stateMachine:DriftReportAgentASL")
+
+# Store có thể thay bằng InMemoryRepoStore khi chạy local
+repo_store = DynamoDBRepoStore(table)
+# Slot store (env SCAN_SLOT_TABLE), None = chỉ đếm lease
+scan_slots = build_slot_store()
+# Listing KB (iac_config/ + aws_state/) không đổi so với lần scan trước → dùng lại report cũ (env SCAN_DEDUP, KB_BUCKET)
+fingerprinter = build_fingerprinter(s3)
+
+
+def execution_name(repo_url, lease_id):
+    # Tên execution: tối đa 80 ký tự, chỉ chữ/số/-/_
+    repo = re.sub(r"[^A-Za-z0-9_-]", "-", repo_url.rstrip("/").split("github.com/")[-1])
+    return f"scan-{repo[:60]}-{lease_id[:8]}"
+
+
+def start_scan(repo_url, lease_id):
+    # lease_id đi theo input execution → report lambda trả đúng lease của mình
+    response = sf.start_execution(
+        stateMachineArn=STEP_FUNCTION_ARN,
+        name=execution_name(repo_url, lease_id),
+        input=json.dumps({"query": f"scan {repo_url}", "type": "full_scan", "lease_id": lease_id}),
+    )
+    print(f"🚀 Started scan {repo_url}: {response.get('executionArn')}")
+
+
+def lambda_handler(event, context):
+    event = event or {}
+    event_name = event.get("eventName") or event.get("detail-type") or "FillScanSlots"
+    scheduler = build_scan_scheduler(repo_store, start_scan, slots=scan_slots, fingerprint=fingerprinter)
+    start = time.time()
+    if event_name == "StartScanCycle":
+        result = scheduler.start_cycle()
+    else:
+        result = scheduler.fill()
+    logger.info(f"{event_name}: {result} in {time.time() - start:.2f}s")
+    return {"status": "ok", "eventName": event_name, "concurrency": scheduler.concurrency, **result}